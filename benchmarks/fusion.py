@@ -0,0 +1,81 @@
+"""
+Parity and latency of DeepAtrousGuidedFilter.fuse_for_inference
+
+Run as:
+python -m benchmarks.fusion with xyz_config {other flags}
+
+Folds the model by MACs (default) and with fuse_latency_tradeoff (every pair
+within fuse_max_kernel_size), compares both against the original on a random
+full resolution frame (asserting parity within bench_atol), and reports conv
+MACs next to latency, for the whole model and the full resolution guided map.
+"""
+# Libraries
+from sacred import Experiment
+from copy import deepcopy
+import logging
+
+# Torch Libs
+import torch
+
+# Modules
+from config import initialise
+from models import get_model
+from utils.benchmark import conv_macs, format_table, time_fn
+from utils.train_helper import load_models
+from utils.tupperware import tupperware
+
+ex = Experiment("bench_fusion")
+ex = initialise(ex)
+
+
+@ex.config
+def bench_config():
+    bench_repeats = 5
+    bench_atol = 1e-4
+
+
+@ex.automain
+def main(_run):
+    args = tupperware(_run.config)
+
+    G = get_model.model(args)
+    G, _, _, _, _ = load_models(G, g_optimizer=None, args=args, tag=args.inference_mode)
+    G = G.to(args.device).eval()
+
+    x_hr = torch.rand(1, 3, args.image_height, args.image_width, device=args.device)
+    x_hr = (x_hr - 0.5) * 2
+
+    models = [("original", G)]
+    for name, latency_tradeoff in [("folded (MACs)", False), ("folded (latency)", True)]:
+        G_fused = deepcopy(G)
+        report = G_fused.fuse_for_inference(
+            max_kernel_size=args.fuse_max_kernel_size,
+            latency_tradeoff=latency_tradeoff,
+        )
+        headers = ["Block", "Branch", "Action", "MACs / px", "Folded MACs / px"]
+        logging.info(f"{name}\n" + format_table(headers, report))
+        models.append((name, G_fused))
+
+    rows = []
+    with torch.no_grad():
+        reference = G(x_hr)
+        guided_reference = G.guided_map(x_hr)
+        for name, model in models:
+            error = (model(x_hr) - reference).abs().max().item()
+            guided_error = (model.guided_map(x_hr) - guided_reference).abs().max()
+            assert error < args.bench_atol, f"{name} deviates by {error}"
+
+            rows.append(
+                [
+                    name,
+                    conv_macs(model, x_hr) / 1e9,
+                    time_fn(model, x_hr, repeats=args.bench_repeats),
+                    conv_macs(model.guided_map, x_hr) / 1e9,
+                    time_fn(model.guided_map, x_hr, repeats=args.bench_repeats),
+                    max(error, guided_error.item()),
+                ]
+            )
+
+    headers = ["Model", "DAGF GMACs", "DAGF (ms)", "HR guided map GMACs"]
+    headers += ["HR guided map (ms)", "Max abs error"]
+    logging.info("Fusion\n" + format_table(headers, rows))
@@ -0,0 +1,85 @@
+"""
+Parity of two pass tiled inference (tile_global_statistics) with whole frame
+inference
+
+Run as:
+python -m benchmarks.global_stats with xyz_config {other flags}
+
+Restores a random frame whole, with per tile statistics (tiled_forward) and
+with frame statistics (tiled_forward_global_statistics) for every
+bench_tile_sizes, asserting the latter matches whole frame inference within
+bench_atol. Reports max abs errors and latency.
+"""
+# Libraries
+from sacred import Experiment
+import logging
+
+# Torch Libs
+import torch
+
+# Modules
+from config import initialise
+from models import get_model
+from models.tiling import tiled_forward, tiled_forward_global_statistics
+from utils.benchmark import time_fn, format_table
+from utils.train_helper import load_models
+from utils.tupperware import tupperware
+
+ex = Experiment("bench_global_stats")
+ex = initialise(ex)
+
+
+@ex.config
+def bench_config():
+    bench_repeats = 3
+    bench_tile_sizes = [256, 512]
+    bench_atol = 1e-4
+
+
+@ex.automain
+def main(_run):
+    args = tupperware(_run.config)
+
+    G = get_model.model(args)
+    G, _, _, _, _ = load_models(G, g_optimizer=None, args=args, tag=args.inference_mode)
+    G = G.to(args.device).eval()
+
+    x_hr = torch.rand(1, 3, args.image_height, args.image_width, device=args.device)
+    x_hr = (x_hr - 0.5) * 2
+
+    rows = []
+    with torch.no_grad():
+        reference = G(x_hr)
+        latency = time_fn(G, x_hr, repeats=args.bench_repeats)
+        rows.append(["whole frame", "-", 0.0, latency])
+
+        for tile_size in args.bench_tile_sizes:
+            # "auto" overlap: receptive field capped at a quarter tile (seam error)
+            kwargs = dict(tile_size=tile_size, overlap="auto")
+            output = tiled_forward(G, x_hr, **kwargs)
+            error = (output - reference).abs().max().item()
+            latency = time_fn(
+                tiled_forward, G, x_hr, **kwargs, repeats=args.bench_repeats
+            )
+            rows.append(["tiled, per tile statistics", tile_size, error, latency])
+
+            output = tiled_forward_global_statistics(
+                G, x_hr, tile_size=tile_size, band_rows=args.statistics_band_rows
+            )
+            error = (output - reference).abs().max().item()
+            assert error < args.bench_atol, f"tile {tile_size}: deviates by {error}"
+
+            latency = time_fn(
+                tiled_forward_global_statistics,
+                G,
+                x_hr,
+                tile_size=tile_size,
+                band_rows=args.statistics_band_rows,
+                repeats=args.bench_repeats,
+            )
+            rows.append(["tiled, frame statistics", tile_size, error, latency])
+
+    logging.info(
+        f"Tiled inference @ {tuple(x_hr.shape)}\n"
+        + format_table(["Mode", "Tile", "Max abs error", "Latency (ms)"], rows)
+    )
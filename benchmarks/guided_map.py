@@ -0,0 +1,146 @@
+"""
+Full resolution cost of the guided map variants (models/guided_map.py)
+
+Run as:
+python -m benchmarks.guided_map with xyz_config {other flags}
+
+For every bench_guided_maps and bench_resolutions: parameters, conv GMACs,
+latency and peak memory of the guided map alone at full resolution, then
+latency and peak memory of the whole model per bench_lr_scales (the low
+resolution path options), to pick a variant per deployment tier.
+Variants with a checkpoint in bench_ckpts are also evaluated (PSNR / SSIM) on
+the val set at lr_scale. Every measurement runs in a fresh process: peak memory
+is the increase of ru_maxrss (cuda: max_memory_allocated) over the input.
+"""
+# Libraries
+from sacred import Experiment
+import gc
+import logging
+
+# Torch Libs
+import torch
+
+# Modules
+from config import initialise
+from dataloader import OLEDDataset
+from models import get_model
+from models.guided_map import guided_maps
+from utils.benchmark import (
+    conv_macs,
+    evaluate_psnr_ssim,
+    format_table,
+    peak_rss_mb,
+    run_in_subprocess,
+    time_fn,
+)
+from utils.model_serialization import load_state_dict
+from utils.tupperware import tupperware
+
+ex = Experiment("bench_guided_map")
+ex = initialise(ex)
+
+
+@ex.config
+def bench_config():
+    bench_guided_maps = list(guided_maps)
+    bench_resolutions = [(1024, 2048), (2160, 3840)]
+    bench_lr_scales = [0.5, 0.25]
+    bench_ckpts = {}  # guided_map: checkpoint, for PSNR / SSIM
+    bench_max_images = None  # val images to evaluate on, None: all
+    bench_repeats = 3
+
+
+def _measure(config: "Dict", whole_model: bool, height: int, width: int):
+    """
+    Peak memory (MB) and latency (ms) of the guided map (or the whole model)
+    on a height x width frame, in a fresh process.
+    """
+    args = tupperware(config)
+    G = get_model.model(args).to(args.device).eval()
+    module = G if whole_model else G.guided_map
+
+    x_hr = torch.rand(1, 3, height, width, device=args.device) * 2 - 1
+    cuda = args.device.startswith("cuda")
+
+    gc.collect()
+    if cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        before = torch.cuda.memory_allocated() / 2 ** 20
+    else:
+        before = peak_rss_mb()
+
+    with torch.no_grad():
+        latency = time_fn(module, x_hr, warmup=1, repeats=args.bench_repeats)
+
+    if cuda:
+        after = torch.cuda.max_memory_allocated() / 2 ** 20
+    else:
+        after = peak_rss_mb()
+
+    return after - before, latency
+
+
+@ex.automain
+def main(_run):
+    args = tupperware(_run.config)
+
+    guided_map_rows = []
+    model_rows = []
+    for name in args.bench_guided_maps:
+        config = dict(_run.config, guided_map=name, pruned_arch=None)
+        G = get_model.model(tupperware(config)).eval()
+        params = sum(p.numel() for p in G.guided_map.parameters())
+
+        for height, width in args.bench_resolutions:
+            with torch.no_grad():
+                x_hr = torch.rand(1, 3, height, width) * 2 - 1
+                macs = conv_macs(G.guided_map, x_hr) / 1e9
+
+            memory, latency = run_in_subprocess(_measure, config, False, height, width)
+            guided_map_rows.append(
+                [name, f"{height}x{width}", params, macs, latency, memory]
+            )
+
+            for scale in args.bench_lr_scales:
+                memory, latency = run_in_subprocess(
+                    _measure, dict(config, lr_scale=scale), True, height, width
+                )
+                model_rows.append([name, f"{height}x{width}", scale, latency, memory])
+
+    headers = [
+        "Guided map",
+        "Resolution",
+        "Parameters",
+        "Conv GMACs",
+        "Latency (ms)",
+        "Peak memory (MB)",
+    ]
+    table = format_table(headers, guided_map_rows)
+    logging.info("Guided map, full resolution\n" + table)
+
+    headers = ["Guided map", "Resolution", "lr_scale"] + headers[-2:]
+    logging.info("Whole model\n" + format_table(headers, model_rows))
+
+    if not args.bench_ckpts:
+        return
+
+    dataset = OLEDDataset(args, mode="val", max_len=args.bench_max_images)
+    assert len(dataset), f"No val images in {args.val_source_dir}"
+
+    rows = []
+    for name, ckpt in args.bench_ckpts.items():
+        G = get_model.model(args._replace(guided_map=name, pruned_arch=None))
+        load_state_dict(G, torch.load(ckpt, map_location="cpu")["state_dict"])
+        G = G.to(args.device).eval()
+
+        with torch.no_grad():
+            psnr, ssim_ = evaluate_psnr_ssim(
+                G, dataset, range(len(dataset)), device=args.device
+            )
+        rows.append([name, psnr, ssim_])
+
+    logging.info(
+        f"Quality at lr_scale={args.lr_scale}\n"
+        + format_table(["Guided map", "PSNR", "SSIM"], rows)
+    )
@@ -0,0 +1,103 @@
+"""
+Quality / latency of the low resolution stage scale (lr_scale)
+
+Run as:
+python -m benchmarks.lr_scale with xyz_config {other flags}
+
+For every lr_scales: PSNR / SSIM on the val set, latency of the model and of
+LRNet alone on one frame, and LRNet ms per low resolution megapixel (set
+lr_ms_per_megapixel to it for lr_latency_budget).
+Then, for lr_scale=adaptive, the scale picked and latencies at every
+bench_resolutions: LRNet latency stays near constant across input sizes.
+"""
+# Libraries
+from sacred import Experiment
+import logging
+import statistics
+
+# Torch Libs
+import torch
+from torch.nn import functional as F
+
+# Modules
+from config import initialise
+from dataloader import OLEDDataset
+from models import get_model
+from utils.benchmark import evaluate_psnr_ssim, time_fn, format_table
+from utils.ops import unpixel_shuffle
+from utils.train_helper import load_models
+from utils.tupperware import tupperware
+
+ex = Experiment("bench_lr_scale")
+ex = initialise(ex)
+
+
+@ex.config
+def bench_config():
+    bench_repeats = 3
+    bench_max_images = None  # val images to evaluate on, None: all
+    bench_resolutions = [(512, 1024), (1024, 2048), (2160, 3840)]
+
+
+def _lrnet_input(G, x_hr, scale: float):
+    x_lr = F.interpolate(x_hr, scale_factor=scale, mode="bilinear", align_corners=True)
+    return unpixel_shuffle(x_lr, G.pixelshuffle_ratio)
+
+
+@ex.automain
+def main(_run):
+    args = tupperware(_run.config)
+
+    G = get_model.model(args)
+    G, _, _, _, _ = load_models(G, g_optimizer=None, args=args, tag=args.inference_mode)
+    G = G.to(args.device).eval()
+
+    dataset = OLEDDataset(args, mode="val", max_len=args.bench_max_images)
+    assert len(dataset), f"No val images in {args.val_source_dir}"
+    indices = range(len(dataset))
+
+    x_hr = dataset[0][0][None].to(args.device)
+    h, w = x_hr.shape[-2:]
+
+    rows = []
+    ms_per_megapixel = []
+    G.adaptive_lr_scale = False
+    with torch.no_grad():
+        for scale in sorted(G.lr_scales, reverse=True):
+            G.lr_scale = scale
+            psnr, ssim_ = evaluate_psnr_ssim(G, dataset, indices, device=args.device)
+            latency = time_fn(G, x_hr, repeats=args.bench_repeats)
+
+            lr_pixels = int(h * scale) * int(w * scale)
+            lr_latency = time_fn(
+                G.lr, _lrnet_input(G, x_hr, scale), repeats=args.bench_repeats
+            )
+            ms_per_megapixel.append(lr_latency / lr_pixels * 1e6)
+            rows.append(
+                [scale, psnr, ssim_, latency, lr_latency, ms_per_megapixel[-1]]
+            )
+
+    headers = ["Scale", "PSNR", "SSIM", "Latency (ms)", "LRNet (ms)", "LRNet ms / MP"]
+    logging.info(
+        f"lr_scale @ {h}x{w} ({len(dataset)} val images)\n"
+        + format_table(headers, rows)
+        + f"\nlr_ms_per_megapixel={statistics.median(ms_per_megapixel):.3f}"
+    )
+
+    rows = []
+    G.adaptive_lr_scale = True
+    with torch.no_grad():
+        for height, width in args.bench_resolutions:
+            x = (torch.rand(1, 3, height, width, device=args.device) - 0.5) * 2
+            scale = G.lr_scale_for(height, width)
+            lr_latency = time_fn(
+                G.lr, _lrnet_input(G, x, scale), repeats=args.bench_repeats
+            )
+            latency = time_fn(G, x, repeats=args.bench_repeats)
+            rows.append([f"{height}x{width}", scale, lr_latency, latency])
+
+    headers = ["Resolution", "Scale", "LRNet (ms)", "Latency (ms)"]
+    logging.info(
+        f"lr_scale=adaptive, {G.lr_pixel_budget} pixel budget\n"
+        + format_table(headers, rows)
+    )
@@ -0,0 +1,125 @@
+"""
+LRNet forward with preallocated feature buffers (lrnet_arena) against the
+default torch.cat forward
+
+Run as:
+python -m benchmarks.lrnet_arena with xyz_config {other flags}
+
+Checks the arena forward matches the default one, then reports the peak
+memory of one inference call and latency of LRNet at the low resolution size
+of every bench_resolutions (full resolution frames, at lr_scale). Every
+measurement runs in a fresh process: peak memory is the increase of ru_maxrss
+(cuda: max_memory_allocated) over the model and its input.
+"""
+# Libraries
+from sacred import Experiment
+import gc
+import logging
+
+# Torch Libs
+import torch
+
+# Modules
+from config import initialise
+from models import get_model
+from utils.benchmark import format_table, peak_rss_mb, run_in_subprocess, time_fn
+from utils.tupperware import tupperware
+
+ex = Experiment("bench_lrnet_arena")
+ex = initialise(ex)
+
+
+@ex.config
+def bench_config():
+    bench_resolutions = [(1024, 2048), (2160, 3840)]
+    bench_repeats = 5
+    bench_atol = 1e-5
+
+
+def _lrnet(config: "Dict", arena: bool):
+    args = tupperware(config)._replace(lrnet_arena=arena)
+    torch.manual_seed(0)
+    return get_model.model(args).lr.to(args.device).eval()
+
+
+def _lr_input(config: "Dict", height: int, width: int):
+    """
+    LRNet input for a height x width frame: lr_scale, then pixel unshuffled.
+    """
+    ratio = config["pixelshuffle_ratio"]
+    scale = float(config["lr_scale"])
+    h, w = int(height * scale) // ratio, int(width * scale) // ratio
+
+    generator = torch.Generator().manual_seed(0)
+    x = torch.rand(1, 3 * ratio ** 2, h, w, generator=generator) * 2 - 1
+    return x.to(config["device"])
+
+
+def _measure(config: "Dict", arena: bool, height: int, width: int):
+    """
+    Peak memory (MB) of the first call and latency (ms) of LRNet, in a fresh
+    process.
+    """
+    lr = _lrnet(config, arena)
+    x = _lr_input(config, height, width)
+    cuda = config["device"].startswith("cuda")
+
+    gc.collect()
+    if cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        before = torch.cuda.memory_allocated() / 2 ** 20
+    else:
+        before = peak_rss_mb()
+
+    with torch.no_grad():
+        lr(x)
+
+    if cuda:
+        after = torch.cuda.max_memory_allocated() / 2 ** 20
+    else:
+        after = peak_rss_mb()
+
+    with torch.no_grad():
+        latency = time_fn(lr, x, repeats=config["bench_repeats"])
+
+    return after - before, latency
+
+
+@ex.automain
+def main(_run):
+    args = tupperware(_run.config)
+    assert args.lr_scale != "adaptive", "Set a fixed lr_scale"
+    config = dict(_run.config)
+
+    # Parity, twice: the second call reuses the arena
+    lr = _lrnet(config, arena=False)
+    lr_arena = _lrnet(config, arena=True)
+    x = _lr_input(config, 1024, 2048)
+    with torch.no_grad():
+        reference = lr(x)
+        errors = [(lr_arena(x) - reference).abs().max().item() for _ in range(2)]
+    assert max(errors) < args.bench_atol, f"Arena deviates by {max(errors)}"
+    logging.info(f"Arena max abs error {max(errors):.2e}")
+
+    rows = []
+    for height, width in args.bench_resolutions:
+        results = {
+            arena: run_in_subprocess(_measure, config, arena, height, width)
+            for arena in [False, True]
+        }
+        for arena, (memory, latency) in results.items():
+            reduction = 1 - memory / max(results[False][0], 1e-6)
+            rows.append(
+                [
+                    f"{height}x{width}",
+                    "arena" if arena else "torch.cat",
+                    memory,
+                    reduction * 100,
+                    latency,
+                ]
+            )
+
+    headers = ["Resolution", "Forward", "Peak memory (MB)", "Reduction (%)"]
+    headers += ["Latency (ms)"]
+    logging.info(f"LRNet at lr_scale={args.lr_scale}\n" + format_table(headers, rows))
@@ -0,0 +1,98 @@
+"""
+LRNet variants (lrnet_channels, lrnet_blocks_per_stage, lrnet_stages)
+
+Run as:
+python -m benchmarks.lrnet_variants with xyz_config {other flags}
+
+For every bench_variants [channels, blocks per stage, stages, checkpoint]:
+conv GMACs of LRNet and of the whole model, MACs relative to the first
+variant, latency on one image_height x image_width frame, and PSNR / SSIM on
+the val set if a checkpoint is given (eg: a student from train.py with
+distill_teacher_ckpt).
+"""
+# Libraries
+from sacred import Experiment
+import logging
+
+# Torch Libs
+import torch
+
+# Modules
+from config import initialise
+from dataloader import OLEDDataset
+from models import get_model
+from utils.benchmark import conv_macs, evaluate_psnr_ssim, time_fn, format_table
+from utils.model_serialization import load_state_dict
+from utils.ops import unpixel_shuffle
+from utils.tupperware import tupperware
+
+ex = Experiment("bench_lrnet_variants")
+ex = initialise(ex)
+
+
+@ex.config
+def bench_config():
+    bench_repeats = 3
+    bench_max_images = None  # val images to evaluate on, None: all
+
+    # channels, blocks per stage, stages, checkpoint (None: no PSNR / SSIM)
+    bench_variants = [
+        [48, 4, 3, None],
+        [32, 3, 3, None],
+        [24, 2, 3, None],
+    ]
+
+
+@ex.automain
+def main(_run):
+    args = tupperware(_run.config)
+
+    dataset = OLEDDataset(args, mode="val", max_len=args.bench_max_images)
+    x_hr = (torch.rand(1, 3, args.image_height, args.image_width) - 0.5) * 2
+    x_hr = x_hr.to(args.device)
+
+    rows = []
+    for channels, blocks, stages, ckpt in args.bench_variants:
+        variant_args = args._replace(
+            lrnet_channels=channels,
+            lrnet_blocks_per_stage=blocks,
+            lrnet_stages=stages,
+            pruned_arch=None,
+        )
+        G = get_model.model(variant_args)
+        if ckpt:
+            load_state_dict(G, torch.load(ckpt, map_location="cpu")["state_dict"])
+        G = G.to(args.device).eval()
+
+        with torch.no_grad():
+            x_lr, _ = G.forward_lr(x_hr)
+            lr_input = unpixel_shuffle(x_lr, G.pixelshuffle_ratio)
+            lr_macs = conv_macs(G.lr, lr_input) / 1e9
+            macs = conv_macs(G, x_hr) / 1e9
+
+            latency = time_fn(G, x_hr, repeats=args.bench_repeats)
+
+        psnr, ssim_ = "-", "-"
+        if ckpt and len(dataset):
+            psnr, ssim_ = evaluate_psnr_ssim(
+                G, dataset, range(len(dataset)), device=args.device
+            )
+
+        name = f"{channels}x{blocks}x{stages}"
+        rows.append([name, lr_macs, macs, latency, psnr, ssim_])
+
+    for row in rows:
+        row.insert(3, rows[0][2] / row[2])
+
+    headers = [
+        "Variant (C x B x S)",
+        "LRNet GMACs",
+        "GMACs",
+        "MAC reduction",
+        "Latency (ms)",
+        "PSNR",
+        "SSIM",
+    ]
+    logging.info(
+        f"LRNet variants @ {tuple(x_hr.shape)}\n" + format_table(headers, rows)
+    )
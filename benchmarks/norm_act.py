@@ -0,0 +1,93 @@
+"""
+Fused AdaptiveInstanceNorm + LeakyReLU against the unfused modules
+
+Run as:
+python -m benchmarks.norm_act with xyz_config {other flags}
+
+Checks forward and backward parity (inputs, w_0, w_1 and the instance norm
+affine parameters) and reports forward / forward + backward latency at the
+LRNet branch shape.
+"""
+# Libraries
+from sacred import Experiment
+import logging
+
+# Torch Libs
+import torch
+
+# Modules
+from config import initialise
+from models.model_utils import AdaptiveInstanceNorm
+from utils.benchmark import time_fn, format_table
+from utils.tupperware import tupperware
+
+ex = Experiment("bench_norm_act")
+ex = initialise(ex)
+
+
+@ex.config
+def bench_config():
+    bench_repeats = 10
+    bench_channels = 24
+    bench_atol = 1e-4
+
+
+def _step(norm, x, fused: bool):
+    norm.fused = fused
+    y = norm.forward_leaky_relu(x, 0.2)
+    y.backward(torch.ones_like(y))
+    return y
+
+
+@ex.automain
+def main(_run):
+    args = tupperware(_run.config)
+
+    scale = 2 * args.pixelshuffle_ratio
+    shape = (
+        1,
+        args.bench_channels,
+        args.image_height // scale,
+        args.image_width // scale,
+    )
+    x = torch.randn(*shape, device=args.device, requires_grad=True)
+
+    norm = AdaptiveInstanceNorm(args.bench_channels).to(args.device)
+    with torch.no_grad():
+        norm.w_0.fill_(0.7)
+        norm.w_1.fill_(0.4)
+        norm.ins_norm.weight.normal_(1.0, 0.1)
+        norm.ins_norm.bias.normal_(0.0, 0.1)
+
+    # Parity: outputs and all gradients
+    results = {}
+    for fused in [False, True]:
+        x.grad = None
+        norm.zero_grad()
+        y = _step(norm, x, fused)
+        results[fused] = [y.detach(), x.grad.clone()] + [
+            p.grad.clone() for p in norm.parameters()
+        ]
+
+    names = ["output", "x"] + [name for name, _ in norm.named_parameters()]
+    rows = []
+    for name, reference, fused in zip(names, results[False], results[True]):
+        error = (reference - fused).abs().max().item()
+        assert error < args.bench_atol * max(1.0, reference.abs().max().item()), name
+        rows.append([name, error])
+    logging.info("Max abs error\n" + format_table(["Tensor", "Error"], rows))
+
+    rows = []
+    for fused in [False, True]:
+        norm.fused = fused
+        with torch.no_grad():
+            forward = time_fn(
+                norm.forward_leaky_relu, x, 0.2, repeats=args.bench_repeats
+            )
+        train_step = time_fn(_step, norm, x, fused, repeats=args.bench_repeats)
+        rows.append(["fused" if fused else "unfused", forward, train_step])
+
+    logging.info(
+        f"AdaptiveInstanceNorm + LeakyReLU @ {shape}\n"
+        + format_table(["Mode", "Forward (ms)", "Forward + backward (ms)"], rows)
+    )
@@ -0,0 +1,70 @@
+"""
+Reduced precision inference (inference_precision) against fp32
+
+Run as:
+python -m benchmarks.precision with xyz_config {other flags}
+
+Restores the val set in fp32, bf16 and fp16-storage, reporting PSNR / SSIM,
+the PSNR delta against fp32, the max abs deviation from the fp32 output and
+latency on one frame.
+"""
+# Libraries
+from sacred import Experiment
+import logging
+
+# Torch Libs
+import torch
+
+# Modules
+from config import initialise
+from dataloader import OLEDDataset
+from models import get_model
+from models.guided_filter import precisions
+from utils.benchmark import evaluate_psnr_ssim, time_fn, format_table
+from utils.train_helper import load_models
+from utils.tupperware import tupperware
+
+ex = Experiment("bench_precision")
+ex = initialise(ex)
+
+
+@ex.config
+def bench_config():
+    bench_repeats = 3
+    bench_max_images = None  # val images to evaluate on, None: all
+
+
+@ex.automain
+def main(_run):
+    args = tupperware(_run.config)
+
+    G = get_model.model(args)
+    G, _, _, _, _ = load_models(G, g_optimizer=None, args=args, tag=args.inference_mode)
+    G = G.to(args.device).eval()
+
+    dataset = OLEDDataset(args, mode="val", max_len=args.bench_max_images)
+    assert len(dataset), f"No val images in {args.val_source_dir}"
+    indices = range(len(dataset))
+
+    x_hr = dataset[0][0][None].to(args.device)
+
+    rows = []
+    with torch.no_grad():
+        G.set_inference_precision("fp32")
+        reference = G(x_hr)
+
+        for precision in precisions:
+            G.set_inference_precision(precision)
+            psnr, ssim_ = evaluate_psnr_ssim(G, dataset, indices, device=args.device)
+            error = (G(x_hr).float() - reference).abs().max().item()
+            latency = time_fn(G, x_hr, repeats=args.bench_repeats)
+            rows.append([precision, psnr, ssim_, error, latency])
+
+    for row in rows:
+        row.insert(2, row[1] - rows[0][1])
+
+    headers = ["Precision", "PSNR", "PSNR delta", "SSIM", "Max abs err", "Latency (ms)"]
+    logging.info(
+        f"Inference precision ({len(dataset)} val images)\n"
+        + format_table(headers, rows)
+    )
@@ -0,0 +1,74 @@
+"""
+Preview mode (DeepAtrousGuidedFilter.preview) against full inference
+
+Run as:
+python -m benchmarks.preview with xyz_config {other flags}
+
+Reports latency of full resolution inference, and of preview at the low
+resolution size and every bench_preview_sizes, plus the PSNR of each preview
+against the full output downscaled to the same size (area).
+"""
+# Libraries
+from sacred import Experiment
+import logging
+
+# Torch Libs
+import torch
+from torch.nn import functional as F
+
+# Modules
+from config import initialise
+from metrics import PSNR_numpy
+from models import get_model
+from utils.benchmark import time_fn, format_table
+from utils.train_helper import load_models
+from utils.tupperware import tupperware
+
+ex = Experiment("bench_preview")
+ex = initialise(ex)
+
+
+@ex.config
+def bench_config():
+    bench_repeats = 3
+    bench_preview_sizes = [(256, 512), (128, 256)]
+
+
+def _psnr(output, reference) -> float:
+    output = output[0].mul(0.5).add(0.5).permute(1, 2, 0).cpu().numpy()
+    reference = reference[0].mul(0.5).add(0.5).permute(1, 2, 0).cpu().numpy()
+    return PSNR_numpy(reference, output)
+
+
+@ex.automain
+def main(_run):
+    args = tupperware(_run.config)
+
+    G = get_model.model(args)
+    G, _, _, _, _ = load_models(G, g_optimizer=None, args=args, tag=args.inference_mode)
+    G = G.to(args.device).eval()
+
+    h, w = args.image_height, args.image_width
+    x_hr = (torch.rand(1, 3, h, w, device=args.device) - 0.5) * 2
+
+    rows = []
+    with torch.no_grad():
+        full = G(x_hr)
+        latency = time_fn(G, x_hr, repeats=args.bench_repeats)
+        rows.append(["full", f"{h}x{w}", "-", latency])
+
+        for size in [None] + [tuple(size) for size in args.bench_preview_sizes]:
+            preview = G.preview(x_hr, size=size)
+            reference = F.interpolate(full, size=preview.shape[-2:], mode="area")
+            latency = time_fn(G.preview, x_hr, size=size, repeats=args.bench_repeats)
+            rows.append(
+                [
+                    "preview",
+                    "x".join(map(str, preview.shape[-2:])),
+                    _psnr(preview, reference),
+                    latency,
+                ]
+            )
+
+    headers = ["Mode", "Output", "PSNR vs full (dB)", "Latency (ms)"]
+    logging.info(f"Preview @ {h}x{w}\n" + format_table(headers, rows))
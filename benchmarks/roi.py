@@ -0,0 +1,81 @@
+"""
+Receptive field and region of interest restoration (models/roi.py)
+
+Run as:
+python -m benchmarks.roi with xyz_config {other flags}
+
+Logs the receptive field of every atrous branch and of the model, asserts that
+restoring the whole frame as a box matches whole frame inference within
+bench_atol, then for centred square boxes of every bench_roi_sizes reports max
+abs error against the crop of whole frame inference and latency, with the
+exact low resolution halo and with every bench_halos.
+"""
+# Libraries
+from sacred import Experiment
+import logging
+
+# Torch Libs
+import torch
+
+# Modules
+from config import initialise
+from models import get_model
+from models.receptive_field import branch_table, receptive_field
+from models.roi import restore_roi
+from utils.benchmark import time_fn, format_table
+from utils.train_helper import load_models
+from utils.tupperware import tupperware
+
+ex = Experiment("bench_roi")
+ex = initialise(ex)
+
+
+@ex.config
+def bench_config():
+    bench_repeats = 3
+    bench_roi_sizes = [128, 256, 512]
+    bench_halos = [32, 64]
+    bench_atol = 1e-4
+
+
+@ex.automain
+def main(_run):
+    args = tupperware(_run.config)
+
+    G = get_model.model(args)
+    G, _, _, _, _ = load_models(G, g_optimizer=None, args=args, tag=args.inference_mode)
+    G = G.to(args.device).eval()
+
+    field = receptive_field(G)
+    headers = ["Block", "Branch", "ShareSepConv", "Dilation", "Radius"]
+    logging.info(f"{field}\n" + format_table(headers, branch_table(G)))
+
+    h, w = args.image_height, args.image_width
+    x_hr = (torch.rand(1, 3, h, w, device=args.device) - 0.5) * 2
+
+    rows = []
+    with torch.no_grad():
+        reference = G(x_hr)
+        latency = time_fn(G, x_hr, repeats=args.bench_repeats)
+        rows.append(["whole frame", "-", 0.0, latency])
+
+        error = (restore_roi(G, x_hr, (0, 0, w, h)) - reference).abs().max().item()
+        assert error < args.bench_atol, f"Whole frame box deviates by {error}"
+
+        for size in args.bench_roi_sizes:
+            y0, x0 = (h - size) // 2, (w - size) // 2
+            box = (x0, y0, x0 + size, y0 + size)
+            crop = reference[:, :, y0 : y0 + size, x0 : x0 + size]
+
+            for halo in [None] + list(args.bench_halos):
+                output = restore_roi(G, x_hr, box, halo=halo)
+                error = (output - crop).abs().max().item()
+                latency = time_fn(
+                    restore_roi, G, x_hr, box, halo=halo, repeats=args.bench_repeats
+                )
+                rows.append([f"{size}x{size}", halo or field.lr, error, latency])
+
+    logging.info(
+        f"ROI restoration @ {tuple(x_hr.shape)}\n"
+        + format_table(["Box", "LR halo", "Max abs error", "Latency (ms)"], rows)
+    )
@@ -0,0 +1,98 @@
+"""
+Per block benchmark of the ShareSepConv engines (direct, fft, lowrank)
+
+Run as:
+python -m benchmarks.sharesep with xyz_config {other flags}
+
+Loads the checkpoint of the config if present (trained kernels are less
+separable than the delta initialisation), and reports latency and the
+max abs deviation from the direct conv for every smoothing conv of LRNet,
+at the LRNet resolution (image_height / 4 x image_width / 4 by default).
+"""
+# Libraries
+from sacred import Experiment
+import logging
+
+# Torch Libs
+import torch
+
+# Modules
+from config import initialise
+from models import get_model
+from models.lr_net import ShareSepConv
+from utils.benchmark import time_fn, format_table
+from utils.train_helper import load_models
+from utils.tupperware import tupperware
+
+ex = Experiment("bench_sharesep")
+ex = initialise(ex)
+
+
+@ex.config
+def bench_config():
+    bench_repeats = 10
+    bench_atol = 1e-4  # parity tolerance of fft vs direct
+
+
+@ex.automain
+def main(_run):
+    args = tupperware(_run.config)
+    args.sharesep_engine = "direct"
+
+    G = get_model.model(args)
+    G, _, _, _, _ = load_models(G, g_optimizer=None, args=args, tag=args.inference_mode)
+    G = G.to(args.device).eval()
+
+    scale = 2 * args.pixelshuffle_ratio
+    channels = G.lr.conv1.out_channels
+    x = torch.randn(
+        1,
+        channels,
+        args.image_height // scale,
+        args.image_width // scale,
+        device=args.device,
+    )
+
+    rows = []
+    with torch.no_grad():
+        for name, module in G.lr.named_modules():
+            if not isinstance(module, ShareSepConv) or module.kernel_size == 1:
+                continue
+
+            reference = module._forward_direct(x)
+            row = [name, module.kernel_size]
+
+            for engine in ["direct", "fft", "lowrank"]:
+                module.engine = engine
+                row.append(time_fn(module, x, repeats=args.bench_repeats))
+
+            module.engine = "fft"
+            fft_error = (module(x) - reference).abs().max().item()
+            assert fft_error < args.bench_atol, f"{name}: fft error {fft_error}"
+
+            factors = module._lowrank_factors()
+            if factors:
+                module.engine = "lowrank"
+                lowrank_error = (module(x) - reference).abs().max().item()
+                bound = args.sharesep_lowrank_tol * x.abs().max().item()
+                assert lowrank_error <= bound + args.bench_atol, name
+                rank = factors[0].size(0)
+            else:
+                lowrank_error = 0.0
+                rank = "full"
+
+            module.engine = "direct"
+            row += [fft_error, rank, lowrank_error]
+            rows.append(row)
+
+    headers = [
+        "Layer",
+        "Kernel",
+        "Direct (ms)",
+        "FFT (ms)",
+        "Lowrank (ms)",
+        "FFT err",
+        "Rank",
+        "Lowrank err",
+    ]
+    logging.info(f"ShareSepConv @ {tuple(x.shape)}\n" + format_table(headers, rows))
@@ -0,0 +1,143 @@
+"""
+Fused bilinear upsample + affine + tanh (BilinearAffineTanh) of the guided
+filter output against F.interpolate
+
+Run as:
+python -m benchmarks.upsample_apply with xyz_config {other flags}
+
+Checks forward and backward parity, then reports peak memory and latency of
+    unfused: tanh(interpolate(A) * x + interpolate(b))
+    fused: BilinearAffineTanh, whole frame
+    banded: BilinearAffineTanh, bench_band_rows rows per band
+at every bench_resolutions (default 1024 x 2048 and 4K), inference and training
+(forward + backward). Every measurement runs in a fresh process: peak memory is
+the increase of ru_maxrss (cuda: max_memory_allocated) over the inputs.
+"""
+# Libraries
+from sacred import Experiment
+import gc
+import logging
+import time
+
+# Torch Libs
+import torch
+from torch.nn import functional as F
+
+# Modules
+from config import initialise
+from models.model_utils import BilinearAffineTanh
+from utils.benchmark import format_table, peak_rss_mb, run_in_subprocess
+from utils.tupperware import tupperware
+
+ex = Experiment("bench_upsample_apply")
+ex = initialise(ex)
+
+
+@ex.config
+def bench_config():
+    bench_resolutions = [(1024, 2048), (2160, 3840)]
+    bench_band_rows = 128
+    bench_atol = 1e-5
+
+
+def _unfused(A, b, x):
+    h, w = x.shape[-2:]
+    mean_A = F.interpolate(A, (h, w), mode="bilinear", align_corners=True)
+    mean_b = F.interpolate(b, (h, w), mode="bilinear", align_corners=True)
+    return torch.tanh(mean_A * x + mean_b)
+
+
+def _inputs(height: int, width: int, device, requires_grad: bool):
+    """
+    A, b at the guided filter (half) resolution, x at full resolution
+    """
+    generator = torch.Generator().manual_seed(0)
+    A = torch.randn(1, 3, height // 2, width // 2, generator=generator)
+    b = torch.randn(1, 3, height // 2, width // 2, generator=generator)
+    x = torch.rand(1, 3, height, width, generator=generator) * 2 - 1
+    return [t.to(device).requires_grad_(requires_grad) for t in (A, b, x)]
+
+
+def _measure(mode: str, height: int, width: int, band_rows: int, train, device):
+    """
+    Peak memory (MB) and latency (ms) of one call, in a fresh process.
+    """
+    A, b, x = _inputs(height, width, device, requires_grad=train)
+    cuda = device.startswith("cuda")
+
+    gc.collect()
+    if cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        before = torch.cuda.memory_allocated() / 2 ** 20
+    else:
+        before = peak_rss_mb()
+
+    start = time.perf_counter()
+    with torch.set_grad_enabled(train):
+        if mode == "unfused":
+            y = _unfused(A, b, x)
+        else:
+            y = BilinearAffineTanh.apply(A, b, x, band_rows)
+
+        if train:
+            y.backward(torch.ones_like(y))
+
+    if cuda:
+        torch.cuda.synchronize()
+        after = torch.cuda.max_memory_allocated() / 2 ** 20
+    else:
+        after = peak_rss_mb()
+
+    return after - before, (time.perf_counter() - start) * 1e3
+
+
+@ex.automain
+def main(_run):
+    args = tupperware(_run.config)
+
+    # Parity, odd sizes and a partial last band
+    A, b, x = _inputs(250, 514, args.device, requires_grad=True)
+    results = {}
+    for mode in ["unfused", "banded"]:
+        for t in (A, b, x):
+            t.grad = None
+        if mode == "unfused":
+            y = _unfused(A, b, x)
+        else:
+            y = BilinearAffineTanh.apply(A, b, x, 64)
+        y.backward(torch.cos(torch.arange(y.numel(), device=y.device)).view_as(y))
+        results[mode] = [y.detach(), A.grad, b.grad, x.grad]
+
+    rows = []
+    for name, reference, fused in zip(
+        ["output", "A", "b", "x"], results["unfused"], results["banded"]
+    ):
+        error = (reference - fused).abs().max().item()
+        assert error < args.bench_atol * max(1.0, reference.abs().max().item()), name
+        rows.append([name, error])
+    logging.info("Max abs error\n" + format_table(["Tensor", "Error"], rows))
+
+    rows = []
+    for height, width in args.bench_resolutions:
+        for train in [False, True]:
+            for mode, band_rows in [
+                ("unfused", 0),
+                ("fused", 0),
+                ("banded", args.bench_band_rows),
+            ]:
+                memory, latency = run_in_subprocess(
+                    _measure, mode, height, width, band_rows, train, args.device
+                )
+                rows.append(
+                    [
+                        f"{height}x{width}",
+                        "train" if train else "inference",
+                        mode,
+                        memory,
+                        latency,
+                    ]
+                )
+
+    headers = ["Resolution", "Pass", "Mode", "Peak memory (MB)", "Latency (ms)"]
+    logging.info("Upsample + affine + tanh\n" + format_table(headers, rows))
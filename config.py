@@ -33,10 +33,41 @@ def base_config():
 
     batch_size = 1
     num_threads = batch_size  # parallel workers
+    val_num_threads = 0
+    test_num_threads = 0
+
+    # Background prefetch (dataloader.DevicePrefetcher): batches kept decoded
+    # and on device ahead of the train / val / test loops, 0: off
+    train_prefetch = 0
+    val_prefetch = 0
+    test_prefetch = 0
 
     # augment
     do_augment = True
 
+    # Patch training: every decoded train pair yields crops_per_image aligned
+    # random crops of crop_size (h, w), augmented per crop, so train batches
+    # hold batch_size * crops_per_image crops. Sides: multiples of
+    # pixelshuffle_ratio / lr_scale. None: whole frames
+    crop_size = None
+    crops_per_image = 4
+
+    # Progressive resolution curriculum (utils/curriculum.py): crop sizes (h, w)
+    # of the first restart cycles (T_0, T_mult), eg: [[256, 512], [512, 1024]],
+    # then crop_size. crops_per_image grows as crops shrink, keeping the pixels
+    # per step (memory) of the final stage. Time to each of
+    # curriculum_target_psnr (dB) on val is logged
+    curriculum_crop_sizes = []
+    curriculum_target_psnr = []
+
+    # png: decode every sample with cv2, packed: pre-decoded uint8 memory mapped
+    # store next to each source dir (build it with pack_dataset.py)
+    data_backend = "png"
+
+    # uint8: datasets yield uint8 CHW tensors into pinned memory, converted to
+    # float [-1, 1] on the target device (dataloader.to_device)
+    data_uint8 = False
+
     # ---------------------------------------------------------------------------- #
     # Train Configs
     # ---------------------------------------------------------------------------- #
@@ -81,15 +112,126 @@ def base_config():
     inference_mode = "latest"
     assert inference_mode in ["latest", "best"]
 
+    # Tiled inference, see models/tiling.py
+    # Bounds peak memory by the tile size, outputs differ slightly at tile seams
+    tiled_inference = False
+    # Frames within one tile run whole (1024 x 2048 by default), larger ones (eg:
+    # 4K) in 2048 px tiles. The "auto" overlap is the receptive field (~1800 px)
+    # capped at tile_size // 4: beyond it, context is truncated at tile seams
+    # (error reported by benchmarks/global_stats.py). See models/tiling.py
+    tile_size = "auto"  # pixels, "auto": largest tile within tile_pixel_budget
+    tile_overlap = "auto"  # pixels, at most tile_size // 4. "auto": capped receptive field
+    tile_batch_size = 1
+    tile_pixel_budget = 4 * 2 ** 20  # pixels per forward (tile_batch_size tiles)
+
+    # Two pass tiling: frame statistics for AdaptiveInstanceNorm / CALayer and
+    # a whole frame LR stage, matches whole frame inference (no tile_overlap)
+    tile_global_statistics = False
+    statistics_band_rows = 256  # rows per band when collecting statistics
+
+    # Preview: downscaled output from the low resolution stage only, resized to
+    # preview_size (height, width), None: low resolution size
+    # See DeepAtrousGuidedFilter.preview, benchmarks/preview.py
+    preview = False
+    preview_size = None
+
+    # Fold ShareSepConv into the atrous convs after loading, see models/fusion.py
+    fuse_for_inference = False
+    fuse_max_kernel_size = 7  # largest folded kernel (ShareSepConv size + 2 * dilation)
+    # Fold even when the dense kernel takes more MACs than the pair it replaces
+    # (latency only, check benchmarks/fusion.py). Off: fold only if MACs drop
+    fuse_latency_tradeoff = False
+
+    # fp32, bf16 (autocast) or fp16-storage (fp16 activations, fp32 compute)
+    # Guided filter and instance norm statistics stay in fp32
+    # See DeepAtrousGuidedFilter.set_inference_precision, benchmarks/precision.py
+    inference_precision = "fp32"
+
+    # Exported model for inference: eager, script, trace, compile or onnx
+    # Artifacts are cached in export_cache_dir, see models/export.py, export.py
+    inference_backend = "eager"
+    export_cache_dir = Path("exports") / "cache"
+    export_optimize = True  # torch.jit.optimize_for_inference on TorchScript
+    onnx_opset = 17
+    onnx_num_threads = 0  # ONNX Runtime intra op threads, 0: its default
+
+    # int8 LRNet (CPU), checkpoint from quantize.py, see models/quantization.py
+    int8_inference = False
+    quant_backend = "fbgemm"  # x86: fbgemm, ARM: qnnpack
+    quant_calibration_images = 16  # first images of the val set
+    save_filename_int8_G = "model_int8.pth"
+
     # ---------------------------------------------------------------------------- #
     # Model: See models/get_model.py for registry
     # ---------------------------------------------------------------------------- #
     pixelshuffle_ratio = 2
 
-    # Guided map
+    # LRNet: lrnet_stages stages (dilation 1, 2, 4, ...) of lrnet_blocks_per_stage
+    # smooth dilated blocks, lrnet_channels wide (multiple of 8)
+    # Defaults are the published model. See benchmarks/lrnet_variants.py
+    lrnet_channels = 48
+    lrnet_blocks_per_stage = 4
+    lrnet_stages = 3
+
+    # Channel widths of a pruned model (arch.json from prune.py), None: unpruned
+    pruned_arch = None
+
+    # Low resolution stage scale (1 / n): LRNet and the guided filter
+    # coefficients run at lr_scale of the input, the guided filter upsamples back
+    # "adaptive": largest of lr_scales whose low resolution frame fits
+    # lr_pixel_budget pixels, or lr_latency_budget ms of LRNet at
+    # lr_ms_per_megapixel (measured by benchmarks/lr_scale.py), per input
+    lr_scale = 0.5
+    lr_scales = [0.5, 0.25, 0.125]
+    lr_pixel_budget = 512 * 1024
+    lr_latency_budget = 0  # ms, 0: lr_pixel_budget
+    lr_ms_per_megapixel = 0.0
+
+    # Guided map (runs at full resolution): atrous (published), separable,
+    # separable-lite or pointwise. See models/guided_map.py, benchmarks/guided_map.py
+    guided_map = "atrous"
     guided_map_kernel_size = 3
     guided_map_channels = 16
 
+    # Guided filter box filter: conv (learnable 3x3, dilation gf_radius) or
+    # integral ((2 gf_radius + 1)^2 box via running sums, same cost for any radius)
+    # See benchmarks/box_filter.py
+    gf_box_filter = "conv"
+    gf_radius = 1
+
+    # Fused bilinear upsample + affine + tanh of the guided filter output
+    # (train and inference), in bands of gf_band_rows output rows (0: all)
+    # See models/model_utils.py, benchmarks/upsample_apply.py
+    fused_upsample = False
+    gf_band_rows = 0
+
+    # ShareSepConv engine: direct, fft, lowrank or auto (picked by kernel size)
+    # See models/lr_net.py, benchmarks/sharesep.py
+    sharesep_engine = "direct"
+    sharesep_fft_kernel_size = 31
+    sharesep_lowrank_kernel_size = 15
+    sharesep_lowrank_tol = 1e-3  # lowrank output error <= tol * max|input|
+
+    # Dilated 3x3 conv engine of the atrous branches (dilation >=
+    # dilated_conv_min_dilation): direct, space_to_batch (dense 3x3 conv over the
+    # dilation phases) or auto (times both per layer and input shape on first
+    # use, keeps the faster). See models/lr_net.py, benchmarks/dilated_conv.py
+    dilated_conv_engine = "direct"
+    dilated_conv_min_dilation = 4
+
+    # Fused AdaptiveInstanceNorm + LeakyReLU (train and inference)
+    # See models/model_utils.py, benchmarks/norm_act.py
+    fused_norm_act = False
+
+    # Inference: atrous branches written into one buffer instead of torch.cat
+    # See benchmarks/branches.py
+    batched_branches = False
+
+    # Inference: LRNet features written into buffers preallocated per input shape
+    # (no torch.cat, in place activations and gated sum), fp32 only
+    # See models/lr_net.py, benchmarks/lrnet_arena.py
+    lrnet_arena = False
+
     # ---------------------------------------------------------------------------- #
     # Loss
     # ---------------------------------------------------------------------------- #
@@ -99,6 +241,16 @@ def base_config():
     cobi_rgb_patch_size = 8
     cobi_rgb_stride = 8
 
+    # Distillation (train.py) from a frozen teacher checkpoint, None: off
+    # L1 to the teacher output, attention transfer on the LRNet gated features
+    distill_teacher_ckpt = None
+    distill_teacher_channels = 48
+    distill_teacher_blocks_per_stage = 4
+    distill_teacher_stages = 3
+    distill_teacher_guided_map = "atrous"
+    lambda_distill_output = 1.0
+    lambda_distill_features = 0.0
+
     resume = True
     finetune = False  # Wont load loss or epochs
 
@@ -3,8 +3,12 @@ Dataloaders
 """
 
 # Libs
+from contextlib import nullcontext
 from dataclasses import dataclass
+from functools import partial
 import logging
+import queue
+import threading
 from typing import TYPE_CHECKING
 from sacred import Experiment
 
@@ -13,9 +17,12 @@ from torch.utils.data import DataLoader, Dataset
 import torch
 import torch.distributed as dist
 import cv2
+import numpy as np
 from config import initialise
 import random
 
+from utils.packed_store import PackedStore, imread_rgb, store_dir
+
 if TYPE_CHECKING:
     from utils.typing_alias import *
 
@@ -42,7 +49,11 @@ class OLEDDataset(Dataset):
         mode: str = "train",
         max_len: int = None,
         is_local_rank_0: bool = True,
+        uint8: bool = False,
     ):
+        """
+        :param uint8: yield uint8 CHW tensors, see _to_tensor
+        """
         super(OLEDDataset, self).__init__()
 
         assert mode in ["train", "val", "test"]
@@ -62,6 +73,22 @@ class OLEDDataset(Dataset):
             self.target_dir = None
 
         self.max_len = max_len
+        self.uint8 = uint8
+
+        # Patch training, train set only (see _crops)
+        self.crop_size = args.crop_size if mode == "train" else None
+        if self.crop_size:
+            multiple = crop_multiple(args)
+            assert all(
+                side % multiple == 0 for side in self.crop_size
+            ), f"crop_size sides should be multiples of {multiple}"
+
+        # png: decode per sample, packed: memory mapped store (pack_dataset.py)
+        assert args.data_backend in ["png", "packed"]
+        self.store = None
+        if args.data_backend == "packed":
+            self.store = self._open_store()
+
         self.source_paths, self.target_paths = self._load_dataset()
 
         if is_local_rank_0:
@@ -70,8 +97,33 @@ class OLEDDataset(Dataset):
             )
         self.is_local_rank_0 = is_local_rank_0
 
+    def _open_store(self) -> "Optional[PackedStore]":
+        """
+        Packed store of the split, None (an empty dataset) if the split or its
+        store is absent. A store that exists must be complete and non empty.
+        """
+        if not self.source_dir or not self.source_dir.exists():
+            return None
+
+        directory = store_dir(self.source_dir)
+        if not directory.exists():
+            logging.warning(
+                f"No packed store {directory}, {self.mode} set is empty. "
+                "Build it with pack_dataset.py"
+            )
+            return None
+
+        store = PackedStore(directory)
+        assert len(store), f"Empty packed store {directory}"
+        return store
+
     def _load_dataset(self, glob_str="*.png") -> "Union[List,List]":
-        source_paths = list(self.source_dir.glob(glob_str))[: self.max_len]
+        if self.args.data_backend == "packed":
+            names = self.store.names if self.store is not None else []
+            source_paths = [self.source_dir / name for name in names]
+        else:
+            source_paths = list(self.source_dir.glob(glob_str))
+        source_paths = source_paths[: self.max_len]
 
         if self.target_dir:
             target_paths = [self.target_dir / file.name for file in source_paths]
@@ -80,6 +132,74 @@ class OLEDDataset(Dataset):
 
         return source_paths, target_paths
 
+    def _imread(self, index: int, key: str = "source") -> "np.ndarray":
+        """
+        HWC uint8 RGB image: a view of the packed store, or decoded from png.
+        """
+        if self.store is not None:
+            return self.store.read(index, key)
+
+        paths = self.source_paths if key == "source" else self.target_paths
+        return imread_rgb(paths[index])
+
+    def _to_tensor(self, image: "np.ndarray") -> "Tensor":
+        """
+        HWC uint8 image to a CHW tensor: float in [-1, 1], or with uint8 a
+        contiguous uint8 tensor (a quarter of the bytes through worker IPC and
+        the host to device copy), normalised on device by to_device.
+        """
+        if self.uint8:
+            return torch.from_numpy(np.ascontiguousarray(image.transpose(2, 0, 1)))
+
+        image = torch.tensor(image / 255.0).float().permute(2, 0, 1)
+        return (image - 0.5) * 2
+
+    def _augment(
+        self, source: "np.ndarray", target: "np.ndarray"
+    ) -> "Tuple[np.ndarray, np.ndarray]":
+        if not self.args.do_augment:
+            return source, target
+
+        # Vertical flip
+        if random.random() < 0.25:
+            source = source[::-1]
+            target = target[::-1]
+
+        # Horz flip
+        if random.random() < 0.25:
+            source = source[:, ::-1]
+            target = target[:, ::-1]
+
+        # 180 rotate
+        if random.random() < 0.25:
+            source = cv2.rotate(source, cv2.ROTATE_180)
+            target = cv2.rotate(target, cv2.ROTATE_180)
+
+        return source, target
+
+    def _crops(self, source: "np.ndarray", target: "np.ndarray", name: str):
+        """
+        crops_per_image aligned random crops of a decoded pair, augmented
+        independently.
+
+        :return: source, target (K, C, crop_h, crop_w) and name, see
+            collate_crops
+        """
+        crop_h, crop_w = self.crop_size
+        h, w = source.shape[:2]
+        assert crop_h <= h and crop_w <= w, f"crop_size exceeds {name} ({h}x{w})"
+
+        sources, targets = [], []
+        for _ in range(self.args.crops_per_image):
+            top = random.randint(0, h - crop_h)
+            left = random.randint(0, w - crop_w)
+            window = (slice(top, top + crop_h), slice(left, left + crop_w))
+            source_crop, target_crop = self._augment(source[window], target[window])
+            sources.append(self._to_tensor(source_crop))
+            targets.append(self._to_tensor(target_crop))
+
+        return torch.stack(sources), torch.stack(targets), name
+
     def __len__(self):
         return len(self.source_paths)
 
@@ -87,41 +207,25 @@ class OLEDDataset(Dataset):
         source_path = self.source_paths[index]
 
         if self.mode == "train":
-            target_path = self.target_paths[index]
-            source = cv2.imread(str(source_path))[:, :, ::-1] / 255.0
-            target = cv2.imread(str(target_path))[:, :, ::-1] / 255.0
-
-            # Data augmentation
-            if self.args.do_augment:
-                # Vertical flip
-                if random.random() < 0.25:
-                    source = source[::-1]
-                    target = target[::-1]
-
-                # Horz flip
-                if random.random() < 0.25:
-                    source = source[:, ::-1]
-                    target = target[:, ::-1]
-
-                # 180 rotate
-                if random.random() < 0.25:
-                    source = cv2.rotate(source, cv2.ROTATE_180)
-                    target = cv2.rotate(target, cv2.ROTATE_180)
+            source = self._imread(index, "source")
+            target = self._imread(index, "target")
+
+            if self.crop_size:
+                return self._crops(source, target, source_path.name)
+
+            source, target = self._augment(source, target)
 
         elif self.mode == "val":
-            target_path = self.target_paths[index]
-            source = cv2.imread(str(source_path))[:, :, ::-1] / 255.0
-            target = cv2.imread(str(target_path))[:, :, ::-1] / 255.0
+            source = self._imread(index, "source")
+            target = self._imread(index, "target")
 
         elif self.mode == "test":
-            source = cv2.imread(str(source_path))[:, :, ::-1] / 255.0
+            source = self._imread(index, "source")
 
-        source = torch.tensor(source.copy()).float().permute(2, 0, 1)
-        source = (source - 0.5) * 2
+        source = self._to_tensor(source)
 
         if self.mode in ["train", "val"]:
-            target = torch.tensor(target.copy()).float().permute(2, 0, 1)
-            target = (target - 0.5) * 2
+            target = self._to_tensor(target)
 
             return (source, target, source_path.name)
 
@@ -129,16 +233,148 @@ class OLEDDataset(Dataset):
             return (source, source_path.name)
 
 
-def get_dataloaders(args, is_local_rank_0: bool = True):
+def crop_multiple(args) -> int:
+    """
+    Crop sides have to survive the lr_scale downsample (the smallest of
+    lr_scales if adaptive) and unpixelshuffle.
+    """
+    scales = args.lr_scales if args.lr_scale == "adaptive" else [args.lr_scale]
+    return int(round(1 / min(scales))) * args.pixelshuffle_ratio
+
+
+def collate_crops(batch: "List[Tuple]") -> "Tuple":
+    """
+    Collate _crops samples: crops of every image along the batch dimension, so
+    batches hold batch_size * crops_per_image crops.
+    """
+    sources, targets, names = zip(*batch)
+    names = [name for name, crops in zip(names, sources) for _ in crops]
+    return torch.cat(sources), torch.cat(targets), names
+
+
+def to_device(image: "Tensor", device) -> "Tensor":
+    """
+    Batch of OLEDDataset images on device, float in [-1, 1].
+
+    uint8 batches (data_uint8) are copied as is (non blocking from pinned
+    memory) and normalised on device, in one batched step.
+    """
+    if image.dtype == torch.uint8:
+        return image.to(device, non_blocking=True).float().div_(127.5).sub_(1)
+    return image.to(device)
+
+
+class DevicePrefetcher:
+    """
+    Iterates loader in a background thread, up to depth batches ahead of the
+    consumer, with their tensors already on device (to_device; on cuda, on a
+    side stream, from pinned memory). Decoding and host to device copies
+    overlap the model, even with num_workers=0.
+
+    Other attributes (dataset, sampler, ...) are the loader's.
+    """
+
+    def __init__(self, loader: "DataLoader", device, depth: int = 2):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.depth = depth
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __getattr__(self, name: str):
+        if name == "loader":
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+    @staticmethod
+    def _put(batches: "queue.Queue", item, stop: "threading.Event") -> bool:
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, batches: "queue.Queue", stop: "threading.Event"):
+        cuda = self.device.type == "cuda"
+        stream = torch.cuda.Stream(self.device) if cuda else None
+        try:
+            with torch.cuda.stream(stream) if cuda else nullcontext():
+                for batch in self.loader:
+                    batch = [
+                        to_device(x, self.device) if torch.is_tensor(x) else x
+                        for x in batch
+                    ]
+                    event = stream.record_event() if cuda else None
+                    if not self._put(batches, (batch, event), stop):
+                        return
+        except Exception as e:
+            self._put(batches, e, stop)
+            return
+        self._put(batches, None, stop)
+
+    def __iter__(self):
+        batches = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=self._produce, args=(batches, stop), daemon=True
+        )
+        thread.start()
+
+        try:
+            while True:
+                item = batches.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+
+                batch, event = item
+                if event is not None:
+                    # Consumer stream waits for the copy, and owns the memory
+                    stream = torch.cuda.current_stream(self.device)
+                    stream.wait_event(event)
+                    for x in batch:
+                        if torch.is_tensor(x) and x.is_cuda:
+                            x.record_stream(stream)
+                yield batch
+        finally:
+            # Early exit (eg: break), unblock and retire the producer
+            stop.set()
+            thread.join()
+
+
+def get_dataloaders(args, is_local_rank_0: bool = True, device=None):
     """
     Get dataloaders for train and val
 
+    :param device: with {split}_prefetch batches, loaders prefetch to device
+        (DevicePrefetcher)
+
     Returns:
     :data
     """
-    train_dataset = OLEDDataset(args, mode="train", is_local_rank_0=is_local_rank_0)
-    val_dataset = OLEDDataset(args, mode="val", is_local_rank_0=is_local_rank_0)
-    test_dataset = OLEDDataset(args, mode="test", is_local_rank_0=is_local_rank_0)
+    dataset = partial(
+        OLEDDataset, is_local_rank_0=is_local_rank_0, uint8=args.data_uint8
+    )
+    train_dataset = dataset(args, mode="train")
+    val_dataset = dataset(args, mode="val")
+    test_dataset = dataset(args, mode="test")
+
+    # uint8 or prefetched batches: pinned, for non blocking copies (to_device)
+    prefetch = {
+        "train": args.train_prefetch,
+        "val": args.val_prefetch,
+        "test": args.test_prefetch,
+    }
+    if device is None:
+        prefetch = dict.fromkeys(prefetch, 0)
+    pin_memory = {
+        split: bool(args.data_uint8 or depth) and torch.cuda.is_available()
+        for split, depth in prefetch.items()
+    }
 
     if is_local_rank_0:
         logging.info(
@@ -165,9 +401,10 @@ def get_dataloaders(args, is_local_rank_0: bool = True):
             batch_size=args.batch_size,
             shuffle=shuffle,
             num_workers=args.num_threads,
-            pin_memory=False,
+            pin_memory=pin_memory["train"],
             drop_last=True,
             sampler=train_sampler,
+            collate_fn=collate_crops if args.crop_size else None,
         )
 
     if len(val_dataset):
@@ -185,8 +422,8 @@ def get_dataloaders(args, is_local_rank_0: bool = True):
             val_dataset,
             batch_size=args.batch_size,
             shuffle=shuffle,
-            num_workers=0,
-            pin_memory=False,
+            num_workers=args.val_num_threads,
+            pin_memory=pin_memory["val"],
             drop_last=True,
             sampler=val_sampler,
         )
@@ -206,12 +443,19 @@ def get_dataloaders(args, is_local_rank_0: bool = True):
             test_dataset,
             batch_size=args.batch_size,
             shuffle=shuffle,
-            num_workers=0,
-            pin_memory=False,
+            num_workers=args.test_num_threads,
+            pin_memory=pin_memory["test"],
             drop_last=True,
             sampler=test_sampler,
         )
 
+    if prefetch["train"] and train_loader:
+        train_loader = DevicePrefetcher(train_loader, device, prefetch["train"])
+    if prefetch["val"] and val_loader:
+        val_loader = DevicePrefetcher(val_loader, device, prefetch["val"])
+    if prefetch["test"] and test_loader:
+        test_loader = DevicePrefetcher(test_loader, device, prefetch["test"])
+
     return Data(
         train_loader=train_loader, val_loader=val_loader, test_loader=test_loader
     )
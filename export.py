@@ -0,0 +1,99 @@
+"""
+Export Script
+
+Run as:
+python export.py with xyz_config inference_backend=script {other flags}
+
+Exports DeepAtrousGuidedFilter (checkpoint of the config, tag inference_mode)
+as TorchScript (inference_backend=script or trace), ONNX with dynamic
+height and width (inference_backend=onnx, run with ONNX Runtime on CPU) or
+warms up a torch.compile'd variant (inference_backend=compile), for inputs of
+1 x 3 x image_height x image_width. Artifacts are cached in export_cache_dir,
+see models/export.py.
+
+Checks parity against eager PyTorch (also at half resolution for shape
+agnostic artifacts) and reports latency.
+"""
+# Libraries
+from sacred import Experiment
+import logging
+import time
+
+# Torch Libs
+import torch
+
+# Modules
+from config import initialise
+from models import get_model
+from models.export import export_model, dynamic_shape_methods
+from utils.benchmark import time_fn, format_table
+from utils.train_helper import load_models
+from utils.tupperware import tupperware
+
+ex = Experiment("export")
+ex = initialise(ex)
+
+
+@ex.config
+def export_config():
+    export_repeats = 5
+    export_atol = 1e-4
+
+
+@ex.automain
+def main(_run):
+    args = tupperware(_run.config)
+    assert args.inference_backend != "eager", "Pick a backend to export to"
+
+    G = get_model.model(args)
+    G, _, _, _, _ = load_models(G, g_optimizer=None, args=args, tag=args.inference_mode)
+    G = G.to(args.device).eval()
+
+    if args.fuse_for_inference:
+        G.fuse_for_inference(
+            max_kernel_size=args.fuse_max_kernel_size,
+            latency_tradeoff=args.fuse_latency_tradeoff,
+        )
+
+    # Same model as val.py runs (see get_model.inference_fn)
+    G.set_inference_precision(args.inference_precision)
+
+    shape = (1, 3, args.image_height, args.image_width)
+
+    start = time.perf_counter()
+    exported = export_model(
+        G,
+        shape,
+        args.export_cache_dir,
+        method=args.inference_backend,
+        optimize=args.export_optimize,
+        onnx_opset=args.onnx_opset,
+        num_threads=args.onnx_num_threads,
+    )
+    logging.info(
+        f"Export ({args.inference_backend}) took {time.perf_counter() - start:.1f}s"
+    )
+
+    x_hr = (torch.rand(*shape, device=args.device) - 0.5) * 2
+
+    with torch.no_grad():
+        error = (G(x_hr) - exported(x_hr)).abs().max().item()
+        assert error < args.export_atol, f"Exported model deviates by {error}"
+
+        if args.inference_backend in dynamic_shape_methods:
+            x_half = x_hr[:, :, : args.image_height // 2, : args.image_width // 2]
+            half_error = (G(x_half) - exported(x_half)).abs().max().item()
+            assert half_error < args.export_atol, f"Deviates by {half_error} @ 1/2"
+
+        rows = [
+            ["eager", time_fn(G, x_hr, repeats=args.export_repeats)],
+            [
+                args.inference_backend,
+                time_fn(exported, x_hr, repeats=args.export_repeats),
+            ],
+        ]
+
+    logging.info(
+        f"Max abs error {error:.2e} @ {shape}\n"
+        + format_table(["Backend", "Latency (ms)"], rows)
+    )
@@ -1,3 +1,4 @@
+from functools import partial
 from typing import TYPE_CHECKING
 
 import torch
@@ -12,6 +13,14 @@ if TYPE_CHECKING:
     from utils.typing_alias import *
 
 
+def _attention_map(features: "Tensor[N,C,H,W]") -> "Tensor[N,HW]":
+    """
+    Channel pooled, l2 normalised spatial attention (independent of width).
+    See https://arxiv.org/abs/1612.03928
+    """
+    return F.normalize(features.pow(2).mean(dim=1).flatten(1), dim=1)
+
+
 class GLoss(nn.Module):
     def __init__(self, args):
         super(GLoss, self).__init__()
@@ -58,3 +67,58 @@ class GLoss(nn.Module):
         self.total_loss += +self.image_loss + self.cobi_rgb_loss
 
         return self.total_loss
+
+
+class DistillationLoss(nn.Module):
+    """
+    Supervision of a student DeepAtrousGuidedFilter by a frozen teacher:
+    L1 between their outputs, and attention transfer between the gated
+    features of their LRNets (input of deconv2), which may differ in width.
+    """
+
+    def __init__(self, G: "nn.Module", teacher: "nn.Module", args):
+        super(DistillationLoss, self).__init__()
+        self.args = args
+        self.teacher = teacher
+
+        # Gated features of the latest forward pass
+        self.features = {}
+        if args.lambda_distill_features:
+            for name, model in [("student", G), ("teacher", teacher)]:
+                model.lr.deconv2.register_forward_pre_hook(
+                    partial(self._capture, name)
+                )
+
+    def _capture(self, name: str, module, inputs):
+        self.features[name] = inputs[0]
+
+    def forward(
+        self, source: "Tensor[N,C,H,W]", output: "Tensor[N,C,H,W]"
+    ) -> "Tensor[torch.float32]":
+        """
+        :param source: student input
+        :param output: student output, its forward pass just ran on source
+        """
+        self.total_loss = torch.tensor(0.0).type_as(output)
+        self.output_loss = torch.tensor(0.0).type_as(output)
+        self.feature_loss = torch.tensor(0.0).type_as(output)
+
+        with torch.no_grad():
+            teacher_output = self.teacher(source)
+
+        if self.args.lambda_distill_output:
+            self.output_loss += (
+                F.l1_loss(output, teacher_output) * self.args.lambda_distill_output
+            )
+
+        if self.args.lambda_distill_features:
+            student = _attention_map(self.features["student"])
+            teacher = _attention_map(self.features["teacher"])
+            self.feature_loss += (
+                (student - teacher).norm(dim=1).mean()
+                * self.args.lambda_distill_features
+            )
+
+        self.total_loss += self.output_loss + self.feature_loss
+
+        return self.total_loss
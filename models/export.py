@@ -0,0 +1,294 @@
+"""
+TorchScript and torch.compile artifacts of DeepAtrousGuidedFilter.
+
+Artifacts are cached under a directory, keyed by a hash of
+    weights (state dict), inference flags of every submodule (engines,
+    fusion, batched branches), input shape, method and torch version.
+A second process with the same key loads the artifact instead of exporting
+(script, trace, onnx; compile always recompiles, see below).
+
+    script: torch.jit.script, frozen. Works for any input shape.
+    trace: torch.jit.trace, frozen. Specialised to the example shape.
+    compile: torch.compile (inductor). Not a compiled artifact: every process
+        re-captures and re-compiles the graph on its first call. The cache
+        directory only holds the inductor configuration (its FX graph cache),
+        which may let inductor reuse generated kernels instead of rebuilding
+        them, and a marker of the key.
+    onnx: ONNX graph with dynamic batch, height and width (multiples of
+        2 * pixelshuffle_ratio), run by ONNX Runtime on CPU.
+"""
+from copy import deepcopy
+from pathlib import Path
+import hashlib
+import logging
+import os
+
+import torch
+import torch.nn as nn
+
+from models.fusion import freeze_share_sep_convs
+from models.lr_net import DilatedConv2d
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+# Typing
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.typing_alias import *
+
+export_methods = ["script", "trace", "compile", "onnx"]
+
+# Artifacts that accept any input shape
+dynamic_shape_methods = ["script", "onnx"]
+
+
+def weights_hash(model: "nn.Module") -> str:
+    """
+    sha256 of the state dict (names, dtypes, shapes and values).
+    """
+    digest = hashlib.sha256()
+    for name, tensor in model.state_dict().items():
+        tensor = tensor.detach().cpu().contiguous()
+        digest.update(f"{name}:{tensor.dtype}:{tuple(tensor.shape)}".encode())
+        digest.update(tensor.view(-1).view(torch.uint8).numpy().tobytes())
+    return digest.hexdigest()
+
+
+def _module_flags(model: "nn.Module") -> "List[str]":
+    """
+    Python scalar attributes of every submodule (eg: ShareSepConv.engine,
+    AdaptiveInstanceNorm.fused), these change the exported graph.
+    """
+    flags = []
+    for name, module in model.named_modules():
+        for key, value in sorted(vars(module).items()):
+            if isinstance(value, (bool, int, float, str)):
+                flags.append(f"{name}.{key}={value}")
+    return flags
+
+
+def artifact_key(model: "nn.Module", shape: "Tuple[int,...]", method: str) -> str:
+    """
+    Cache key of an exported model.
+
+    :param shape: example input shape (n, c, h, w)
+    """
+    digest = hashlib.sha256()
+    digest.update(weights_hash(model).encode())
+    digest.update("\n".join(_module_flags(model)).encode())
+    digest.update(f"{tuple(shape)}:{method}:{torch.__version__}".encode())
+    return digest.hexdigest()[:16]
+
+
+def _export_torchscript(
+    model: "nn.Module", example: "Tensor", method: str, optimize: bool = True
+):
+    with torch.no_grad():
+        if method == "script":
+            exported = torch.jit.script(model)
+        else:
+            exported = torch.jit.trace(model, example)
+
+        exported = torch.jit.freeze(exported.eval())
+        if optimize:
+            exported = torch.jit.optimize_for_inference(exported)
+
+    return exported
+
+
+def graph_friendly(model: "nn.Module") -> "nn.Module":
+    """
+    Copy of model restricted to code paths graph capture (ONNX export, FX
+    quantization) can trace.
+
+    Direct ShareSepConv (a static depthwise conv, instead of expanding the
+    shared kernel to the input channels at runtime), direct dilated convs
+    (nn.Conv2d, no shape dependent space to batch), no fused autograd
+    Functions (norms, guided filter output), torch.cat branches and no LRNet
+    arena.
+    """
+    model = freeze_share_sep_convs(deepcopy(model))
+    if hasattr(model, "set_inference_precision"):
+        model.set_inference_precision("fp32")
+
+    for module in list(model.modules()):
+        for name, child in module.named_children():
+            if isinstance(child, DilatedConv2d):
+                setattr(module, name, child.to_conv2d())
+
+    for module in model.modules():
+        if hasattr(module, "fused"):
+            module.fused = False
+        if hasattr(module, "batched_branches"):
+            module.batched_branches = False
+        if hasattr(module, "arena"):
+            module.arena = False
+
+    return model.eval()
+
+
+def _export_onnx(model: "nn.Module", example: "Tensor", path: "Path", opset: int):
+    axes = {0: "batch", 2: "height", 3: "width"}
+    with torch.no_grad():
+        torch.onnx.export(
+            graph_friendly(model),
+            example,
+            str(path),
+            opset_version=opset,
+            input_names=["input"],
+            output_names=["output"],
+            dynamic_axes={"input": axes, "output": axes},
+            do_constant_folding=True,
+        )
+
+
+class OnnxRuntimeModel:
+    """
+    ONNX Runtime CPU session, called like G (torch tensors in and out).
+    """
+
+    def __init__(self, path: "Path", num_threads: int = 0):
+        assert ort is not None, "ONNX backend requires onnxruntime"
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+
+        self.session = ort.InferenceSession(
+            str(path), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, x: "Tensor[N,C,H,W]") -> "Tensor[N,C,H,W]":
+        inputs = {self.input_name: x.detach().float().cpu().numpy()}
+        y = self.session.run(None, inputs)[0]
+        return torch.from_numpy(y).to(x.device, x.dtype)
+
+
+def _use_inductor_cache(cache_dir: "Path"):
+    """
+    Point the inductor (FX graph) cache into cache_dir.
+
+    Has to run before torch._inductor reads its config, ie: before the
+    first torch.compile'd call of the process.
+    """
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = str(Path(cache_dir).resolve() / "inductor")
+    os.environ["TORCHINDUCTOR_FX_GRAPH_CACHE"] = "1"
+
+
+def export_model(
+    model: "nn.Module",
+    shape: "Tuple[int,...]",
+    cache_dir: "Path",
+    method: str = "script",
+    optimize: bool = True,
+    onnx_opset: int = 17,
+    num_threads: int = 0,
+):
+    """
+    Exported model for inputs of `shape`, loaded from cache_dir if present.
+
+    :param model: model in eval mode, with weights loaded (and folded if needed)
+        and its inference precision set (set_inference_precision)
+    :param shape: example input shape (n, c, h, w)
+    :param method: script, trace, compile or onnx
+    :param optimize: torch.jit.optimize_for_inference on TorchScript artifacts
+    :param onnx_opset: ONNX opset version
+    :param num_threads: ONNX Runtime intra op threads, 0 for its default
+    :return: callable with the same signature as model.forward
+    """
+    assert method in export_methods, f"Unknown export method {method}"
+
+    # Reduced precision runs through autocast / hooks, only compile keeps them
+    precision = getattr(model, "precision", "fp32")
+    if precision != "fp32" and method != "compile":
+        raise ValueError(
+            f"{method} exports fp32 only, got inference_precision={precision}. "
+            "Use inference_backend=compile or eager."
+        )
+
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(exist_ok=True, parents=True)
+
+    device = next(model.parameters()).device
+    example = torch.zeros(*shape, device=device)
+    if method in dynamic_shape_methods:
+        key = artifact_key(model, (), f"{method}_{optimize}_{onnx_opset}")
+    else:
+        key = artifact_key(model, shape, f"{method}_{optimize}")
+
+    if method == "compile":
+        _use_inductor_cache(cache_dir)
+        compiled = torch.compile(model, dynamic=False)
+
+        # Warm up: graph capture and compilation run here in every process,
+        # inductor may reuse kernels of its FX graph cache
+        marker = cache_dir / f"dagf_compile_{key}.done"
+        with torch.no_grad():
+            compiled(example)
+        logging.info(
+            f"torch.compile compiled, inductor cache {cache_dir / 'inductor'} "
+            f"({'seen' if marker.exists() else 'new'} configuration)"
+        )
+        marker.touch()
+        return compiled
+
+    if method == "onnx":
+        path = cache_dir / f"dagf_onnx_{key}.onnx"
+        if path.exists():
+            logging.info(f"Loading ONNX artifact {path}")
+        else:
+            _export_onnx(model, example, path, onnx_opset)
+            logging.info(f"Saved ONNX artifact {path}")
+        return OnnxRuntimeModel(path, num_threads=num_threads)
+
+    path = cache_dir / f"dagf_{method}_{key}.pt"
+    if path.exists():
+        logging.info(f"Loading TorchScript artifact {path}")
+        return torch.jit.load(str(path), map_location=device)
+
+    exported = _export_torchscript(model, example, method, optimize=optimize)
+    torch.jit.save(exported, str(path))
+    logging.info(f"Saved TorchScript artifact {path}")
+
+    return exported
+
+
+class ExportedModel(nn.Module):
+    """
+    Exports `model` lazily, once per input shape for shape specialised
+    methods (trace, compile), once overall otherwise.
+
+    :param export_kwargs: see export_model
+    """
+
+    def __init__(
+        self,
+        model: "nn.Module",
+        cache_dir: "Path",
+        method: str = "script",
+        **export_kwargs,
+    ):
+        super().__init__()
+        self.model = model
+        self.cache_dir = cache_dir
+        self.method = method
+        self.export_kwargs = export_kwargs
+        self._exported = {}
+
+    def forward(self, x):
+        shape = None if self.method in dynamic_shape_methods else tuple(x.shape)
+        if shape not in self._exported:
+            self._exported[shape] = export_model(
+                self.model,
+                tuple(x.shape),
+                self.cache_dir,
+                method=self.method,
+                **self.export_kwargs,
+            )
+        return self._exported[shape](x)
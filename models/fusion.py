@@ -0,0 +1,193 @@
+"""
+Inference time graph folding.
+
+Every atrous branch runs conv_k(pre_conv_k(x)): a shared depthwise smoothing
+kernel (ShareSepConv, k x k) followed by a 3x3 conv of dilation D, both linear
+and bias free. Their composition is a single dense conv of size k + 2D.
+
+    k == 1: the smoothing is a scalar, folded into the conv weights (exact,
+        one conv less).
+    k > 1: replaced by FoldedSmoothConv only if its dense (k + 2D)^2 kernel
+        takes fewer multiply-accumulates per pixel than the pair (see
+        pair_macs / folded_macs). For the published widths it never does:
+        at k = 3, D = 2, a 7x7 dense conv costs ~5x the depthwise 3x3 and
+        dilated 3x3 it replaces. With latency_tradeoff, pairs up to
+        max_kernel_size are folded anyway: one dense conv can run faster
+        than two passes on some backends, at the cost of more MACs. Measure
+        with benchmarks/fusion.py.
+"""
+import logging
+
+import torch
+import torch.nn as nn
+from torch.nn import functional as F
+
+from models.lr_net import (
+    ShareSepConv,
+    SmoothDilatedResidualAtrousBlock,
+    SmoothDilatedResidualAtrousGuidedBlock,
+)
+
+# Typing
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.typing_alias import *
+
+branch_ids = [1, 2, 4, 8]
+
+
+def compose_kernels(pre_conv: "ShareSepConv", conv: "nn.Conv2d") -> "Tensor":
+    """
+    Weight of the single conv equivalent to conv(pre_conv(x)).
+
+    :return: composed weight, shape: (out, in / groups, k + 2D, k + 2D)
+    """
+    k = pre_conv.kernel_size
+    dilation = conv.dilation[0]
+    out_channels, in_channels, _, _ = conv.weight.shape
+
+    # Dilated 3x3 as a dense (2D + 1) kernel
+    size = 2 * dilation + 1
+    weight = conv.weight.new_zeros(out_channels, in_channels, size, size)
+    weight[:, :, ::dilation, ::dilation] = conv.weight
+
+    # Full convolution with the smoothing kernel (correlation with its flip)
+    smoothing = pre_conv.weight.flip(-1, -2).expand(in_channels, 1, k, k)
+    return F.conv2d(F.pad(weight, [k - 1] * 4), smoothing, groups=in_channels)
+
+
+def pair_macs(pre_conv: "ShareSepConv", conv: "nn.Conv2d") -> int:
+    """
+    Multiply-accumulates per output pixel of conv(pre_conv(x)).
+    """
+    k = pre_conv.kernel_size
+    return conv.in_channels * k * k + conv.weight[0].numel() * conv.out_channels
+
+
+def folded_macs(pre_conv: "ShareSepConv", conv: "nn.Conv2d") -> int:
+    """
+    Multiply-accumulates per output pixel of their FoldedSmoothConv.
+    """
+    size = pre_conv.kernel_size + 2 * conv.dilation[0]
+    return conv.out_channels * (conv.in_channels // conv.groups) * size * size
+
+
+class FoldedSmoothConv(nn.Module):
+    """
+    conv(pre_conv(x)) as a single conv.
+
+    Within `dilation` pixels of the frame border, the original pair zero pads
+    the smoothed map while the folded conv smooths the zero padding. Those
+    strips are recomputed with the original pair, so outputs match everywhere.
+    """
+
+    def __init__(self, pre_conv: "ShareSepConv", conv: "nn.Conv2d"):
+        super().__init__()
+        self.pre_conv = pre_conv
+        self.conv = conv
+
+        self.groups = conv.groups
+        self.border = conv.dilation[0]
+        self.halo = 2 * conv.dilation[0] + pre_conv.padding
+
+        padding = pre_conv.padding + conv.padding[0]
+        self.padding = (padding, padding)
+
+        with torch.no_grad():
+            self.register_buffer("weight", compose_kernels(pre_conv, conv))
+
+    def _reference(self, x):
+        return self.conv(self.pre_conv(x))
+
+    def forward(self, x):
+        h, w = x.shape[-2], x.shape[-1]
+        if min(h, w) <= 2 * self.halo:
+            return self._reference(x)
+
+        y = F.conv2d(x, self.weight, None, 1, self.padding, 1, self.groups)
+
+        b, halo = self.border, self.halo
+        y[:, :, :b] = self._reference(x[:, :, :halo])[:, :, :b]
+        y[:, :, -b:] = self._reference(x[:, :, -halo:])[:, :, -b:]
+        y[:, :, :, :b] = self._reference(x[:, :, :, :halo])[:, :, :, :b]
+        y[:, :, :, -b:] = self._reference(x[:, :, :, -halo:])[:, :, :, -b:]
+
+        return y
+
+
+def fuse_for_inference(
+    model: "nn.Module", max_kernel_size: int = 7, latency_tradeoff: bool = False
+) -> "List[Tuple[str,int,str,int,int]]":
+    """
+    Fold ShareSepConv into the following dilated conv, in place.
+
+    Irreversible (the state dict changes), so fold after loading weights.
+
+    :param max_kernel_size: largest folded kernel
+    :param latency_tradeoff: fold within max_kernel_size even if that takes
+        more MACs, see module docstring
+    :return: (block, branch, action, MACs per pixel before, after) for every
+        branch, action being "scaled", "folded" or "kept".
+    """
+    report = []
+
+    for name, block in model.named_modules():
+        if not isinstance(
+            block,
+            (SmoothDilatedResidualAtrousBlock, SmoothDilatedResidualAtrousGuidedBlock),
+        ):
+            continue
+
+        for i in branch_ids:
+            pre_conv = getattr(block, f"pre_conv{i}")
+            conv = getattr(block, f"conv{i}")
+
+            if not isinstance(pre_conv, ShareSepConv):
+                continue
+
+            k = pre_conv.kernel_size
+            before = pair_macs(pre_conv, conv)
+            fits = k + 2 * conv.dilation[0] <= max_kernel_size
+            if k == 1:
+                with torch.no_grad():
+                    conv.weight.mul_(pre_conv.weight[0, 0, 0, 0])
+                action, after = "scaled", before - conv.in_channels
+
+            elif fits and (latency_tradeoff or folded_macs(pre_conv, conv) < before):
+                setattr(block, f"conv{i}", FoldedSmoothConv(pre_conv, conv))
+                action, after = "folded", folded_macs(pre_conv, conv)
+
+            else:
+                action, after = "kept", before
+
+            if action != "kept":
+                setattr(block, f"pre_conv{i}", nn.Identity())
+
+            report.append((name, i, action, before, after))
+
+    folded = sum(row[2] != "kept" for row in report)
+    logging.info(f"Folded {folded} / {len(report)} smoothing convs.")
+
+    return report
+
+
+def freeze_share_sep_convs(model: "nn.Module") -> "nn.Module":
+    """
+    Replace every ShareSepConv by a static depthwise nn.Conv2d, in place.
+
+    For graph exporters and quantizers, which do not handle the shared kernel
+    being expanded to the runtime channel count.
+    """
+    pairs = [(f"pre_conv{i}", f"conv{i}") for i in branch_ids]
+    pairs += [("pre_conv", "conv")]  # FoldedSmoothConv
+    pairs += [("pre_conv", "depthwise")]  # SeparableAtrousBranch
+
+    for module in list(model.modules()):
+        for pre_name, conv_name in pairs:
+            pre_conv = getattr(module, pre_name, None)
+            conv = getattr(module, conv_name, None)
+            if isinstance(pre_conv, ShareSepConv) and isinstance(conv, nn.Conv2d):
+                setattr(module, pre_name, pre_conv.to_conv2d(conv.in_channels))
+
+    return model
@@ -1,8 +1,109 @@
 """
 Get model
 """
+from functools import partial
+
+import torch
+
+from models.export import ExportedModel, dynamic_shape_methods
 from models.guided_filter import DeepAtrousGuidedFilter
+from models.guided_map import guided_maps
+from models.tiling import (
+    tile_side,
+    tiled_forward,
+    tiled_forward_global_statistics,
+)
+from utils.model_serialization import load_state_dict
 
 
 def model(args):
+    """
+    DeepAtrousGuidedFilter, with the guided map variant args.guided_map
+    (registry in models/guided_map.py).
+    """
+    assert args.guided_map in guided_maps, (
+        f"Unknown guided map {args.guided_map}, pick one of {list(guided_maps)}"
+    )
     return DeepAtrousGuidedFilter(args)
+
+
+def teacher(args):
+    """
+    Frozen teacher for distillation: LRNet of the distill_teacher_* shape,
+    weights from distill_teacher_ckpt.
+    """
+    teacher_args = args._replace(
+        lrnet_channels=args.distill_teacher_channels,
+        lrnet_blocks_per_stage=args.distill_teacher_blocks_per_stage,
+        lrnet_stages=args.distill_teacher_stages,
+        guided_map=args.distill_teacher_guided_map,
+        pruned_arch=None,
+    )
+    G = DeepAtrousGuidedFilter(teacher_args)
+
+    checkpoint = torch.load(args.distill_teacher_ckpt, map_location="cpu")
+    load_state_dict(G, checkpoint["state_dict"])
+
+    return G.eval().requires_grad_(False)
+
+
+def inference_fn(G, args):
+    """
+    Callable used by inference entry points (val.py) to restore a batch.
+    """
+    if args.inference_precision != "fp32":
+        assert args.inference_backend in ["eager", "compile"], (
+            f"inference_precision={args.inference_precision} "
+            f"is not exported by {args.inference_backend}"
+        )
+    G.set_inference_precision(args.inference_precision)
+
+    if args.lr_scale == "adaptive":
+        assert args.inference_backend not in dynamic_shape_methods, (
+            f"{args.inference_backend} exports one lr_scale for every input size"
+        )
+
+    if args.preview:
+        assert not args.tiled_inference and args.inference_backend == "eager", (
+            "Preview runs eager, on whole frames"
+        )
+        return partial(G.preview, size=args.preview_size)
+
+    forward_fn = G
+    if args.inference_backend != "eager":
+        forward_fn = ExportedModel(
+            G,
+            args.export_cache_dir,
+            method=args.inference_backend,
+            optimize=args.export_optimize,
+            onnx_opset=args.onnx_opset,
+            num_threads=args.onnx_num_threads,
+        )
+
+    if args.tiled_inference and args.tile_global_statistics:
+        assert (
+            args.inference_backend == "eager" and args.inference_precision == "fp32"
+        ), "Two pass tiling runs eager, in fp32"
+        # Non overlapping output tiles, halos are the guided map radius
+        tile_size, _ = tile_side(
+            G, args.tile_size, overlap=0, pixel_budget=args.tile_pixel_budget
+        )
+        return partial(
+            tiled_forward_global_statistics,
+            G,
+            tile_size=tile_size,
+            band_rows=args.statistics_band_rows,
+        )
+
+    if args.tiled_inference:
+        return partial(
+            tiled_forward,
+            G,
+            tile_size=args.tile_size,
+            overlap=args.tile_overlap,
+            tile_batch_size=args.tile_batch_size,
+            pixel_budget=args.tile_pixel_budget,
+            forward_fn=forward_fn,
+        )
+
+    return forward_fn
@@ -1,10 +1,15 @@
+import json
+
 import torch
 import torch.nn as nn
 from torch.nn import functional as F
-from utils.ops import unpixel_shuffle
+from utils.ops import box_sum, unpixel_shuffle
 
-from models.lr_net import SmoothDilatedResidualAtrousGuidedBlock, LRNet
-from models.model_utils import AdaptiveInstanceNorm
+from models.guided_map import guided_map
+from models.lr_net import LRNet
+from models.model_utils import AdaptiveInstanceNorm, BilinearAffineTanh
+from models.fusion import fuse_for_inference
+from models.roi import restore_roi
 
 
 from sacred import Experiment
@@ -14,13 +19,88 @@ ex = Experiment("DAGF")
 ex = initialise(ex)
 
 
+precisions = ["fp32", "bf16", "fp16-storage"]
+
+
+def select_lr_scale(
+    height: int,
+    width: int,
+    scales: list,
+    pixel_budget: int,
+    multiple: int = 1,
+) -> float:
+    """
+    Largest of scales whose low resolution frame has at most pixel_budget
+    pixels, the smallest one if none fits. LRNet cost is linear in its pixels,
+    so this caps it whatever the input size.
+
+    :param multiple: low resolution sides must be multiples of it (pixel shuffle)
+    """
+    valid = [
+        scale
+        for scale in sorted(scales, reverse=True)
+        if int(height * scale) % multiple == 0 and int(width * scale) % multiple == 0
+    ]
+    assert valid, f"No scale in {scales} fits {height}x{width} (multiple {multiple})"
+
+    for scale in valid:
+        if int(height * scale) * int(width * scale) <= pixel_budget:
+            return scale
+    return valid[-1]
+
+
+def lr_pixel_budget(args) -> int:
+    """
+    Low resolution pixels of the adaptive scale policy: lr_pixel_budget, or
+    lr_latency_budget (ms) of LRNet at lr_ms_per_megapixel.
+    """
+    if args.lr_latency_budget:
+        assert args.lr_ms_per_megapixel > 0, "Measure lr_ms_per_megapixel first"
+        return int(args.lr_latency_budget / args.lr_ms_per_megapixel * 1e6)
+    return args.lr_pixel_budget
+
+
+def _float_inputs(module, inputs):
+    return tuple(x.float() if torch.is_tensor(x) else x for x in inputs)
+
+
+def _half_output(module, inputs, output):
+    return output.half()
+
+
 class ConvGuidedFilter(nn.Module):
     """
     Adapted from https://github.com/wuhuikai/DeepGuidedFilter
     """
-    def __init__(self, radius=1, norm=nn.BatchNorm2d, conv_a_kernel_size: int = 1):
+    def __init__(
+        self,
+        radius=1,
+        norm=nn.BatchNorm2d,
+        conv_a_kernel_size: int = 1,
+        box_filter: str = "conv",
+        fused: bool = False,
+        band_rows: int = 0,
+    ):
+        """
+        :param radius: dilation of the 3x3 box filter (conv), or radius of
+            the (2 radius + 1)^2 box (integral)
+        :param box_filter: conv (learnable dilated 3x3 depthwise conv) or
+            integral (box sum through running sums, O(1) per pixel in radius)
+        :param fused: fused upsample + affine + tanh in forward_tanh
+        :param band_rows: output rows per band of the fused op, 0 for all
+        """
         super(ConvGuidedFilter, self).__init__()
 
+        assert box_filter in ["conv", "integral"]
+        self.box_filter_type = box_filter
+        self.radius: int = radius
+
+        self.fused = fused
+        self.band_rows = band_rows
+
+        # (key, box filter of ones), see _normalisation
+        self._normalisation_cache = None
+
         self.box_filter = nn.Conv2d(
             3, 3, kernel_size=3, padding=radius, dilation=radius, bias=False, groups=3
         )
@@ -53,71 +133,304 @@ class ConvGuidedFilter(nn.Module):
         )
         self.box_filter.weight.data[...] = 1.0
 
+        # Unused by the integral box filter, kept for checkpoint compatibility
+        if box_filter == "integral":
+            self.box_filter.weight.requires_grad_(False)
+
     def forward(self, x_lr, y_lr, x_hr):
-        _, _, h_lrx, w_lrx = x_lr.size()
         _, _, h_hrx, w_hrx = x_hr.size()
 
-        N = self.box_filter(x_lr.data.new().resize_((1, 3, h_lrx, w_lrx)).fill_(1.0))
-        ## mean_x
-        mean_x = self.box_filter(x_lr) / N
-        ## mean_y
-        mean_y = self.box_filter(y_lr) / N
+        A, b = self.coefficients(x_lr, y_lr)
+
+        ## mean_A; mean_b
+        mean_A = F.interpolate(A, (h_hrx, w_hrx), mode="bilinear", align_corners=True)
+        mean_b = F.interpolate(b, (h_hrx, w_hrx), mode="bilinear", align_corners=True)
+
+        return mean_A * x_hr + mean_b
+
+    def forward_tanh(self, x_lr, y_lr, x_hr):
+        """
+        torch.tanh(self(x_lr, y_lr, x_hr)), fused if self.fused
+
+        The fused op reads A, b and x_hr once and writes the output directly,
+        without full resolution mean_A, mean_b temporaries (see
+        BilinearAffineTanh, benchmarks/upsample_apply.py).
+        """
+        if self.fused and not torch.jit.is_scripting():
+            A, b = self.coefficients(x_lr, y_lr)
+            return self._fused_tanh(A, b, x_hr)
+        return torch.tanh(self(x_lr, y_lr, x_hr))
+
+    @torch.jit.unused
+    def _fused_tanh(self, A, b, x_hr):
+        return BilinearAffineTanh.apply(A, b, x_hr, self.band_rows)
+
+    def coefficients(self, x_lr, y_lr):
+        """
+        Low resolution linear coefficients A, b (y ~ A * x + b)
+        """
+        N = self._normalisation(x_lr)
+
+        ## mean_x, mean_y, mean_xy, mean_xx in one box filter call
+        stats = torch.cat([x_lr, y_lr, x_lr * y_lr, x_lr * x_lr], dim=1)
+        mean_x, mean_y, mean_xy, mean_xx = (self._box(stats) / N).chunk(4, dim=1)
         ## cov_xy
-        cov_xy = self.box_filter(x_lr * y_lr) / N - mean_x * mean_y
+        cov_xy = mean_xy - mean_x * mean_y
         ## var_x
-        var_x = self.box_filter(x_lr * x_lr) / N - mean_x * mean_x
+        var_x = mean_xx - mean_x * mean_x
 
         ## A
         A = self.conv_a(torch.cat([cov_xy, var_x], dim=1))
         ## b
         b = mean_y - A * mean_x
 
-        ## mean_A; mean_b
-        mean_A = F.interpolate(A, (h_hrx, w_hrx), mode="bilinear", align_corners=True)
-        mean_b = F.interpolate(b, (h_hrx, w_hrx), mode="bilinear", align_corners=True)
+        return A, b
 
-        return mean_A * x_hr + mean_b
+    def _box(self, x):
+        """
+        Box filter of every channel of x (a multiple of 3 channels).
+        """
+        if self.box_filter_type == "integral":
+            return box_sum(x, self.radius)
+
+        c = x.size(1)
+        weight = self.box_filter.weight.repeat(c // 3, 1, 1, 1)
+        return F.conv2d(x, weight, None, 1, self.radius, self.radius, c)
+
+    def _normalisation(self, x_lr):
+        """
+        Pixels per window (fewer at the border), for the 4 stacked statistics.
+        """
+        _, _, h, w = x_lr.size()
+        if self.training or torch.jit.is_scripting():
+            return self._box(x_lr.new_ones((1, 12, h, w)))
+        return self._cached_normalisation(x_lr)
+
+    @torch.jit.unused
+    def _cached_normalisation(self, x_lr):
+        """
+        Cached per (H, W, device, dtype) and version of the box filter weights.
+        """
+        weight = self.box_filter.weight
+        key = (
+            tuple(x_lr.shape[-2:]),
+            x_lr.device,
+            x_lr.dtype,
+            weight._version,
+            weight.data_ptr(),
+        )
+        if self._normalisation_cache is None or self._normalisation_cache[0] != key:
+            with torch.no_grad():
+                N = self._box(x_lr.new_ones((1, 12) + key[0]))
+            self._normalisation_cache = (key, N)
+
+        return self._normalisation_cache[1]
 
 
 class DeepAtrousGuidedFilter(nn.Module):
-    def __init__(self, args, radius=1):
+    def __init__(self, args, radius=None):
         super().__init__()
 
         self.args = args
+        # Plain attribute, forward does not read args (TorchScript)
+        self.pixelshuffle_ratio: int = args.pixelshuffle_ratio
         norm = AdaptiveInstanceNorm
 
-        c = args.guided_map_channels
-        self.guided_map = SmoothDilatedResidualAtrousGuidedBlock(
-            in_channel=3, channel_num=c, args=args
-        )
+        # Widths of a pruned model (prune.py), None: from args
+        arch = {}
+        if args.pruned_arch:
+            with open(args.pruned_arch) as f:
+                arch = json.load(f)
+
+        # Registry of variants in models/guided_map.py
+        self.guided_map = guided_map(args, branch_channels=arch.get("guided_map"))
 
         self.lr = LRNet(
             in_c=3 * args.pixelshuffle_ratio ** 2,
             out_c=3 * args.pixelshuffle_ratio ** 2,
             args=args,
+            arch=arch.get("lrnet"),
         )
 
-        self.gf = ConvGuidedFilter(radius, norm=norm)
-
-        self.downsample = nn.Upsample(
-            scale_factor=0.5, mode="bilinear", align_corners=True
+        self.gf = ConvGuidedFilter(
+            radius or args.gf_radius,
+            norm=norm,
+            box_filter=args.gf_box_filter,
+            fused=args.fused_upsample,
+            band_rows=args.gf_band_rows,
         )
 
+        # Low resolution scale (1 / n of the input), fixed or picked per input
+        # by select_lr_scale
+        self.adaptive_lr_scale: bool = args.lr_scale == "adaptive"
+        self.lr_scales = [float(scale) for scale in args.lr_scales]
+        if self.adaptive_lr_scale:
+            self.lr_scale: float = max(self.lr_scales)
+        else:
+            self.lr_scale: float = float(args.lr_scale)
+        for scale in self.lr_scales + [self.lr_scale]:
+            assert (1 / scale).is_integer(), f"lr_scale {scale} is not 1 / n"
+        self.lr_pixel_budget: int = lr_pixel_budget(args)
+
+        # Inference precision, see set_inference_precision
+        self.precision = "fp32"
+        self._precision_hooks = []
+
     def forward(self, x_hr):
-        x_lr = self.downsample(x_hr)
+        if self.precision != "fp32" and not torch.jit.is_scripting():
+            return self._forward_reduced_precision(x_hr)
+
+        y_lr, guide_lr, guide_hr = self.forward_features(x_hr)
+        return self.gf.forward_tanh(guide_lr, y_lr, guide_hr)
+
+    def forward_features(self, x_hr):
+        """
+        Everything but the guided filter.
+
+        :return: LRNet output, guided maps of the low and full resolution frames
+        """
+        x_lr, y_lr = self.forward_lr(x_hr)
+        return y_lr, self.guided_map(x_lr), self.guided_map(x_hr)
+
+    def forward_lr(self, x_hr):
+        """
+        Low resolution stage.
+
+        :return: low resolution frame, LRNet output
+        """
+        scale = self.lr_scale
+        if self.adaptive_lr_scale and not torch.jit.is_scripting():
+            scale = self.lr_scale_for(x_hr.shape[-2], x_hr.shape[-1])
+
+        x_lr = F.interpolate(
+            x_hr, scale_factor=scale, mode="bilinear", align_corners=True
+        )
 
         # Unpixelshuffle
-        x_lr_unpixelshuffled = unpixel_shuffle(x_lr, self.args.pixelshuffle_ratio)
+        x_lr_unpixelshuffled = unpixel_shuffle(x_lr, self.pixelshuffle_ratio)
 
         # Pixelshuffle
-        y_lr = F.pixel_shuffle(
-            self.lr(x_lr_unpixelshuffled), self.args.pixelshuffle_ratio
+        y_lr = F.pixel_shuffle(self.lr(x_lr_unpixelshuffled), self.pixelshuffle_ratio)
+
+        return x_lr, y_lr
+
+    @torch.jit.unused
+    def preview(self, x_hr, size=None):
+        """
+        Downscaled restoration from the low resolution stage alone: the guided
+        filter coefficients applied to the low resolution guided map. The full
+        resolution guided map and upsampling never run.
+
+        :param size: output (height, width), default the low resolution size.
+            Smaller sizes are area downsampled, larger ones bilinear upsampled.
+        """
+        with torch.autocast(
+            x_hr.device.type, dtype=torch.bfloat16, enabled=self.precision == "bf16"
+        ):
+            x_lr, y_lr = self.forward_lr(x_hr)
+            guide_lr = self.guided_map(x_lr)
+
+        guide_lr = guide_lr.float()
+        A, b = self.gf.coefficients(guide_lr, y_lr.float())
+        y = torch.tanh(torch.addcmul(b, A, guide_lr))
+
+        h, w = y.shape[-2:]
+        if size is None or tuple(size) == (h, w):
+            return y
+        if size[0] <= h and size[1] <= w:
+            return F.interpolate(y, size=tuple(size), mode="area")
+        return F.interpolate(y, size=tuple(size), mode="bilinear", align_corners=True)
+
+    @torch.jit.unused
+    def lr_scale_for(self, height: int, width: int) -> float:
+        """
+        Scale of the low resolution stage for inputs of height x width.
+        """
+        if not self.adaptive_lr_scale:
+            return self.lr_scale
+        return select_lr_scale(
+            height,
+            width,
+            self.lr_scales,
+            self.lr_pixel_budget,
+            multiple=self.pixelshuffle_ratio,
         )
 
-        return F.tanh(
-            self.gf(self.guided_map(x_lr), y_lr, self.guided_map(x_hr))
+    def lr_factor(self) -> int:
+        """
+        Largest input / low resolution size ratio. Input sides should be
+        multiples of lr_factor() * pixelshuffle_ratio.
+        """
+        scales = self.lr_scales if self.adaptive_lr_scale else [self.lr_scale]
+        return int(round(1 / min(scales)))
+
+    @torch.jit.unused
+    def _forward_reduced_precision(self, x_hr):
+        if self.precision == "bf16":
+            with torch.autocast(x_hr.device.type, dtype=torch.bfloat16):
+                y_lr, guide_lr, guide_hr = self.forward_features(x_hr)
+        else:
+            # fp16 outputs, see set_inference_precision
+            y_lr, guide_lr, guide_hr = self.forward_features(x_hr)
+
+        # var_x = box(x * x) / N - mean_x^2 cancels catastrophically in bf16 / fp16
+        return self.gf.forward_tanh(guide_lr.float(), y_lr.float(), guide_hr.float())
+
+    def set_inference_precision(self, precision: str = "fp32"):
+        """
+        fp32: default.
+        bf16: LRNet and the guided map under autocast.
+        fp16-storage: activations between layers (the outputs of LRNet
+            convs and blocks, and of the guided map) are stored in fp16,
+            every layer and the LRNet norm, gating and residual math between
+            them compute in fp32 (LRNet.float_compute).
+        The guided filter and instance norm statistics always run in fp32.
+        """
+        assert precision in precisions, f"Unknown precision {precision}"
+        self.precision = precision
+
+        # Arena buffers are fp32, written by the blocks (no output hooks)
+        self.lr.arena = self.args.lrnet_arena and precision == "fp32"
+        self.lr.float_compute = precision == "fp16-storage"
+
+        for handle in self._precision_hooks:
+            handle.remove()
+        self._precision_hooks = []
+
+        if precision == "fp16-storage":
+            modules = []
+            for module in self.lr.children():
+                if isinstance(module, nn.ModuleList):
+                    # Atrous stages: every block
+                    modules += [block for stage in module for block in stage]
+                elif not isinstance(module, AdaptiveInstanceNorm):
+                    # Norms (forward_leaky_relu, no hooks) get fp32 inputs from
+                    # LRNet.forward itself
+                    modules.append(module)
+            for module in modules + [self.guided_map]:
+                self._precision_hooks += [
+                    module.register_forward_pre_hook(_float_inputs),
+                    module.register_forward_hook(_half_output),
+                ]
+
+    def fuse_for_inference(
+        self, max_kernel_size: int = 7, latency_tradeoff: bool = False
+    ):
+        """
+        Fold ShareSepConv smoothing into the atrous convs (in place).
+        See models/fusion.py
+        """
+        return fuse_for_inference(
+            self, max_kernel_size=max_kernel_size, latency_tradeoff=latency_tradeoff
         )
 
+    def restore_roi(self, image, box, halo=None):
+        """
+        Restored crop box (x0, y0, x1, y1) of image, computing only its context.
+        See models/roi.py
+        """
+        return restore_roi(self, image, box, halo=halo)
+
 
 @ex.automain
 def main(_run):
@@ -0,0 +1,131 @@
+"""
+Guided map variants, the full resolution cost of DeepAtrousGuidedFilter.
+
+The guided map runs on the low and on the full resolution frame (LRNet only
+sees lr_scale^2 of the pixels), so its cost per pixel sets the full resolution
+latency. Variants, by guided_map in config.py:
+    atrous: SmoothDilatedResidualAtrousGuidedBlock, the published model. Four
+        ShareSepConv smoothed, dilated 3x3 branches (dilation 1, 2, 4, 8)
+        fused by a 3x3 conv.
+    separable: same branches as depthwise dilated 3x3 + pointwise convs,
+        fused by a pointwise conv.
+    separable-lite: separable, dilation 1 and 2 branches only.
+    pointwise: 1x1 conv, norm, 1x1 conv, no spatial context (the guide of
+        Wu et al., Fast End-to-End Trainable Guided Filter).
+Compare them with benchmarks/guided_map.py.
+"""
+from functools import partial
+
+import torch
+import torch.nn as nn
+from torch.nn import functional as F
+
+from models.lr_net import ShareSepConv, SmoothDilatedResidualAtrousGuidedBlock
+from models.model_utils import AdaptiveInstanceNorm
+
+# Typing
+from typing import TYPE_CHECKING, List
+
+if TYPE_CHECKING:
+    from utils.typing_alias import *
+
+
+class SeparableAtrousBranch(nn.Module):
+    """
+    ShareSepConv smoothing, depthwise dilated 3x3 conv, pointwise conv, norm.
+    """
+
+    def __init__(self, in_channel, out_channel, dilation: int = 1, args=None):
+        super().__init__()
+        self.pre_conv = ShareSepConv(2 * dilation - 1, args=args)
+        self.depthwise = nn.Conv2d(
+            in_channel,
+            in_channel,
+            3,
+            1,
+            padding=dilation,
+            dilation=dilation,
+            groups=in_channel,
+            bias=False,
+        )
+        self.pointwise = nn.Conv2d(in_channel, out_channel, 1, bias=False)
+        self.norm = AdaptiveInstanceNorm(out_channel, fused=args.fused_norm_act)
+
+    def forward(self, x):
+        y = self.pointwise(self.depthwise(self.pre_conv(x)))
+        return self.norm.forward_leaky_relu(y, 0.2)
+
+
+class SeparableAtrousGuidedBlock(nn.Module):
+    """
+    SmoothDilatedResidualAtrousGuidedBlock with depthwise separable branches
+    and a pointwise fusion conv.
+
+    :param dilations: one branch per dilation
+    """
+
+    def __init__(self, in_channel, channel_num, dilations=(1, 2, 4, 8), args=None):
+        super().__init__()
+        self.args = args
+
+        branch_channels = channel_num // 2
+        self.branches = nn.ModuleList(
+            [
+                SeparableAtrousBranch(in_channel, branch_channels, dilation, args=args)
+                for dilation in dilations
+            ]
+        )
+
+        self.conv = nn.Conv2d(
+            branch_channels * len(dilations), in_channel, 1, bias=False
+        )
+        self.norm = AdaptiveInstanceNorm(in_channel, fused=args.fused_norm_act)
+
+    def forward(self, x):
+        ys: List[torch.Tensor] = []
+        for branch in self.branches:
+            ys.append(branch(x))
+
+        y = self.norm(self.conv(torch.cat(ys, dim=1)))
+        y = y + x
+
+        return F.leaky_relu(y, 0.2)
+
+
+class PointwiseGuidedMap(nn.Module):
+    def __init__(self, in_channel, channel_num, args=None):
+        super().__init__()
+        self.args = args
+
+        self.conv1 = nn.Conv2d(in_channel, channel_num, 1, bias=False)
+        self.norm1 = AdaptiveInstanceNorm(channel_num, fused=args.fused_norm_act)
+        self.conv2 = nn.Conv2d(channel_num, in_channel, 1)
+
+    def forward(self, x):
+        return self.conv2(self.norm1.forward_leaky_relu(self.conv1(x), 0.2))
+
+
+guided_maps = {
+    "atrous": SmoothDilatedResidualAtrousGuidedBlock,
+    "separable": SeparableAtrousGuidedBlock,
+    "separable-lite": partial(SeparableAtrousGuidedBlock, dilations=(1, 2)),
+    "pointwise": PointwiseGuidedMap,
+}
+
+
+def guided_map(args, branch_channels: "Optional[List[int]]" = None) -> "nn.Module":
+    """
+    Guided map of args.guided_map (3 channels in and out).
+
+    :param branch_channels: widths of a pruned atrous guided map
+    """
+    assert args.guided_map in guided_maps, f"Unknown guided map {args.guided_map}"
+
+    kwargs = {}
+    if branch_channels:
+        assert args.guided_map == "atrous", "Only atrous guided maps are pruned"
+        kwargs["branch_channels"] = branch_channels
+
+    return guided_maps[args.guided_map](
+        in_channel=3, channel_num=args.guided_map_channels, args=args, **kwargs
+    )
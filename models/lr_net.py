@@ -3,6 +3,11 @@ Code derived from:
 
 https://github.com/cddlyf/GCANet
 """
+from functools import partial
+from typing import Optional
+import re
+import time
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -15,10 +20,41 @@ ex = Experiment("LRNet")
 ex = initialise(ex)
 
 from models.model_utils import AdaptiveInstanceNorm, CALayer, PALayer
+from utils.ops import batch_to_space, space_to_batch
+
+
+def _fft_size(n: int) -> int:
+    """
+    Smallest 5-smooth integer >= n (fast pocketfft / cuFFT sizes).
+    """
+    size = n
+    while True:
+        m = size
+        for p in [2, 3, 5]:
+            while m % p == 0:
+                m = m // p
+        if m == 1:
+            break
+        size += 1
+    return size
 
 
 class ShareSepConv(nn.Module):
-    def __init__(self, kernel_size):
+    """
+    Depthwise smoothing conv, with one kernel shared by all channels.
+
+    Execution engines (numerically equivalent, see benchmarks/sharesep.py):
+        direct: depthwise F.conv2d, O(k^2) per pixel.
+        fft: frequency domain product, O(log HW) per pixel.
+        lowrank: sum of rank-1 separable convs from the SVD of the kernel,
+            truncated such that the output error is at most lowrank_tol * max|x|.
+            Inference only (SVD gradients are unstable for repeated singular
+            values), falls back to direct when gradients are required.
+        auto: fft for kernel_size >= fft_kernel_size, lowrank for
+            kernel_size >= lowrank_kernel_size, else direct.
+    """
+
+    def __init__(self, kernel_size, args=None):
         super(ShareSepConv, self).__init__()
         assert kernel_size % 2 == 1, "kernel size should be odd"
         self.padding = (kernel_size - 1) // 2
@@ -27,86 +63,360 @@ class ShareSepConv(nn.Module):
         self.weight = nn.Parameter(weight_tensor)
         self.kernel_size = kernel_size
 
+        self.engine = args.sharesep_engine if args else "direct"
+        assert self.engine in ["direct", "fft", "lowrank", "auto"]
+        self.fft_kernel_size = args.sharesep_fft_kernel_size if args else 31
+        self.lowrank_kernel_size = args.sharesep_lowrank_kernel_size if args else 15
+        self.lowrank_tol = args.sharesep_lowrank_tol if args else 1e-3
+
+        # (weight version, separable factors), see _lowrank_factors
+        self._lowrank_cache = None
+
     def forward(self, x):
+        engine = self.engine
+        if engine == "auto":
+            if self.kernel_size >= self.fft_kernel_size:
+                engine = "fft"
+            elif self.kernel_size >= self.lowrank_kernel_size:
+                engine = "lowrank"
+            else:
+                engine = "direct"
+
+        if engine == "fft":
+            return self._forward_fft(x)
+
+        if engine == "lowrank" and not torch.jit.is_scripting():
+            return self._forward_lowrank(x)
+
+        return self._forward_direct(x)
+
+    def _forward_direct(self, x):
         inc = x.size(1)
         expand_weight = self.weight.expand(
             inc, 1, self.kernel_size, self.kernel_size
         ).contiguous()
         return F.conv2d(x, expand_weight, None, 1, self.padding, 1, inc)
 
+    def to_conv2d(self, channels: int) -> "nn.Conv2d":
+        """
+        Equivalent depthwise nn.Conv2d for `channels` inputs, with the shared
+        kernel expanded into a static weight (eg: for ONNX export).
+        """
+        conv = nn.Conv2d(
+            channels,
+            channels,
+            self.kernel_size,
+            padding=self.padding,
+            groups=channels,
+            bias=False,
+        ).to(self.weight.device, self.weight.dtype)
+
+        with torch.no_grad():
+            conv.weight.copy_(self.weight.expand_as(conv.weight))
+        return conv
+
+    def _forward_fft(self, x):
+        """
+        Cross-correlation as a product with the conjugate kernel spectrum.
+
+        The frame is zero padded by `padding` (as in F.conv2d), so the
+        circular wrap around never reaches the h x w outputs kept.
+        """
+        h, w = x.shape[-2], x.shape[-1]
+        p = self.padding
+        size = [_fft_size(h + 2 * p), _fft_size(w + 2 * p)]
+
+        # No half precision FFTs on CPU
+        x_ = x
+        if x.dtype == torch.float16 or x.dtype == torch.bfloat16:
+            x_ = x.float()
+
+        x_f = torch.fft.rfft2(F.pad(x_, (p, p, p, p)), s=size)
+        kernel_f = torch.fft.rfft2(self.weight.to(x_.dtype), s=size)
+
+        y = torch.fft.irfft2(x_f * kernel_f.conj(), s=size)
+        return y[:, :, :h, :w].to(x.dtype)
+
+    @torch.jit.unused
+    def _forward_lowrank(self, x):
+        """
+        sum_r (x * u_r) * v_r, with all ranks batched along channels.
+        Direct conv when gradients are needed or the kernel is not low rank.
+        """
+        if torch.is_grad_enabled() and self.weight.requires_grad:
+            return self._forward_direct(x)
+
+        factors = self._lowrank_factors()
+        if factors is None:
+            return self._forward_direct(x)
+
+        vertical, horizontal = factors
+        n, c, h, w = x.shape
+        rank = vertical.size(0)
+        k = self.kernel_size
+
+        vertical = vertical.to(x.dtype).repeat(c, 1).view(c * rank, 1, k, 1)
+        horizontal = horizontal.to(x.dtype).repeat(c, 1).view(c * rank, 1, 1, k)
+
+        y = F.conv2d(x, vertical, None, 1, (self.padding, 0), 1, c)
+        y = F.conv2d(y, horizontal, None, 1, (0, self.padding), 1, c * rank)
+        return y.view(n, c, rank, h, w).sum(dim=2)
+
+    @torch.jit.unused
+    def _lowrank_factors(self):
+        """
+        Vertical and horizontal factors of the truncated SVD of the kernel.
+
+        The smallest rank r whose residual kernel has an l1 norm below
+        lowrank_tol is kept, bounding the output error by lowrank_tol * max|x|.
+        Returns None if r is too large for separable convs to pay off.
+        """
+        version = (self.weight._version, self.weight.data_ptr())
+        if self._lowrank_cache is not None and self._lowrank_cache[0] == version:
+            return self._lowrank_cache[1]
+
+        with torch.no_grad():
+            kernel = self.weight[0, 0].double()
+            U, S, Vh = torch.linalg.svd(kernel)
+
+            # Residual l1 norm for every rank, (k, k, k) at most
+            components = U.t()[:, :, None] * (S[:, None, None] * Vh[:, None, :])
+            residual = kernel - torch.cumsum(components, dim=0)
+            error = residual.abs().sum(dim=(1, 2))
+
+            within_tol = torch.nonzero(error <= self.lowrank_tol)
+            rank = int(within_tol[0]) + 1 if len(within_tol) else self.kernel_size
+
+            if 2 * rank >= self.kernel_size:
+                factors = None
+            else:
+                scale = S[:rank].sqrt()
+                vertical = (U[:, :rank] * scale).t().to(self.weight.dtype)
+                horizontal = (Vh[:rank] * scale[:, None]).to(self.weight.dtype)
+                factors = (vertical, horizontal)
+
+        self._lowrank_cache = (version, factors)
+        return factors
+
+dilated_conv_engines = ["direct", "space_to_batch", "auto"]
+
+
+class DilatedConv2d(nn.Conv2d):
+    """
+    Stride 1, same padded (padding == dilation) 3x3 conv, for large dilations
+    that CPU conv backends handle poorly. Execution engines (same output up to
+    float rounding, see benchmarks/dilated_conv.py):
+        direct: F.conv2d with dilation d.
+        space_to_batch: the input (zero padded to multiples of d) split into
+            its d x d dilation phases along the batch, one dense 3x3 conv over
+            all of them, phases interleaved back (utils/ops.py).
+        auto: times both on the first input of every shape, per layer, and
+            keeps the faster.
+
+    Parameters are those of nn.Conv2d, checkpoints are interchangeable.
+    TorchScript runs direct.
+    """
+
+    def __init__(self, *args, engine: str = "auto", **kwargs):
+        super().__init__(*args, **kwargs)
+        assert engine in dilated_conv_engines, f"Unknown engine {engine}"
+        assert self.kernel_size == (3, 3) and self.stride == (1, 1)
+        assert self.padding == self.dilation, "Same padding only"
+        self.engine = engine
+
+        # (input shape, dtype, device) -> engine picked by auto
+        self._autotune_cache = {}
+
+    def forward(self, x):
+        if self.engine != "direct" and not torch.jit.is_scripting():
+            return self._forward_engine(x)
+        return self._conv_forward(x, self.weight, self.bias)
+
+    @torch.jit.unused
+    def _forward_engine(self, x):
+        engine = self.engine
+        if engine == "auto":
+            engine = self.autotune(x)
+
+        if engine == "space_to_batch":
+            return self._forward_space_to_batch(x)
+        return self._conv_forward(x, self.weight, self.bias)
+
+    @torch.jit.unused
+    def _forward_space_to_batch(self, x):
+        d = self.dilation[0]
+        h, w = x.shape[-2], x.shape[-1]
+
+        y = space_to_batch(F.pad(x, (0, -w % d, 0, -h % d)), d)
+        y = F.conv2d(y, self.weight, self.bias, 1, 1, 1, self.groups)
+        return batch_to_space(y, d)[:, :, :h, :w]
+
+    @torch.jit.unused
+    def autotune(self, x, repeats: int = 3) -> str:
+        """
+        Faster engine for inputs like x (timed once per shape, then cached).
+        """
+        key = (tuple(x.shape), x.dtype, x.device)
+        if key not in self._autotune_cache:
+            timings = {}
+            with torch.no_grad():
+                for engine, fn in [
+                    ("direct", lambda: self._conv_forward(x, self.weight, self.bias)),
+                    ("space_to_batch", lambda: self._forward_space_to_batch(x)),
+                ]:
+                    fn()
+                    if x.is_cuda:
+                        torch.cuda.synchronize()
+                    start = time.perf_counter()
+                    for _ in range(repeats):
+                        fn()
+                    if x.is_cuda:
+                        torch.cuda.synchronize()
+                    timings[engine] = time.perf_counter() - start
+
+            self._autotune_cache[key] = min(timings, key=timings.get)
+
+        return self._autotune_cache[key]
+
+    def to_conv2d(self) -> "nn.Conv2d":
+        """
+        Equivalent nn.Conv2d (direct engine), sharing the parameters.
+        """
+        conv = nn.Conv2d(
+            self.in_channels,
+            self.out_channels,
+            3,
+            padding=self.padding,
+            dilation=self.dilation,
+            groups=self.groups,
+            bias=self.bias is not None,
+        )
+        conv.weight, conv.bias = self.weight, self.bias
+        return conv
+
+
+def dilated_conv(
+    in_channels, out_channels, dilation: int, groups: int = 1, args=None
+) -> "nn.Conv2d":
+    """
+    Bias free, same padded 3x3 conv of an atrous branch: DilatedConv2d of the
+    dilated_conv_engine for dilations >= dilated_conv_min_dilation, else
+    nn.Conv2d.
+    """
+    engine = args.dilated_conv_engine if args else "direct"
+    min_dilation = args.dilated_conv_min_dilation if args else 1
+    if engine == "direct" or dilation < min_dilation:
+        conv = nn.Conv2d
+    else:
+        conv = partial(DilatedConv2d, engine=engine)
+
+    return conv(
+        in_channels,
+        out_channels,
+        3,
+        1,
+        padding=dilation,
+        dilation=dilation,
+        groups=groups,
+        bias=False,
+    )
+
+
+def _atrous_branches_into_buffer(block: nn.Module, x: torch.Tensor) -> torch.Tensor:
+    """
+    The four atrous branches of `block`, concatenated along channels.
+
+    Every branch writes its normalised activation straight into its channel
+    slice of one buffer, instead of allocating its own output and copying it
+    again with torch.cat. Inference only, out= ops are not differentiable.
+    """
+    branches = [
+        (block.pre_conv1, block.conv1, block.norm1),
+        (block.pre_conv2, block.conv2, block.norm2),
+        (block.pre_conv4, block.conv4, block.norm4),
+        (block.pre_conv8, block.conv8, block.norm8),
+    ]
+
+    n, _, h, w = x.shape
+    channels = sum(norm.ins_norm.num_features for _, _, norm in branches)
+    y = x.new_empty(n, channels, h, w)
+
+    start = 0
+    for pre_conv, conv, norm in branches:
+        end = start + norm.ins_norm.num_features
+        norm.forward_leaky_relu(conv(pre_conv(x)), 0.2, out=y[:, start:end])
+        start = end
+
+    return y
+
 
 class SmoothDilatedResidualAtrousGuidedBlock(nn.Module):
     def __init__(
-        self, in_channel, channel_num, dialation_start: int = 1, group=1, args=None
+        self,
+        in_channel,
+        channel_num,
+        dialation_start: int = 1,
+        group=1,
+        branch_channels=None,
+        args=None,
     ):
         super().__init__()
         self.args = args
 
-        norm = AdaptiveInstanceNorm
+        # Output channels of the dilation 1, 2, 4, 8 branches, halves of
+        # channel_num unless pruned (see models/pruning.py)
+        branch_channels = branch_channels or [channel_num // 2] * 4
 
-        self.norm1 = norm(channel_num // 2)
-        self.norm2 = norm(channel_num // 2)
-        self.norm4 = norm(channel_num // 2)
-        self.norm8 = norm(channel_num // 2)
+        norm = partial(AdaptiveInstanceNorm, fused=args.fused_norm_act)
 
-        self.pre_conv1 = ShareSepConv(2 * dialation_start - 1)
-        self.pre_conv2 = ShareSepConv(4 * dialation_start - 1)
-        self.pre_conv4 = ShareSepConv(8 * dialation_start - 1)
-        self.pre_conv8 = ShareSepConv(16 * dialation_start - 1)
+        self.norm1 = norm(branch_channels[0])
+        self.norm2 = norm(branch_channels[1])
+        self.norm4 = norm(branch_channels[2])
+        self.norm8 = norm(branch_channels[3])
 
-        self.conv1 = nn.Conv2d(
-            in_channel,
-            channel_num // 2,
-            3,
-            1,
-            padding=dialation_start,
-            dilation=dialation_start,
-            bias=False,
+        self.pre_conv1 = ShareSepConv(2 * dialation_start - 1, args=args)
+        self.pre_conv2 = ShareSepConv(4 * dialation_start - 1, args=args)
+        self.pre_conv4 = ShareSepConv(8 * dialation_start - 1, args=args)
+        self.pre_conv8 = ShareSepConv(16 * dialation_start - 1, args=args)
+
+        self.conv1 = dilated_conv(
+            in_channel, branch_channels[0], dialation_start, args=args
         )
 
-        self.conv2 = nn.Conv2d(
-            in_channel,
-            channel_num // 2,
-            3,
-            1,
-            padding=2 * dialation_start,
-            dilation=2 * dialation_start,
-            groups=group,
-            bias=False,
+        self.conv2 = dilated_conv(
+            in_channel, branch_channels[1], 2 * dialation_start, groups=group, args=args
         )
 
-        self.conv4 = nn.Conv2d(
-            in_channel,
-            channel_num // 2,
-            3,
-            1,
-            padding=4 * dialation_start,
-            dilation=4 * dialation_start,
-            groups=group,
-            bias=False,
+        self.conv4 = dilated_conv(
+            in_channel, branch_channels[2], 4 * dialation_start, groups=group, args=args
         )
 
-        self.conv8 = nn.Conv2d(
-            in_channel,
-            channel_num // 2,
-            3,
-            1,
-            padding=8 * dialation_start,
-            dilation=8 * dialation_start,
-            groups=group,
-            bias=False,
+        self.conv8 = dilated_conv(
+            in_channel, branch_channels[3], 8 * dialation_start, groups=group, args=args
         )
 
-        self.conv = nn.Conv2d(channel_num * 2, in_channel, 3, 1, padding=1, bias=False)
+        self.conv = nn.Conv2d(
+            sum(branch_channels), in_channel, 3, 1, padding=1, bias=False
+        )
         self.norm = norm(in_channel)
 
+        # Inference: write branches into one buffer, no torch.cat
+        self.batched_branches = args.batched_branches
+
+    @torch.jit.unused
+    def _branches_into_buffer(self, x):
+        return _atrous_branches_into_buffer(self, x)
+
     def forward(self, x):
-        y1 = F.leaky_relu(self.norm1(self.conv1(self.pre_conv1(x))), 0.2)
-        y2 = F.leaky_relu(self.norm2(self.conv2(self.pre_conv2(x))), 0.2)
-        y4 = F.leaky_relu(self.norm4(self.conv4(self.pre_conv4(x))), 0.2)
-        y8 = F.leaky_relu(self.norm8(self.conv8(self.pre_conv8(x))), 0.2)
+        if self.batched_branches and not torch.is_grad_enabled():
+            y = self._branches_into_buffer(x)
+        else:
+            y1 = self.norm1.forward_leaky_relu(self.conv1(self.pre_conv1(x)), 0.2)
+            y2 = self.norm2.forward_leaky_relu(self.conv2(self.pre_conv2(x)), 0.2)
+            y4 = self.norm4.forward_leaky_relu(self.conv4(self.pre_conv4(x)), 0.2)
+            y8 = self.norm8.forward_leaky_relu(self.conv8(self.pre_conv8(x)), 0.2)
 
-        y = torch.cat((y1, y2, y4, y8), dim=1)
+            y = torch.cat((y1, y2, y4, y8), dim=1)
 
         y = self.norm(self.conv(y))
 
@@ -116,80 +426,98 @@ class SmoothDilatedResidualAtrousGuidedBlock(nn.Module):
 
 
 class SmoothDilatedResidualAtrousBlock(nn.Module):
-    def __init__(self, channel_num, dialation_start: int = 1, group=1, args=None):
+    def __init__(
+        self,
+        channel_num,
+        dialation_start: int = 1,
+        group=1,
+        branch_channels=None,
+        attention_channels=None,
+        args=None,
+    ):
         super().__init__()
         self.args = args
 
-        norm = AdaptiveInstanceNorm
+        # Output channels of the dilation 1, 2, 4, 8 branches, halves of
+        # channel_num unless pruned (see models/pruning.py)
+        branch_channels = branch_channels or [channel_num // 2] * 4
 
-        self.norm1 = norm(channel_num // 2)
-        self.norm2 = norm(channel_num // 2)
-        self.norm4 = norm(channel_num // 2)
-        self.norm8 = norm(channel_num // 2)
+        norm = partial(AdaptiveInstanceNorm, fused=args.fused_norm_act)
 
-        self.pre_conv1 = ShareSepConv(2 * dialation_start - 1)
-        self.pre_conv2 = ShareSepConv(4 * dialation_start - 1)
-        self.pre_conv4 = ShareSepConv(8 * dialation_start - 1)
-        self.pre_conv8 = ShareSepConv(16 * dialation_start - 1)
+        self.norm1 = norm(branch_channels[0])
+        self.norm2 = norm(branch_channels[1])
+        self.norm4 = norm(branch_channels[2])
+        self.norm8 = norm(branch_channels[3])
 
-        self.conv1 = nn.Conv2d(
-            channel_num,
-            channel_num // 2,
-            3,
-            1,
-            padding=dialation_start,
-            dilation=dialation_start,
-            bias=False,
+        self.pre_conv1 = ShareSepConv(2 * dialation_start - 1, args=args)
+        self.pre_conv2 = ShareSepConv(4 * dialation_start - 1, args=args)
+        self.pre_conv4 = ShareSepConv(8 * dialation_start - 1, args=args)
+        self.pre_conv8 = ShareSepConv(16 * dialation_start - 1, args=args)
+
+        self.conv1 = dilated_conv(
+            channel_num, branch_channels[0], dialation_start, args=args
         )
 
-        self.conv2 = nn.Conv2d(
+        self.conv2 = dilated_conv(
             channel_num,
-            channel_num // 2,
-            3,
-            1,
-            padding=2 * dialation_start,
-            dilation=2 * dialation_start,
+            branch_channels[1],
+            2 * dialation_start,
             groups=group,
-            bias=False,
+            args=args,
         )
 
-        self.conv4 = nn.Conv2d(
+        self.conv4 = dilated_conv(
             channel_num,
-            channel_num // 2,
-            3,
-            1,
-            padding=4 * dialation_start,
-            dilation=4 * dialation_start,
+            branch_channels[2],
+            4 * dialation_start,
             groups=group,
-            bias=False,
+            args=args,
         )
 
-        self.conv8 = nn.Conv2d(
+        self.conv8 = dilated_conv(
             channel_num,
-            channel_num // 2,
-            3,
-            1,
-            padding=8 * dialation_start,
-            dilation=8 * dialation_start,
+            branch_channels[3],
+            8 * dialation_start,
             groups=group,
-            bias=False,
+            args=args,
         )
 
-        self.conv = nn.Conv2d(channel_num * 2, channel_num, 3, 1, padding=1, bias=False)
+        self.conv = nn.Conv2d(
+            sum(branch_channels), channel_num, 3, 1, padding=1, bias=False
+        )
 
         self.norm = norm(channel_num)
-        self.calayer = CALayer(channel_num)
-        self.palayer = PALayer(channel_num)
-
-    def forward(self, x):
-        y1 = F.leaky_relu(self.norm1(self.conv1(self.pre_conv1(x))), 0.2)
-        y2 = F.leaky_relu(self.norm2(self.conv2(self.pre_conv2(x))), 0.2)
-        y4 = F.leaky_relu(self.norm4(self.conv4(self.pre_conv4(x))), 0.2)
-        y8 = F.leaky_relu(self.norm8(self.conv8(self.pre_conv8(x))), 0.2)
+        self.calayer = CALayer(channel_num, attention_channels)
+        self.palayer = PALayer(channel_num, attention_channels)
+
+        # Inference: write branches into one buffer, no torch.cat
+        self.batched_branches = args.batched_branches
+
+    @torch.jit.unused
+    def _branches_into_buffer(self, x):
+        return _atrous_branches_into_buffer(self, x)
+
+    def forward(self, x, out: Optional[torch.Tensor] = None):
+        """
+        :param out: optional preallocated output (see LRNet, lrnet_arena),
+            residual adds and activation then run in place. Inference only.
+        """
+        if self.batched_branches and not torch.is_grad_enabled():
+            y = self._branches_into_buffer(x)
+        else:
+            y1 = self.norm1.forward_leaky_relu(self.conv1(self.pre_conv1(x)), 0.2)
+            y2 = self.norm2.forward_leaky_relu(self.conv2(self.pre_conv2(x)), 0.2)
+            y4 = self.norm4.forward_leaky_relu(self.conv4(self.pre_conv4(x)), 0.2)
+            y8 = self.norm8.forward_leaky_relu(self.conv8(self.pre_conv8(x)), 0.2)
+
+            y = torch.cat((y1, y2, y4, y8), dim=1)
 
-        y = torch.cat((y1, y2, y4, y8), dim=1)
         y = self.norm(self.conv(y))
 
+        if out is not None:
+            y = self.palayer(self.calayer(y.add_(x)))
+            return F.leaky_relu_(torch.add(y, x, out=out), 0.2)
+
         y = y + x
 
         y = self.palayer(self.calayer(y))
@@ -199,11 +527,13 @@ class SmoothDilatedResidualAtrousBlock(nn.Module):
 
 
 class ResidualFFABlock(nn.Module):
-    def __init__(self, channel_num, dilation=1, group=1, args=None):
+    def __init__(
+        self, channel_num, dilation=1, group=1, attention_channels=None, args=None
+    ):
         super().__init__()
         self.args = args
 
-        norm = AdaptiveInstanceNorm
+        norm = partial(AdaptiveInstanceNorm, fused=args.fused_norm_act)
 
         self.conv1 = nn.Conv2d(
             channel_num,
@@ -228,11 +558,20 @@ class ResidualFFABlock(nn.Module):
         )
         self.norm2 = norm(channel_num)
 
-        self.calayer = CALayer(channel_num)
-        self.palayer = PALayer(channel_num)
+        self.calayer = CALayer(channel_num, attention_channels)
+        self.palayer = PALayer(channel_num, attention_channels)
+
+    def forward(self, x, out: Optional[torch.Tensor] = None):
+        """
+        :param out: optional preallocated output (see LRNet, lrnet_arena),
+            residual adds and activation then run in place. Inference only.
+        """
+        y = self.norm1.forward_leaky_relu(self.conv1(x), 0.2)
+
+        if out is not None:
+            y = self.palayer(self.calayer(self.norm2(self.conv2(y.add_(x)))))
+            return F.leaky_relu_(torch.add(y, x, out=out), 0.2)
 
-    def forward(self, x):
-        y = F.leaky_relu(self.norm1(self.conv1(x)), 0.2)
         y = y + x
         y = self.norm2(self.conv2(y))
 
@@ -242,62 +581,96 @@ class ResidualFFABlock(nn.Module):
         return F.leaky_relu(y, 0.2)
 
 
+def _block_key(stage: int, block: int) -> str:
+    """
+    Checkpoint name of block `block` of stage `stage` (0 indexed): res1_a, ...
+    """
+    return f"res{stage + 1}_{chr(ord('a') + block)}"
+
+
+def _flatten_stage_keys(module, state_dict, prefix, local_metadata):
+    """
+    State dict hook: stages.{s}.{i}.* saved as res{s + 1}_{letter}.*, the names
+    of checkpoints prior to configurable depth.
+    """
+    items = list(state_dict.items())
+    state_dict.clear()
+    for key, value in items:
+        if key.startswith(prefix + "stages."):
+            stage, block, rest = key[len(prefix + "stages.") :].split(".", 2)
+            key = f"{prefix}{_block_key(int(stage), int(block))}.{rest}"
+        state_dict[key] = value
+
+
+def _unflatten_stage_keys(state_dict, prefix, *args):
+    """
+    Load state dict pre hook, inverse of _flatten_stage_keys.
+    """
+    pattern = re.compile(re.escape(prefix) + r"res(\d+)_([a-z])\.(.*)")
+    for key in list(state_dict):
+        match = pattern.fullmatch(key)
+        if match:
+            stage, block, rest = match.groups()
+            new_key = f"{prefix}stages.{int(stage) - 1}.{ord(block) - ord('a')}.{rest}"
+            state_dict[new_key] = state_dict.pop(key)
+
+
 class LRNet(nn.Module):
-    def __init__(self, in_c=4, out_c=3, args=None):
+    """
+    lrnet_stages stages of lrnet_blocks_per_stage smooth dilated blocks
+    (dilation 1, 2, 4, ... per stage) of lrnet_channels channels. The stem, the
+    output of every stage but the last and res_final are summed with learnt
+    gates. Defaults (48 channels, 3 x 4 blocks) are the published model.
+
+    :param arch: widths of a pruned LRNet, see models/pruning.py
+    """
+
+    def __init__(self, in_c=4, out_c=3, args=None, arch=None):
         super().__init__()
 
         self.args = args
 
-        interm_channels = 48
-        residual_adds = 4
+        arch = arch or {}
+        interm_channels = arch.get("channels", args.lrnet_channels)
+        attention_channels = arch.get("attention_channels")
+        branch_channels = arch.get("branch_channels", {})
+        if not arch:
+            assert interm_channels % 8 == 0, "lrnet_channels must be a multiple of 8"
+
+        # Stem, every stage but the last, res_final
+        residual_adds = args.lrnet_stages + 1
         smooth_dialated_block = SmoothDilatedResidualAtrousBlock
         residual_block = ResidualFFABlock
-        norm = AdaptiveInstanceNorm
+        norm = partial(AdaptiveInstanceNorm, fused=args.fused_norm_act)
 
         self.conv1 = nn.Conv2d(in_c, interm_channels, 3, 1, 1, bias=False)
         self.norm1 = norm(interm_channels)
 
-        self.res1_a = smooth_dialated_block(
-            interm_channels, dialation_start=1, args=args
-        )
-        self.res1_b = smooth_dialated_block(
-            interm_channels, dialation_start=1, args=args
-        )
-        self.res1_c = smooth_dialated_block(
-            interm_channels, dialation_start=1, args=args
-        )
-        self.res1_d = smooth_dialated_block(
-            interm_channels, dialation_start=1, args=args
+        # Checkpointed as res{stage}_{letter}, see _flatten_stage_keys
+        self.stages = nn.ModuleList(
+            [
+                nn.Sequential(
+                    *[
+                        smooth_dialated_block(
+                            interm_channels,
+                            dialation_start=2 ** stage,
+                            branch_channels=branch_channels.get(f"stages.{stage}.{i}"),
+                            attention_channels=attention_channels,
+                            args=args,
+                        )
+                        for i in range(args.lrnet_blocks_per_stage)
+                    ]
+                )
+                for stage in range(args.lrnet_stages)
+            ]
         )
+        self._register_state_dict_hook(_flatten_stage_keys)
+        self._register_load_state_dict_pre_hook(_unflatten_stage_keys)
 
-        self.res2_a = smooth_dialated_block(
-            interm_channels, dialation_start=2, args=args
-        )
-        self.res2_b = smooth_dialated_block(
-            interm_channels, dialation_start=2, args=args
-        )
-        self.res2_c = smooth_dialated_block(
-            interm_channels, dialation_start=2, args=args
-        )
-        self.res2_d = smooth_dialated_block(
-            interm_channels, dialation_start=2, args=args
+        self.res_final = residual_block(
+            interm_channels, attention_channels=attention_channels, args=args
         )
 
-        self.res3_a = smooth_dialated_block(
-            interm_channels, dialation_start=4, args=args
-        )
-        self.res3_b = smooth_dialated_block(
-            interm_channels, dialation_start=4, args=args
-        )
-        self.res3_c = smooth_dialated_block(
-            interm_channels, dialation_start=4, args=args
-        )
-        self.res3_d = smooth_dialated_block(
-            interm_channels, dialation_start=4, args=args
-        )
-
-        self.res_final = residual_block(interm_channels, args=args)
-
         self.gate = nn.Conv2d(
             interm_channels * residual_adds, residual_adds, 3, 1, 1, bias=True
         )
@@ -306,38 +679,110 @@ class LRNet(nn.Module):
         self.norm5 = norm(interm_channels)
         self.deconv1 = nn.Conv2d(interm_channels, out_c, 1)
 
-    def forward(self, x):
-        y1 = F.leaky_relu(self.norm1(self.conv1(x)), 0.2)
-
-        y = self.res1_a(y1)
-        y = self.res1_b(y)
-        y = self.res1_c(y)
-        y2 = self.res1_d(y)
-
-        y = self.res2_a(y2)
-        y = self.res2_b(y)
-        y = self.res2_c(y)
-        y3 = self.res2_d(y)
-
-        y = self.res3_a(y3)
-        y = self.res3_b(y)
-        y = self.res3_c(y)
-        y = self.res3_d(y)
-        y4 = self.res_final(y)
-
-        gates = self.gate(torch.cat((y1, y2, y3, y4), dim=1))
-        gated_y = (
-            y1 * gates[:, [0], :, :]
-            + y2 * gates[:, [1], :, :]
-            + y3 * gates[:, [2], :, :]
-            + y4 * gates[:, [3], :, :]
-        )
+        # Inference: features in buffers preallocated per input shape, see
+        # _forward_arena (fp32 only, see set_inference_precision)
+        self.arena = args.lrnet_arena
+        self._arena = None
+
+        # fp16-storage: layer outputs are stored in fp16 (hooks, see
+        # set_inference_precision), the math between them runs in fp32
+        self.float_compute = False
 
-        y = F.leaky_relu(self.norm5(self.deconv2(gated_y)), 0.2)
-        y = F.leaky_relu(self.deconv1(y), 0.2)
+    def _compute(self, x: torch.Tensor) -> torch.Tensor:
+        return x.float() if self.float_compute else x
+
+    def forward(self, x):
+        if (
+            self.arena
+            and not torch.is_grad_enabled()
+            and not torch.jit.is_scripting()
+            and not torch.jit.is_tracing()
+        ):
+            return self._forward_arena(x)
+
+        y1 = self.norm1.forward_leaky_relu(self._compute(self.conv1(x)), 0.2)
+        if self.float_compute:
+            y1 = y1.half()
+
+        # Stem and stage outputs, the last one through res_final
+        features = [y1]
+        y = y1
+        for stage in self.stages:
+            y = stage(y)
+            features.append(y)
+        features[-1] = self.res_final(y)
+
+        gates = self._compute(self.gate(torch.cat(features, dim=1)))
+        gated_y = self._compute(features[0]) * gates[:, 0:1, :, :]
+        for i in range(1, len(features)):
+            gated_y = gated_y + self._compute(features[i]) * gates[:, i : i + 1, :, :]
+
+        y = self.norm5.forward_leaky_relu(self._compute(self.deconv2(gated_y)), 0.2)
+        y = F.leaky_relu(self._compute(self.deconv1(y)), 0.2)
 
         return y
 
+    def train(self, mode: bool = True):
+        # Back to training (eg: after validation): release the arena buffers
+        if mode:
+            self._arena = None
+        return super().train(mode)
+
+    @torch.jit.unused
+    def _arena_for(self, x):
+        """
+        Buffers for inputs like x, kept across calls: the gate input (stem,
+        stage outputs and res_final along channels), two scratch block outputs
+        and the gated sum. Released on a new input shape and by train().
+        """
+        n, _, h, w = x.shape
+        c = self.conv1.out_channels
+        key = (n, h, w, x.dtype, x.device)
+
+        if self._arena is None or self._arena[0] != key:
+            self._arena = None  # release the previous shape first
+            features = x.new_empty(n, c * self.gate.out_channels, h, w)
+            scratch = x.new_empty(2, n, c, h, w)
+            gated = x.new_empty(n, c, h, w)
+            self._arena = (key, features, scratch, gated)
+
+        return self._arena[1:]
+
+    @torch.jit.unused
+    def _forward_arena(self, x):
+        """
+        forward without torch.cat, per block outputs or gating temporaries.
+
+        Blocks write their output into preallocated buffers (residual adds and
+        LeakyReLU in place): the stem, stage outputs and res_final into their
+        channel slice of the gate input, so the concat is a view, other blocks
+        into two alternating scratch buffers. The gated sum accumulates in
+        place with addcmul_.
+        """
+        features, scratch, gated = self._arena_for(x)
+        slices = features.split(self.conv1.out_channels, dim=1)
+
+        y = self.norm1.forward_leaky_relu(self.conv1(x), 0.2, out=slices[0])
+        for k, stage in enumerate(self.stages):
+            for i, block in enumerate(stage):
+                if i == len(stage) - 1 and k < len(self.stages) - 1:
+                    out = slices[k + 1]
+                elif y.data_ptr() == scratch[0].data_ptr():
+                    out = scratch[1]
+                else:
+                    out = scratch[0]
+                y = block(y, out=out)
+        self.res_final(y, out=slices[-1])
+
+        gates = self.gate(features)
+        torch.mul(slices[0], gates[:, 0:1], out=gated)
+        for i in range(1, len(slices)):
+            gated.addcmul_(slices[i], gates[:, i : i + 1])
+
+        y = self.deconv2(gated)
+        y = self.norm5.forward_leaky_relu(y, 0.2, out=y)
+        return F.leaky_relu_(self.deconv1(y), 0.2)
+
 
 @ex.automain
 def main(_run):
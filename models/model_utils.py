@@ -1,9 +1,235 @@
+from typing import Optional
+
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
+
+
+class AdaptiveInstanceNormLeakyReLU(torch.autograd.Function):
+    """
+    leaky_relu(w_0 * x + w_1 * IN(x)) with a hand written backward.
+
+    The instance norm folds into a per (sample, channel) affine map
+        scale = w_0 + w_1 * gamma * rstd
+        shift = w_1 * (beta - gamma * mean * rstd)
+    so x is reduced once for its statistics and mapped once to the output,
+    without the IN(x), w_0 * x and w_1 * IN(x) temporaries.
+    Statistics are kept in fp32 for reduced precision inputs.
+    """
+
+    @staticmethod
+    def scale_shift(x, w_0, w_1, gamma, beta, eps: float):
+        """
+        Per (sample, channel) affine map equivalent to w_0 * x + w_1 * IN(x).
+        """
+        var, mean = torch.var_mean(x.float(), dim=(2, 3), unbiased=False, keepdim=True)
+        rstd = (var + eps).rsqrt()
+        gamma_ = gamma.view(1, -1, 1, 1)
+        beta_ = beta.view(1, -1, 1, 1)
+
+        scale = w_0 + w_1 * gamma_ * rstd
+        shift = w_1 * (beta_ - gamma_ * mean * rstd)
+        return scale, shift, mean, rstd
+
+    @staticmethod
+    def forward(ctx, x, w_0, w_1, gamma, beta, eps: float, negative_slope: float):
+        scale, shift, mean, rstd = AdaptiveInstanceNormLeakyReLU.scale_shift(
+            x, w_0, w_1, gamma, beta, eps
+        )
+
+        out = torch.addcmul(shift.to(x.dtype), x, scale.to(x.dtype))
+        F.leaky_relu_(out, negative_slope)
+
+        ctx.negative_slope = negative_slope
+        ctx.save_for_backward(x, w_1, gamma, beta, mean, rstd, scale, shift)
+        return out
+
+    @staticmethod
+    def backward(ctx, grad_out):
+        x, w_1, gamma, beta, mean, rstd, scale, shift = ctx.saved_tensors
+        dtype = x.dtype
+        x = x.float()
+        grad_out = grad_out.float()
+        gamma_ = gamma.view(1, -1, 1, 1)
+        beta_ = beta.view(1, -1, 1, 1)
+        hw = x.shape[2] * x.shape[3]
+
+        # Through the LeakyReLU, recomputing its input instead of storing it
+        pre_act = torch.addcmul(shift, x, scale)
+        grad = torch.where(pre_act > 0, grad_out, grad_out * ctx.negative_slope)
+
+        # Per (sample, channel) sums of grad and grad * x_hat
+        sum_grad = grad.sum(dim=(2, 3), keepdim=True)
+        sum_grad_x = (grad * x).sum(dim=(2, 3), keepdim=True)
+        sum_grad_x_hat = rstd * (sum_grad_x - mean * sum_grad)
+
+        # d/dx of w_1 * gamma * x_hat, through mean and rstd
+        k = w_1 * gamma_ * rstd
+        coeff_x = -k * rstd * sum_grad_x_hat / hw
+        coeff_1 = -k * sum_grad / hw - coeff_x * mean
+        grad_x = torch.addcmul(torch.addcmul(coeff_1, x, coeff_x), grad, scale)
+
+        grad_w_0 = sum_grad_x.sum().view(1)
+        grad_w_1 = (gamma_ * sum_grad_x_hat + beta_ * sum_grad).sum().view(1)
+        grad_gamma = (w_1 * sum_grad_x_hat).sum(dim=(0, 2, 3))
+        grad_beta = (w_1 * sum_grad).sum(dim=(0, 2, 3))
+
+        return grad_x.to(dtype), grad_w_0, grad_w_1, grad_gamma, grad_beta, None, None
+
+
+def align_corners_coords(size_in: int, size_out: int, device=None):
+    """
+    Bilinear (align_corners=True) source indices and weight, as F.interpolate.
+
+    :return: i0, i1 (neighbouring source indices), weight of i1, for every output
+    """
+    scale = (size_in - 1) / (size_out - 1) if size_out > 1 else 0.0
+    src = torch.arange(size_out, device=device, dtype=torch.float32) * scale
+
+    i0 = src.long().clamp(max=size_in - 1)
+    i1 = (i0 + 1).clamp(max=size_in - 1)
+    return i0, i1, src - i0
+
+
+class BilinearAffineTanh(torch.autograd.Function):
+    """
+    tanh(up(A) * x + up(b)), up: bilinear (align_corners=True) upsampling to
+    the size of x, with a hand written backward.
+
+    Computed over bands of output rows: only a band of up(A), up(b) is ever
+    materialised (both interpolated in one call), and the output is written in
+    place. The backward recomputes the band and scatters the gradients of
+    up(A), up(b) back to A, b with index_add_ (the adjoint of the gather).
+    """
+
+    @staticmethod
+    def upsample_band(ab, rows, cols, start: int, end: int):
+        """
+        Rows start:end of up(ab)
+        """
+        i0, i1, wy = rows
+        j0, j1, wx = cols
+
+        wy = wy[start:end].view(-1, 1).to(ab.dtype)
+        ab = torch.lerp(ab[:, :, i0[start:end]], ab[:, :, i1[start:end]], wy)
+        return torch.lerp(ab[..., j0], ab[..., j1], wx.to(ab.dtype))
+
+    @staticmethod
+    def forward(ctx, A, b, x, band_rows: int = 0):
+        h, w = x.shape[-2:]
+        rows = align_corners_coords(A.size(2), h, x.device)
+        cols = align_corners_coords(A.size(3), w, x.device)
+        step = band_rows or h
+
+        ab = torch.cat([A, b], dim=1)
+        out = torch.empty_like(x)
+        for start in range(0, h, step):
+            end = min(start + step, h)
+            A_band, b_band = BilinearAffineTanh.upsample_band(
+                ab, rows, cols, start, end
+            ).chunk(2, dim=1)
+
+            out_band = out[:, :, start:end]
+            torch.addcmul(b_band, A_band, x[:, :, start:end], out=out_band)
+            out_band.tanh_()
+
+        ctx.step = step
+        ctx.save_for_backward(A, b, x, out)
+        return out
+
+    @staticmethod
+    def backward(ctx, grad_out):
+        A, b, x, out = ctx.saved_tensors
+        n, c, h, w = x.shape
+        rows = align_corners_coords(A.size(2), h, x.device)
+        cols = align_corners_coords(A.size(3), w, x.device)
+        i0, i1, wy = rows
+        j0, j1, wx = cols
+
+        ab = torch.cat([A, b], dim=1)
+        grad_ab = torch.zeros_like(ab)
+        grad_x = torch.empty_like(x) if ctx.needs_input_grad[2] else None
+
+        for start in range(0, h, ctx.step):
+            end = min(start + ctx.step, h)
+
+            # Through the tanh
+            out_band = out[:, :, start:end]
+            grad = grad_out[:, :, start:end] * (1 - out_band * out_band)
+
+            if grad_x is not None:
+                A_band = BilinearAffineTanh.upsample_band(
+                    ab[:, :c], rows, cols, start, end
+                )
+                torch.mul(grad, A_band, out=grad_x[:, :, start:end])
+
+            # Gradients of up(A), up(b), through the horizontal then vertical lerp
+            grad_band = torch.cat([grad * x[:, :, start:end], grad], dim=1)
+            grad_rows = grad_band.new_zeros(n, 2 * c, end - start, A.size(3))
+            grad_rows.index_add_(3, j0, grad_band * (1 - wx))
+            grad_rows.index_add_(3, j1, grad_band * wx)
+
+            wy_band = wy[start:end].view(-1, 1)
+            grad_ab.index_add_(2, i0[start:end], grad_rows * (1 - wy_band))
+            grad_ab.index_add_(2, i1[start:end], grad_rows * wy_band)
+
+        grad_A, grad_b = grad_ab.chunk(2, dim=1)
+        return grad_A, grad_b, grad_x, None
+
+
+class StopForward(Exception):
+    """
+    Raised by a collecting GlobalStatistics once it has seen its input.
+    """
+
+
+class GlobalStatistics:
+    """
+    Per (sample, channel) mean and variance of the input of an
+    AdaptiveInstanceNorm or CALayer over the whole frame, for band / tile
+    wise inference.
+
+    Until frozen, every call accumulates the rows `window` (the part of the
+    current band not in its halo) and cuts the forward pass short with
+    StopForward. Once frozen, the frame statistics replace the live ones.
+    See models/tiling.py
+    """
+
+    def __init__(self):
+        self.window = slice(None)
+        self.frozen = False
+        self.seen = False
+        self.mean = None
+        self.var = None
+
+        self._sum = 0.0
+        self._sum_sq = 0.0
+        self._count = 0
+
+    def __call__(self, x: "Tensor[N,C,H,W]") -> "Tuple[Tensor,Tensor]":
+        if self.frozen:
+            return self.mean.to(x.dtype), self.var.to(x.dtype)
+
+        # float64 sums, E[x^2] - E[x]^2 cancels otherwise
+        valid = x[:, :, self.window].double()
+        self._sum = self._sum + valid.sum(dim=(2, 3), keepdim=True)
+        self._sum_sq = self._sum_sq + (valid * valid).sum(dim=(2, 3), keepdim=True)
+        self._count += valid.shape[2] * valid.shape[3]
+        self.seen = True
+
+        raise StopForward
+
+    def freeze(self):
+        assert self._count, "No statistics collected"
+        mean = self._sum / self._count
+        var = (self._sum_sq / self._count - mean * mean).clamp(min=0)
+
+        self.mean, self.var = mean.float(), var.float()
+        self.frozen = True
 
 
 class AdaptiveInstanceNorm(nn.Module):
-    def __init__(self, n):
+    def __init__(self, n, fused: bool = False):
         super(AdaptiveInstanceNorm, self).__init__()
 
         self.w_0 = nn.Parameter(torch.Tensor([1.0]))
@@ -11,17 +237,81 @@ class AdaptiveInstanceNorm(nn.Module):
 
         self.ins_norm = nn.InstanceNorm2d(n, momentum=0.999, eps=0.001, affine=True)
 
+        # Fuse with the following LeakyReLU, see forward_leaky_relu
+        self.fused = fused
+
+        # Frame statistics for tiled inference, see GlobalStatistics
+        self.statistics = None
+
     def forward(self, x):
-        return self.w_0 * x + self.w_1 * self.ins_norm(x)
+        if self.statistics is not None and not torch.jit.is_scripting():
+            return self._forward_global_statistics(x)
+
+        # Instance norm statistics in fp32 for reduced precision inputs
+        x_norm = self.ins_norm(x.float()).to(x.dtype)
+        return self.w_0.to(x.dtype) * x + self.w_1.to(x.dtype) * x_norm
+
+    @torch.jit.unused
+    def _forward_global_statistics(self, x):
+        mean, var = self.statistics(x)
+        gamma = self.ins_norm.weight.view(1, -1, 1, 1).to(x.dtype)
+        beta = self.ins_norm.bias.view(1, -1, 1, 1).to(x.dtype)
+
+        x_norm = (x - mean) * torch.rsqrt(var + self.ins_norm.eps) * gamma + beta
+        return self.w_0.to(x.dtype) * x + self.w_1.to(x.dtype) * x_norm
+
+    def forward_leaky_relu(
+        self, x, negative_slope: float = 0.2, out: Optional[torch.Tensor] = None
+    ):
+        """
+        F.leaky_relu(self(x), negative_slope), fused if self.fused
+
+        :param out: optional preallocated output (eg: a channel slice of a
+            larger buffer). Inference only, out= ops are not differentiable.
+        """
+        if self.statistics is not None and not torch.jit.is_scripting():
+            y = F.leaky_relu(self._forward_global_statistics(x), negative_slope)
+            return y if out is None else out.copy_(y)
+        if out is not None:
+            return self._leaky_relu_into(x, negative_slope, out)
+        if self.fused and not torch.jit.is_scripting():
+            return self._fused_leaky_relu(x, negative_slope)
+        return F.leaky_relu(self(x), negative_slope)
+
+    @torch.jit.unused
+    def _fused_leaky_relu(self, x, negative_slope: float):
+        return AdaptiveInstanceNormLeakyReLU.apply(
+            x,
+            self.w_0,
+            self.w_1,
+            self.ins_norm.weight,
+            self.ins_norm.bias,
+            self.ins_norm.eps,
+            negative_slope,
+        )
+
+    @torch.jit.unused
+    def _leaky_relu_into(self, x, negative_slope: float, out):
+        scale, shift, _, _ = AdaptiveInstanceNormLeakyReLU.scale_shift(
+            x,
+            self.w_0,
+            self.w_1,
+            self.ins_norm.weight,
+            self.ins_norm.bias,
+            self.ins_norm.eps,
+        )
+        torch.addcmul(shift.to(x.dtype), x, scale.to(x.dtype), out=out)
+        return F.leaky_relu_(out, negative_slope)
 
 
 class PALayer(nn.Module):
-    def __init__(self, channel: int):
+    def __init__(self, channel: int, hidden: "Optional[int]" = None):
         super(PALayer, self).__init__()
+        hidden = hidden or channel // 8
         self.pa = nn.Sequential(
-            nn.Conv2d(channel, channel // 8, 1, padding=0, bias=True),
+            nn.Conv2d(channel, hidden, 1, padding=0, bias=True),
             nn.LeakyReLU(0.2, inplace=True),
-            nn.Conv2d(channel // 8, 1, 1, padding=0, bias=True),
+            nn.Conv2d(hidden, 1, 1, padding=0, bias=True),
             nn.Sigmoid(),
         )
 
@@ -31,17 +321,29 @@ class PALayer(nn.Module):
 
 
 class CALayer(nn.Module):
-    def __init__(self, channel: int):
+    def __init__(self, channel: int, hidden: "Optional[int]" = None):
         super(CALayer, self).__init__()
+        hidden = hidden or channel // 8
         self.avg_pool = nn.AdaptiveAvgPool2d(1)
         self.ca = nn.Sequential(
-            nn.Conv2d(channel, channel // 8, 1, padding=0, bias=True),
+            nn.Conv2d(channel, hidden, 1, padding=0, bias=True),
             nn.LeakyReLU(0.2, inplace=True),
-            nn.Conv2d(channel // 8, channel, 1, padding=0, bias=True),
+            nn.Conv2d(hidden, channel, 1, padding=0, bias=True),
             nn.Sigmoid(),
         )
 
+        # Frame statistics for tiled inference, see GlobalStatistics
+        self.statistics = None
+
     def forward(self, x):
-        y = self.avg_pool(x)
+        if self.statistics is not None and not torch.jit.is_scripting():
+            y = self._pool_global_statistics(x)
+        else:
+            y = self.avg_pool(x)
         y = self.ca(y)
         return x * y
+
+    @torch.jit.unused
+    def _pool_global_statistics(self, x):
+        mean, _ = self.statistics(x)
+        return mean
@@ -0,0 +1,270 @@
+"""
+Structured channel pruning of DeepAtrousGuidedFilter into a smaller dense model.
+
+Channels removed:
+    branch: output channels of every atrous branch (conv{i}, norm{i}) of the
+        LRNet blocks and of the guided map, with the matching input channels
+        of the block fusion conv (over the torch.cat of the branches).
+    stream: the LRNet residual width. Every layer reading or writing it is
+        sliced alike: conv1 / norm1, the branch inputs, fusion conv, norm and
+        attention of every block (the residual additions), res_final, the gate
+        inputs (one slice per residual add), deconv2 / norm5 and deconv1.
+        Channel / pixel attention hidden widths are kept.
+
+Layers keep their surviving weights, so the pruned model is a good starting
+point for fine-tuning. architecture(G) gives its widths (arch.json from
+prune.py, read back through pruned_arch in config.py).
+
+Channel importance, from the AdaptiveInstanceNorm following the channel:
+    norm: |w_1 * gamma|, the scale of its normalised path.
+    taylor: (gamma * dL/dgamma + beta * dL/dbeta)^2 summed over calibration
+        batches, the first order Taylor estimate of the loss change when the
+        channel is removed (https://arxiv.org/abs/1906.10771).
+Branch channels are ranked globally, scores normalised by their branch mean.
+Stream channels sum the normalised scores of every norm writing the stream.
+"""
+import math
+
+import torch
+import torch.nn as nn
+
+from models.fusion import branch_ids
+from models.lr_net import (
+    ShareSepConv,
+    SmoothDilatedResidualAtrousBlock,
+    SmoothDilatedResidualAtrousGuidedBlock,
+)
+from models.model_utils import AdaptiveInstanceNorm
+
+# Typing
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.typing_alias import *
+
+criteria = ["norm", "taylor"]
+
+atrous_blocks = (
+    SmoothDilatedResidualAtrousBlock,
+    SmoothDilatedResidualAtrousGuidedBlock,
+)
+
+
+def _round_up(x: int, multiple: int) -> int:
+    return int(math.ceil(x / multiple)) * multiple
+
+
+def branch_norms(G: "nn.Module") -> "Dict[str,List[AdaptiveInstanceNorm]]":
+    """
+    Norms of the dilation 1, 2, 4, 8 branches of every atrous block, by name.
+    """
+    return {
+        name: [getattr(block, f"norm{i}") for i in branch_ids]
+        for name, block in G.named_modules()
+        if isinstance(block, atrous_blocks)
+    }
+
+
+def stream_norms(lr: "nn.Module") -> "List[AdaptiveInstanceNorm]":
+    """
+    Norms writing to the LRNet residual stream.
+    """
+    blocks = [
+        m for m in lr.modules() if isinstance(m, SmoothDilatedResidualAtrousBlock)
+    ]
+    return (
+        [lr.norm1]
+        + [block.norm for block in blocks]
+        + [lr.res_final.norm1, lr.res_final.norm2, lr.norm5]
+    )
+
+
+def norm_importance(G: "nn.Module") -> "Dict[nn.Module,Tensor]":
+    return {
+        norm: (norm.w_1 * norm.ins_norm.weight).abs().detach()
+        for norm in G.modules()
+        if isinstance(norm, AdaptiveInstanceNorm)
+    }
+
+
+def taylor_importance(
+    G: "nn.Module", batches: "Iterable[Tuple[Tensor,Tensor]]", loss_fn: "Callable"
+) -> "Dict[nn.Module,Tensor]":
+    """
+    :param batches: (source, target) pairs on the device of G
+    :param loss_fn: loss(output, target)
+    """
+    norms = [m for m in G.modules() if isinstance(m, AdaptiveInstanceNorm)]
+    scores = {norm: torch.zeros_like(norm.ins_norm.weight) for norm in norms}
+
+    G.eval()
+    for source, target in batches:
+        G.zero_grad()
+        loss_fn(G(source), target).backward()
+
+        with torch.no_grad():
+            for norm in norms:
+                ins_norm = norm.ins_norm
+                scores[norm] += (
+                    ins_norm.weight * ins_norm.weight.grad
+                    + ins_norm.bias * ins_norm.bias.grad
+                ) ** 2
+
+    G.zero_grad()
+    return scores
+
+
+def _slice_conv(conv: "nn.Conv2d", out_idx=None, in_idx=None):
+    assert conv.groups == 1, "Grouped convs are not pruned"
+    weight = conv.weight.detach()
+    if out_idx is not None:
+        weight = weight[out_idx]
+        conv.out_channels = len(out_idx)
+        if conv.bias is not None:
+            conv.bias = nn.Parameter(conv.bias.detach()[out_idx].clone())
+    if in_idx is not None:
+        weight = weight[:, in_idx]
+        conv.in_channels = len(in_idx)
+    conv.weight = nn.Parameter(weight.clone())
+
+
+def _slice_norm(norm: "AdaptiveInstanceNorm", idx):
+    ins_norm = norm.ins_norm
+    ins_norm.weight = nn.Parameter(ins_norm.weight.detach()[idx].clone())
+    ins_norm.bias = nn.Parameter(ins_norm.bias.detach()[idx].clone())
+    ins_norm.num_features = len(idx)
+
+
+def _slice_attention(block: "nn.Module", idx):
+    _slice_conv(block.calayer.ca[0], in_idx=idx)
+    _slice_conv(block.calayer.ca[2], out_idx=idx)
+    _slice_conv(block.palayer.pa[0], in_idx=idx)
+
+
+def _top(scores: "Tensor", keep: int) -> "Tensor":
+    """
+    Indices of the `keep` largest scores, in channel order.
+    """
+    return scores.topk(keep).indices.sort().values
+
+
+def prune_branches(
+    G: "nn.Module",
+    scores: "Dict[nn.Module,Tensor]",
+    ratio: float,
+    multiple: int = 4,
+) -> "List[List]":
+    """
+    Remove `ratio` of the atrous branch channels of G (global ranking), in
+    place. Widths are rounded up to a multiple of `multiple`.
+
+    :return: (block, branch, channels before, after) rows
+    """
+    blocks = dict(G.named_modules())
+    norms = branch_norms(G)
+
+    normalised = {
+        norm: scores[norm] / scores[norm].mean().clamp(min=1e-12)
+        for block_norms in norms.values()
+        for norm in block_norms
+    }
+    threshold = torch.quantile(torch.cat(list(normalised.values())).float(), ratio)
+
+    report = []
+    for name, block_norms in norms.items():
+        block = blocks[name]
+        in_idx, offset = [], 0
+        for i, norm in zip(branch_ids, block_norms):
+            assert isinstance(
+                getattr(block, f"pre_conv{i}"), ShareSepConv
+            ), "Prune before fuse_for_inference"
+
+            channels = norm.ins_norm.num_features
+            keep = int((normalised[norm] > threshold).sum())
+            keep = min(max(_round_up(keep, multiple), multiple), channels)
+            idx = _top(normalised[norm], keep)
+
+            _slice_conv(getattr(block, f"conv{i}"), out_idx=idx)
+            _slice_norm(norm, idx)
+            in_idx.append(idx + offset)
+            offset += channels
+            report.append([name, i, channels, keep])
+
+        # Fusion conv over torch.cat of the branches
+        _slice_conv(block.conv, in_idx=torch.cat(in_idx))
+
+    return report
+
+
+def prune_stream(
+    lr: "nn.Module",
+    scores: "Dict[nn.Module,Tensor]",
+    ratio: float,
+    multiple: int = 4,
+) -> "Tuple[int,int]":
+    """
+    Remove `ratio` of the LRNet residual stream channels, in place.
+
+    :return: channels before, after
+    """
+    channels = lr.conv1.out_channels
+    importance = sum(
+        scores[norm] / scores[norm].mean().clamp(min=1e-12)
+        for norm in stream_norms(lr)
+    )
+    keep = min(_round_up(int(round(channels * (1 - ratio))), multiple), channels)
+    idx = _top(importance, max(keep, multiple))
+
+    _slice_conv(lr.conv1, out_idx=idx)
+    _slice_norm(lr.norm1, idx)
+
+    for block in lr.modules():
+        if not isinstance(block, SmoothDilatedResidualAtrousBlock):
+            continue
+        for i in branch_ids:
+            _slice_conv(getattr(block, f"conv{i}"), in_idx=idx)
+        _slice_conv(block.conv, out_idx=idx)
+        _slice_norm(block.norm, idx)
+        _slice_attention(block, idx)
+
+    res_final = lr.res_final
+    _slice_conv(res_final.conv1, out_idx=idx, in_idx=idx)
+    _slice_norm(res_final.norm1, idx)
+    _slice_conv(res_final.conv2, out_idx=idx, in_idx=idx)
+    _slice_norm(res_final.norm2, idx)
+    _slice_attention(res_final, idx)
+
+    # Gate over torch.cat of the residual adds
+    residual_adds = lr.gate.out_channels
+    _slice_conv(
+        lr.gate, in_idx=torch.cat([idx + k * channels for k in range(residual_adds)])
+    )
+
+    _slice_conv(lr.deconv2, out_idx=idx, in_idx=idx)
+    _slice_norm(lr.norm5, idx)
+    _slice_conv(lr.deconv1, in_idx=idx)
+
+    return channels, len(idx)
+
+
+def architecture(G: "nn.Module") -> "Dict":
+    """
+    Widths of G, as read by DeepAtrousGuidedFilter (pruned_arch).
+    """
+    lr = G.lr
+    return {
+        "lrnet": {
+            "channels": lr.conv1.out_channels,
+            "attention_channels": lr.res_final.calayer.ca[0].out_channels,
+            "branch_channels": {
+                name: [norm.ins_norm.num_features for norm in norms]
+                for name, norms in branch_norms(lr).items()
+            },
+        },
+        # Other guided map variants (models/guided_map.py) are not pruned
+        "guided_map": [
+            norm.ins_norm.num_features for norm in branch_norms(G.guided_map)[""]
+        ]
+        if isinstance(G.guided_map, SmoothDilatedResidualAtrousGuidedBlock)
+        else None,
+    }
@@ -0,0 +1,85 @@
+"""
+Post training static int8 quantization of LRNet (FX graph mode).
+
+LRNet holds most of the FLOPs. Its convs, CALayer / PALayer, gates and
+residual adds run in int8, while AdaptiveInstanceNorm (statistics computed per
+instance, at runtime) stays in float with (de)quantization around it.
+The guided map and the guided filter are left in float.
+
+Quantized kernels are CPU only (fbgemm / x86 on x86, qnnpack on ARM).
+"""
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.fx.custom_config import PrepareCustomConfig
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+from models.export import graph_friendly
+from models.model_utils import AdaptiveInstanceNorm
+
+# Typing
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.typing_alias import *
+
+
+def prepare_lrnet(G: "nn.Module", backend: str = "fbgemm") -> "nn.Module":
+    """
+    Copy of G (on CPU) whose LRNet records activation ranges (observers).
+    """
+    torch.backends.quantized.engine = backend
+
+    G = graph_friendly(G).cpu()
+    qconfig_mapping = get_default_qconfig_mapping(backend).set_object_type(
+        AdaptiveInstanceNorm, None
+    )
+    custom_config = PrepareCustomConfig().set_non_traceable_module_classes(
+        [AdaptiveInstanceNorm]
+    )
+
+    example = torch.zeros(1, G.lr.conv1.in_channels, 64, 64)
+    G.lr = prepare_fx(
+        G.lr, qconfig_mapping, (example,), prepare_custom_config=custom_config
+    )
+    return G
+
+
+def convert_lrnet(G: "nn.Module") -> "nn.Module":
+    G.lr = convert_fx(G.lr)
+    return G
+
+
+def quantize_lrnet(
+    G: "nn.Module", calibration: "Iterable[Tensor]", backend: str = "fbgemm"
+) -> "nn.Module":
+    """
+    int8 copy of G, LRNet calibrated on full frames.
+
+    :param G: float model with weights loaded (not folded)
+    :param calibration: frames (1, 3, H, W) in [-1, 1]
+    :param backend: quantized engine
+    """
+    G = prepare_lrnet(G, backend=backend)
+
+    with torch.no_grad():
+        for x in calibration:
+            G(x.cpu())
+
+    return convert_lrnet(G)
+
+
+def load_quantized(
+    G: "nn.Module", path: "Path", backend: str = "fbgemm"
+) -> "nn.Module":
+    """
+    int8 model from a checkpoint saved by quantize.py.
+
+    The quantized graph is rebuilt from G, then scales, zero points and
+    packed int8 weights are loaded.
+    """
+    ckpt = torch.load(path, map_location="cpu")
+    assert ckpt["quant_backend"] == backend, f"{path} was quantized for {backend}"
+
+    G = convert_lrnet(prepare_lrnet(G, backend=backend))
+    G.load_state_dict(ckpt["state_dict"])
+    return G.eval()
@@ -0,0 +1,145 @@
+"""
+Receptive field of DeepAtrousGuidedFilter, derived from its layers.
+
+Every layer is a stride 1, same padded conv (ShareSepConv, dilated convs,
+1x1 attention convs), so the radius of a chain is the sum of its layer radii
+and that of an atrous block the widest of its branches (ShareSepConv + dilated
+conv) plus its fusion conv. Scales change through the bilinear downsample
+(lr_scale), the pixel (un)shuffle around LRNet and the bilinear upsampling of
+the guided filter coefficients.
+
+AdaptiveInstanceNorm and CALayer statistics are global, they are not part
+of the (local) receptive field.
+"""
+from dataclasses import dataclass
+
+import torch.nn as nn
+
+from models.fusion import FoldedSmoothConv, branch_ids
+from models.guided_map import (
+    PointwiseGuidedMap,
+    SeparableAtrousBranch,
+    SeparableAtrousGuidedBlock,
+)
+from models.lr_net import ShareSepConv, SmoothDilatedResidualAtrousBlock
+
+# Typing
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.typing_alias import *
+
+
+@dataclass
+class ReceptiveField:
+    """
+    Receptive field radii of DeepAtrousGuidedFilter.
+
+    :param lrnet: LRNet, in its input pixels (lr_scale / pixelshuffle_ratio)
+    :param guided_map: guided map, in pixels of its input (low or full scale)
+    :param lr: guided filter coefficients A, b, in low resolution pixels
+    :param full: output, in full resolution pixels. Upper bound, through the
+        bilinear down and upsampling (at the smallest lr_scale G may pick).
+    """
+
+    lrnet: int
+    guided_map: int
+    lr: int
+    full: int
+
+
+def layer_radius(module: "nn.Module") -> int:
+    """
+    Radius of a stride 1, same padded layer (0 for pointwise layers).
+    """
+    if isinstance(module, nn.Conv2d):
+        return module.dilation[0] * (module.kernel_size[0] - 1) // 2
+    if isinstance(module, ShareSepConv):
+        return module.padding
+    if isinstance(module, FoldedSmoothConv):
+        return module.padding[0]
+    if isinstance(module, SeparableAtrousBranch):
+        return sum(layer_radius(layer) for layer in module.children())
+    return 0
+
+
+def branch_radii(block: "nn.Module") -> "Dict[int,int]":
+    """
+    Radius of every atrous branch (ShareSepConv then dilated conv) of a block.
+    Folded branches (models/fusion.py) have an identity pre_conv.
+    """
+    return {
+        i: layer_radius(getattr(block, f"pre_conv{i}"))
+        + layer_radius(getattr(block, f"conv{i}"))
+        for i in branch_ids
+    }
+
+
+def block_radius(block: "nn.Module") -> int:
+    """
+    Widest branch of an atrous block, followed by its fusion conv.
+    """
+    if isinstance(block, PointwiseGuidedMap):
+        return 0
+    if isinstance(block, SeparableAtrousGuidedBlock):
+        radii = [layer_radius(branch) for branch in block.branches]
+    else:
+        radii = list(branch_radii(block).values())
+    return max(radii) + layer_radius(block.conv)
+
+
+def lrnet_radius(lr: "nn.Module") -> int:
+    radius = layer_radius(lr.conv1)
+    for module in lr.modules():
+        if isinstance(module, SmoothDilatedResidualAtrousBlock):
+            radius += block_radius(module)
+
+    radius += layer_radius(lr.res_final.conv1) + layer_radius(lr.res_final.conv2)
+    radius += layer_radius(lr.gate)
+    radius += layer_radius(lr.deconv2) + layer_radius(lr.deconv1)
+    return radius
+
+
+def receptive_field(G: "nn.Module") -> "ReceptiveField":
+    """
+    Receptive field radii of DeepAtrousGuidedFilter G.
+    """
+    ratio = G.pixelshuffle_ratio
+    lrnet = lrnet_radius(G.lr)
+    guided_map = block_radius(G.guided_map)
+
+    # An LRNet input pixel covers ratio x ratio low resolution pixels
+    lr = max(lrnet * ratio + ratio - 1, guided_map)
+    lr += G.gf.radius + sum(layer_radius(module) for module in G.gf.conv_a)
+
+    # Bilinear (align corners) downsample and upsample: one pixel each side
+    full = max(G.lr_factor() * (lr + 1) + 1, guided_map)
+
+    return ReceptiveField(lrnet=lrnet, guided_map=guided_map, lr=lr, full=full)
+
+
+def branch_table(G: "nn.Module") -> "List[List]":
+    """
+    (block, branch, ShareSepConv kernel, dilation, radius) for every atrous
+    branch of G, radii in pixels of the block input.
+    """
+    rows = []
+    for name, block in G.named_modules():
+        if isinstance(block, SeparableAtrousBranch):
+            dilation = block.depthwise.dilation[0]
+            kernel = block.pre_conv.kernel_size
+            rows.append([name, dilation, kernel, dilation, layer_radius(block)])
+            continue
+        if not hasattr(block, "pre_conv1"):
+            continue
+        for i, radius in branch_radii(block).items():
+            pre_conv = getattr(block, f"pre_conv{i}")
+            conv = getattr(block, f"conv{i}")
+            if isinstance(conv, FoldedSmoothConv):
+                pre_conv, conv = conv.pre_conv, conv.conv
+
+            # ShareSepConv, or its frozen nn.Conv2d (models/fusion.py)
+            kernel = pre_conv.kernel_size
+            kernel = kernel[0] if isinstance(kernel, tuple) else kernel
+            rows.append([name, i, kernel, conv.dilation[0], radius])
+    return rows
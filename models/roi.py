@@ -0,0 +1,127 @@
+"""
+Region of interest restoration: G(image)[box] without restoring the frame.
+
+Only the context a box depends on is computed (see models/receptive_field.py):
+    1. The low resolution frame over the low resolution rows / cols the box
+        upsamples its coefficients from, plus a halo (the receptive field of
+        the coefficients A, b, by default), aligned to the pixel shuffle. It
+        is resampled from the full resolution frame at the whole frame's
+        bilinear grid, reading only the rows / cols it samples.
+    2. LRNet, the guided map and the guided filter coefficients on it.
+    3. The full resolution guided map over the box plus its receptive field,
+        and the upsampled coefficients applied over the box.
+Cost thus scales with the box area plus its halo, not the frame size.
+
+Convs zero pad at context borders, which lie a receptive field away from the
+box (or at the frame border), so local operations match whole frame inference
+exactly. AdaptiveInstanceNorm and CALayer statistics are those of the context
+window, so outputs closely follow (but do not exactly match) G(image), as with
+tiled inference. A smaller halo trades further accuracy for speed.
+"""
+import math
+
+import torch
+from torch.nn import functional as F
+
+from models.model_utils import BilinearAffineTanh, align_corners_coords
+from models.receptive_field import receptive_field
+from utils.ops import unpixel_shuffle
+
+# Typing
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.typing_alias import *
+
+
+def _context(start: int, end: int, halo: int, size: int, ratio: int):
+    """
+    start:end grown by halo, clipped to the frame and aligned to ratio.
+    """
+    start = max(start - halo, 0) // ratio * ratio
+    end = min(int(math.ceil((end + halo) / ratio)) * ratio, size)
+    return start, end
+
+
+def _bilinear_window(x, rows, cols):
+    """
+    Bilinear resampling of x at the given rows / cols (i0, i1, weight of i1).
+    """
+    i0, i1, wy = rows
+    j0, j1, wx = cols
+    i0, i1, wy = i0.view(-1, 1), i1.view(-1, 1), wy.view(-1, 1)
+
+    top = torch.lerp(x[:, :, i0, j0], x[:, :, i0, j1], wx)
+    bottom = torch.lerp(x[:, :, i1, j0], x[:, :, i1, j1], wx)
+    return torch.lerp(top, bottom, wy)
+
+
+def restore_roi(
+    G: "nn.Module",
+    image: "Tensor[N,C,H,W]",
+    box: "Tuple[int,int,int,int]",
+    halo: "Optional[int]" = None,
+) -> "Tensor[N,C,h,w]":
+    """
+    Restore box of image. See module docstring.
+
+    :param G: DeepAtrousGuidedFilter, fp32
+    :param image: full resolution frame(s), in [-1, 1]
+    :param box: x0, y0, x1, y1 in pixels (x1, y1 exclusive)
+    :param halo: context of the low resolution stage, in low resolution
+        pixels. Defaults to the receptive field of the coefficients.
+    :return: restored crop, G(image)[:, :, y0:y1, x0:x1]
+    """
+    assert G.precision == "fp32", "ROI restoration runs in fp32"
+
+    h, w = image.shape[-2:]
+    x0, y0, x1, y1 = box
+    assert 0 <= x0 < x1 <= w and 0 <= y0 < y1 <= h, f"Box {box} outside {w}x{h}"
+
+    field = receptive_field(G)
+    halo = field.lr if halo is None else halo
+    ratio = G.pixelshuffle_ratio
+    device = image.device
+
+    # Low resolution rows / cols the box is upsampled from
+    scale = G.lr_scale_for(h, w)
+    h_lr, w_lr = int(h * scale), int(w * scale)
+    rows = align_corners_coords(h_lr, h, device)
+    cols = align_corners_coords(w_lr, w, device)
+    top, bottom = rows[0][y0].item(), rows[1][y1 - 1].item() + 1
+    left, right = cols[0][x0].item(), cols[1][x1 - 1].item() + 1
+    top, bottom = _context(top, bottom, halo, h_lr, ratio)
+    left, right = _context(left, right, halo, w_lr, ratio)
+
+    # 1. Low resolution context, on the grid of G.forward_lr's downsample
+    down_rows = align_corners_coords(h, h_lr, device)
+    down_cols = align_corners_coords(w, w_lr, device)
+    x_lr = _bilinear_window(
+        image,
+        tuple(t[top:bottom] for t in down_rows),
+        tuple(t[left:right] for t in down_cols),
+    )
+
+    # 2. Low resolution stage
+    y_lr = F.pixel_shuffle(G.lr(unpixel_shuffle(x_lr, ratio)), ratio)
+    A, b = G.gf.coefficients(G.guided_map(x_lr), y_lr)
+
+    # 3. Full resolution guided map and guided filter output over the box
+    radius = field.guided_map
+    hr_top, hr_bottom = max(y0 - radius, 0), min(y1 + radius, h)
+    hr_left, hr_right = max(x0 - radius, 0), min(x1 + radius, w)
+    guide = G.guided_map(image[:, :, hr_top:hr_bottom, hr_left:hr_right])
+    guide = guide[:, :, y0 - hr_top : y1 - hr_top, x0 - hr_left : x1 - hr_left]
+
+    # Upsampling indices relative to the context
+    i0, i1, wy = (t[y0:y1] for t in rows)
+    j0, j1, wx = (t[x0:x1] for t in cols)
+    A_box, b_box = BilinearAffineTanh.upsample_band(
+        torch.cat([A, b], dim=1),
+        (i0 - top, i1 - top, wy),
+        (j0 - left, j1 - left, wx),
+        0,
+        y1 - y0,
+    ).chunk(2, dim=1)
+
+    return torch.tanh(torch.addcmul(b_box, A_box, guide))
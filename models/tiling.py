@@ -0,0 +1,274 @@
+"""
+Tiled full resolution inference for DeepAtrousGuidedFilter.
+
+The frame is chopped into overlapping tiles (see utils.ops.chop_patches),
+tiles are restored in batches and feather blended into the output. Tiles
+are sized from a pixel budget and overlap by the receptive field, capped at
+a quarter tile (tile_side), so peak activation memory is bounded by the
+budget, not the frame size. Frames within a single tile run whole.
+
+AdaptiveInstanceNorm and CALayer see per tile statistics, and the capped
+overlap truncates context at tile seams, so tiled outputs closely follow
+(but do not exactly match) whole frame inference.
+
+tiled_forward_global_statistics matches whole frame inference instead (up to
+float tolerance), in two passes:
+    1. The low resolution stage (LRNet, guided map of the low resolution
+        frame, guided filter coefficients) runs on the whole frame, at
+        lr_scale^2 of the full resolution pixels. Statistics of the full
+        resolution guided map are collected over bands of rows.
+    2. The full resolution guided map runs tile by tile with those statistics
+        frozen, each tile with a halo of its (local) receptive field, and the
+        upsampled coefficients are applied per tile.
+"""
+import math
+
+import torch
+from torch.nn import functional as F
+
+from models.model_utils import (
+    AdaptiveInstanceNorm,
+    BilinearAffineTanh,
+    CALayer,
+    GlobalStatistics,
+    StopForward,
+    align_corners_coords,
+)
+from models.receptive_field import block_radius, receptive_field
+from utils.ops import chop_patches, feather_window
+
+# Typing
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.typing_alias import *
+
+
+def _round_up(x: int, multiple: int) -> int:
+    return int(math.ceil(x / multiple)) * multiple
+
+
+def tile_side(
+    G: "nn.Module",
+    tile_size: "Union[int,str]" = "auto",
+    overlap: "Union[int,str]" = "auto",
+    pixel_budget: int = 4 * 2 ** 20,
+    tile_batch_size: int = 1,
+) -> "Tuple[int, int]":
+    """
+    Tile side and overlap of tiled_forward.
+
+    Tiles are at least 4 overlaps wide, so they are restored at most
+    (4 / 3)^2 times per output pixel. "auto" tiles are the largest within
+    pixel_budget. The "auto" overlap is the receptive field of G, capped at
+    tile_size // 4: ~1800 px for the published model, wider than any tile
+    within practical budgets. Past the cap, pixels near tile seams miss
+    context the whole frame forward sees. That is the seam error, on top of
+    the per tile norm statistics: benchmarks/global_stats.py reports it.
+    Frames that fit a single tile are not tiled, so they have no seams.
+
+    :param tile_size: tile side, "auto": from pixel_budget
+    :param overlap: pixels, "auto": receptive field of G, capped
+    :param pixel_budget: pixels per forward (tile_batch_size tiles), bounds the
+        peak activation memory
+    :return: tile side (a multiple of G.lr_factor() * pixelshuffle_ratio),
+        overlap
+    """
+    # lr_scale downsample followed by unpixelshuffle
+    multiple = G.lr_factor() * G.pixelshuffle_ratio
+
+    if tile_size == "auto":
+        side = int(math.sqrt(pixel_budget / tile_batch_size))
+        tile_size = max(side // multiple * multiple, multiple)
+    else:
+        tile_size = _round_up(tile_size, multiple)
+
+    if overlap == "auto":
+        overlap = min(receptive_field(G).full, tile_size // 4)
+    elif overlap > tile_size // 4:
+        raise ValueError(
+            f"tile_overlap {overlap} exceeds tile_size // 4 ({tile_size // 4}). "
+            "Use larger tiles or a smaller tile_overlap."
+        )
+
+    return tile_size, overlap
+
+
+def tiled_forward(
+    G: "nn.Module",
+    x_hr: "Tensor[N,C,H,W]",
+    tile_size: "Union[int,str]" = "auto",
+    overlap: "Union[int,str]" = "auto",
+    tile_batch_size: int = 1,
+    pixel_budget: int = 4 * 2 ** 20,
+    forward_fn: "Optional[Callable]" = None,
+) -> "Tensor[N,C,H,W]":
+    """
+    Restore x_hr tile by tile.
+
+    Restored tiles are feather blended into a preallocated output, one batch
+    at a time: besides the input and output frames, memory holds a single
+    batch of tiles.
+
+    :param G: DeepAtrousGuidedFilter
+    :param x_hr: full resolution frame(s)
+    :param tile_size, overlap, pixel_budget: see tile_side
+    :param tile_batch_size: tiles restored per forward pass
+    :param forward_fn: restores a batch of tiles (eg: an exported G), default G
+    """
+    n, c, h, w = x_hr.shape
+    multiple = G.lr_factor() * G.pixelshuffle_ratio
+    tile_size, overlap = tile_side(
+        G, tile_size, overlap, pixel_budget, tile_batch_size
+    )
+
+    forward_fn = forward_fn or G
+    if h <= tile_size and w <= tile_size:
+        return forward_fn(x_hr)
+
+    def _geometry(size: int):
+        if size <= tile_size:
+            tile = _round_up(size, multiple)
+            return tile, tile, 1, tile - size
+
+        # Fewest tiles of at most tile_size, shrunk evenly to cover size
+        num = int(math.ceil((size - overlap) / (tile_size - overlap)))
+        tile = _round_up(int(math.ceil((size + (num - 1) * overlap) / num)), multiple)
+        stride = tile - overlap
+        return tile, stride, num, (num - 1) * stride + tile - size
+
+    tile_h, stride_h, _, pad_h = _geometry(h)
+    tile_w, stride_w, num_w, pad_w = _geometry(w)
+
+    # Views of x_pad, row major over the grid, batch minor
+    x_pad = F.pad(x_hr, (0, pad_w, 0, pad_h), mode="replicate")
+    patches = chop_patches(x_pad, tile_h, tile_w, stride_h, stride_w)
+
+    weight = feather_window(
+        tile_h, tile_w, tile_h - stride_h, tile_w - stride_w, device=x_hr.device
+    )
+    output = x_hr.new_zeros(n, c, h + pad_h, w + pad_w)
+    weight_sum = x_hr.new_zeros(h + pad_h, w + pad_w)
+
+    step = tile_batch_size * n
+    for i in range(0, len(patches), step):
+        restored = forward_fn(patches[i : i + step]) * weight
+        for j in range(0, len(restored), n):
+            tile = (i + j) // n
+            y = (tile // num_w) * stride_h
+            x = (tile % num_w) * stride_w
+            output[:, :, y : y + tile_h, x : x + tile_w] += restored[j : j + n]
+            weight_sum[y : y + tile_h, x : x + tile_w] += weight
+
+    return output[:, :, :h, :w].div_(weight_sum[:h, :w])
+
+
+def collect_global_statistics(
+    module: "nn.Module", x: "Tensor[N,C,H,W]", band_rows: int = 256, halo: int = 0
+) -> "List[GlobalStatistics]":
+    """
+    Attach GlobalStatistics to every AdaptiveInstanceNorm and CALayer of
+    module and freeze them to their values on module(x), streaming over bands
+    of rows.
+
+    Every pass over the bands collects the statistics of the first layer
+    (in call order) that is not frozen yet, and stops there. So each layer sees
+    inputs computed with the frame statistics of all the layers before it.
+    Layers must preserve the spatial size (stride 1, same padding).
+
+    :param halo: rows of context around each band, at least the receptive field
+        radius of module. Only rows of the band itself are accumulated.
+    """
+    statistics = []
+    for layer in module.modules():
+        if isinstance(layer, (AdaptiveInstanceNorm, CALayer)):
+            layer.statistics = GlobalStatistics()
+            statistics.append(layer.statistics)
+
+    h = x.shape[2]
+    with torch.no_grad():
+        while not all(stat.frozen for stat in statistics):
+            for start in range(0, h, band_rows):
+                end = min(start + band_rows, h)
+                top, bottom = max(start - halo, 0), min(end + halo, h)
+
+                for stat in statistics:
+                    stat.window = slice(start - top, end - top)
+                try:
+                    module(x[:, :, top:bottom])
+                except StopForward:
+                    pass
+
+            seen = [stat for stat in statistics if stat.seen and not stat.frozen]
+            assert seen, "Statistics layers not reached by forward"
+            for stat in seen:
+                stat.freeze()
+
+    return statistics
+
+
+def release_global_statistics(module: "nn.Module"):
+    """
+    Back to live (per input) statistics.
+    """
+    for layer in module.modules():
+        if isinstance(layer, (AdaptiveInstanceNorm, CALayer)):
+            layer.statistics = None
+
+
+def tiled_forward_global_statistics(
+    G: "nn.Module",
+    x_hr: "Tensor[N,C,H,W]",
+    tile_size: int = 512,
+    band_rows: int = 256,
+) -> "Tensor[N,C,H,W]":
+    """
+    Restore x_hr tile by tile, matching G(x_hr). See module docstring.
+
+    :param G: DeepAtrousGuidedFilter, fp32
+    :param x_hr: full resolution frame(s)
+    :param tile_size: side of the (non overlapping) output tiles
+    :param band_rows: rows per band when collecting statistics
+    """
+    h, w = x_hr.shape[-2:]
+    halo = block_radius(G.guided_map)
+
+    # Pass 1: low resolution stage on the whole frame
+    x_lr, y_lr = G.forward_lr(x_hr)
+    A, b = G.gf.coefficients(G.guided_map(x_lr), y_lr)
+    ab = torch.cat([A, b], dim=1)
+
+    rows = align_corners_coords(A.size(2), h, x_hr.device)
+    cols = align_corners_coords(A.size(3), w, x_hr.device)
+
+    try:
+        collect_global_statistics(G.guided_map, x_hr, band_rows=band_rows, halo=halo)
+
+        # Pass 2: full resolution guided map and guided filter output, per tile
+        output = torch.empty_like(x_hr)
+        for y0 in range(0, h, tile_size):
+            y1 = min(y0 + tile_size, h)
+            top, bottom = max(y0 - halo, 0), min(y1 + halo, h)
+
+            for x0 in range(0, w, tile_size):
+                x1 = min(x0 + tile_size, w)
+                left, right = max(x0 - halo, 0), min(x1 + halo, w)
+
+                guide = G.guided_map(x_hr[:, :, top:bottom, left:right])
+                guide = guide[:, :, y0 - top : y1 - top, x0 - left : x1 - left]
+
+                A_tile, b_tile = BilinearAffineTanh.upsample_band(
+                    ab,
+                    tuple(t[y0:y1] for t in rows),
+                    tuple(t[x0:x1] for t in cols),
+                    0,
+                    y1 - y0,
+                ).chunk(2, dim=1)
+
+                output[:, :, y0:y1, x0:x1] = torch.tanh(
+                    torch.addcmul(b_tile, A_tile, guide)
+                )
+    finally:
+        release_global_statistics(G.guided_map)
+
+    return output
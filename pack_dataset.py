@@ -0,0 +1,88 @@
+"""
+Pack Dataset Script
+
+Run as:
+python pack_dataset.py with xyz_config {other flags}
+
+Decodes the source / target pairs of every pack_splits (train, val, test) once
+into a uint8 memory mapped store next to its source dir (see
+utils/packed_store.py), then compares read throughput of the png and packed
+backends on the first pack_bench_images samples. Train / val with
+data_backend=packed to read from the store.
+"""
+# Libraries
+from sacred import Experiment
+import logging
+import time
+
+# Modules
+from config import initialise
+from dataloader import OLEDDataset
+from utils.benchmark import format_table
+from utils.packed_store import pack, store_dir
+from utils.tupperware import tupperware
+
+ex = Experiment("pack_dataset")
+ex = initialise(ex)
+
+
+@ex.config
+def pack_config():
+    pack_splits = ["train", "val", "test"]
+    pack_shard_gb = 4
+    pack_bench_images = 8
+
+
+def _read_throughput(dataset: "OLEDDataset", num_images: int) -> float:
+    """
+    Samples per second of dataset[i] over its first num_images samples.
+    """
+    num_images = min(num_images, len(dataset))
+    start = time.perf_counter()
+    for i in range(num_images):
+        dataset[i]
+    return num_images / (time.perf_counter() - start)
+
+
+@ex.automain
+def main(_run):
+    args = tupperware(_run.config)
+
+    rows = []
+    for split in args.pack_splits:
+        source_dir = getattr(args, f"{split}_source_dir")
+        if not source_dir or not source_dir.exists():
+            logging.info(f"No {split} images, skipping")
+            continue
+
+        dataset = OLEDDataset(args._replace(data_backend="png"), mode=split)
+        if not len(dataset):
+            logging.info(f"No {split} images in {source_dir}, skipping")
+            continue
+
+        directory = store_dir(dataset.source_dir)
+        start = time.perf_counter()
+        size = pack(
+            dataset.source_paths,
+            dataset.target_paths,
+            directory,
+            shard_bytes=int(args.pack_shard_gb * 2 ** 30),
+        )
+        elapsed = time.perf_counter() - start
+
+        packed = OLEDDataset(args._replace(data_backend="packed"), mode=split)
+        rows.append(
+            [
+                split,
+                len(dataset),
+                size / 2 ** 30,
+                elapsed,
+                _read_throughput(dataset, args.pack_bench_images),
+                _read_throughput(packed, args.pack_bench_images),
+                str(directory),
+            ]
+        )
+
+    headers = ["Split", "Samples", "Size (GB)", "Pack (s)"]
+    headers += ["png (samples / s)", "packed (samples / s)", "Store"]
+    logging.info("Packed stores\n" + format_table(headers, rows))
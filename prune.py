@@ -0,0 +1,128 @@
+"""
+Prune Script
+
+Run as:
+python prune.py with xyz_config {other flags}
+
+Structured channel pruning (see models/pruning.py): removes prune_ratio of the
+atrous branch channels of LRNet and the guided map and, with prune_width, of
+the LRNet residual width, ranked by prune_criterion (norm: AdaptiveInstanceNorm
+scale, taylor: first order Taylor on prune_taylor_images train images). Saves
+the smaller dense model to ckpts / {exp_name}-pruned (save_filename_latest_G and
+arch.json) and reports widths, conv MACs and latency before and after.
+
+Fine-tune it with train.py, flags
+exp_name={exp_name}-pruned pruned_arch=ckpts/{exp_name}-pruned/arch.json
+resume=True finetune=True
+"""
+# Libraries
+from sacred import Experiment
+import json
+import logging
+
+# Torch Libs
+import torch
+from torch.nn import functional as F
+
+# Modules
+from config import initialise
+from dataloader import OLEDDataset
+from models import get_model
+from models.pruning import (
+    architecture,
+    criteria,
+    norm_importance,
+    prune_branches,
+    prune_stream,
+    taylor_importance,
+)
+from utils.benchmark import conv_macs, format_table, time_fn
+from utils.train_helper import load_models
+from utils.tupperware import tupperware
+
+ex = Experiment("prune")
+ex = initialise(ex)
+
+
+@ex.config
+def prune_config():
+    prune_criterion = "norm"  # norm or taylor
+    prune_ratio = 0.5  # fraction of channels removed
+    prune_width = True  # also prune the LRNet residual (stream) width
+    prune_channel_multiple = 4  # pruned widths are multiples of this
+    prune_taylor_images = 16  # first images of the train set
+    prune_repeats = 3
+
+
+def _summary(G, x_hr, repeats: int):
+    """
+    Parameters, conv MACs (G) and latency (ms) of G on x_hr.
+    """
+    with torch.no_grad():
+        params = sum(p.numel() for p in G.parameters())
+        macs = conv_macs(G, x_hr) / 1e9
+        latency = time_fn(G, x_hr, repeats=repeats)
+    return [params, macs, latency]
+
+
+@ex.automain
+def main(_run):
+    args = tupperware(_run.config)
+    assert args.prune_criterion in criteria, f"Unknown criterion {args.prune_criterion}"
+    assert 0 <= args.prune_ratio < 1, "prune_ratio must be in [0, 1)"
+
+    G = get_model.model(args)
+    G, _, _, _, _ = load_models(G, g_optimizer=None, args=args, tag=args.inference_mode)
+    G = G.to(args.device).eval()
+
+    dataset = OLEDDataset(args, mode="val")
+    assert len(dataset), f"No val images in {args.val_source_dir}"
+    x_hr = dataset[0][0][None].to(args.device)
+    before = _summary(G, x_hr, args.prune_repeats)
+
+    if args.prune_criterion == "taylor":
+        train_dataset = OLEDDataset(args._replace(crop_size=None), mode="train")
+        num_images = min(args.prune_taylor_images, len(train_dataset))
+        batches = (
+            (source[None].to(args.device), target[None].to(args.device))
+            for source, target, _ in (train_dataset[i] for i in range(num_images))
+        )
+        scores = taylor_importance(G, batches, F.l1_loss)
+    else:
+        scores = norm_importance(G)
+
+    rows = prune_branches(
+        G, scores, args.prune_ratio, multiple=args.prune_channel_multiple
+    )
+    if args.prune_width:
+        channels, kept = prune_stream(
+            G.lr, scores, args.prune_ratio, multiple=args.prune_channel_multiple
+        )
+        rows.append(["lr", "stream", channels, kept])
+
+    logging.info(
+        f"Pruned widths ({args.prune_criterion})\n"
+        + format_table(["Block", "Branch", "Channels", "Kept"], rows)
+    )
+
+    ckpt_dir = args.ckpt_dir.with_name(f"{args.exp_name}-pruned")
+    ckpt_dir.mkdir(exist_ok=True, parents=True)
+
+    path = ckpt_dir / args.save_filename_latest_G
+    torch.save({"state_dict": G.state_dict()}, path)
+    with open(ckpt_dir / "arch.json", "w") as f:
+        json.dump(architecture(G), f, indent=4)
+    logging.info(f"Saved pruned checkpoint {path}")
+
+    # Check the checkpoint rebuilds from arch.json
+    G_pruned = get_model.model(args._replace(pruned_arch=ckpt_dir / "arch.json"))
+    G_pruned.load_state_dict(G.state_dict())
+
+    after = _summary(G_pruned.to(args.device).eval(), x_hr, args.prune_repeats)
+    logging.info(
+        f"Pruning at {x_hr.shape[-2]}x{x_hr.shape[-1]}\n"
+        + format_table(
+            ["Model", "Parameters", "Conv GMACs", "Latency (ms)"],
+            [["dense"] + before, ["pruned"] + after],
+        )
+    )
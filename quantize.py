@@ -0,0 +1,74 @@
+"""
+Quantize Script
+
+Run as:
+python quantize.py with xyz_config {other flags}
+
+Post training static int8 quantization of LRNet (see models/quantization.py),
+calibrated on the first quant_calibration_images of the val set. Saves the
+int8 checkpoint to ckpt_dir / save_filename_int8_G (used by val.py with
+int8_inference=True) and reports PSNR / SSIM / latency against fp32 on the
+remaining val images (all of them if calibration used the whole set).
+"""
+# Libraries
+from sacred import Experiment
+import logging
+
+# Torch Libs
+import torch
+
+# Modules
+from config import initialise
+from dataloader import OLEDDataset
+from models import get_model
+from models.quantization import quantize_lrnet
+from utils.benchmark import evaluate_psnr_ssim, time_fn, format_table
+from utils.train_helper import load_models
+from utils.tupperware import tupperware
+
+ex = Experiment("quantize")
+ex = initialise(ex)
+
+
+@ex.config
+def quant_config():
+    quant_repeats = 3
+
+
+@ex.automain
+def main(_run):
+    args = tupperware(_run.config)
+
+    G = get_model.model(args)
+    G, _, _, _, _ = load_models(G, g_optimizer=None, args=args, tag=args.inference_mode)
+    G = G.cpu().eval()
+
+    dataset = OLEDDataset(args, mode="val")
+    assert len(dataset), f"No val images in {args.val_source_dir}"
+
+    num_calibration = min(args.quant_calibration_images, len(dataset))
+    calibration = (dataset[i][0][None] for i in range(num_calibration))
+
+    G_int8 = quantize_lrnet(G, calibration, backend=args.quant_backend)
+
+    path = args.ckpt_dir / args.save_filename_int8_G
+    torch.save(
+        {"state_dict": G_int8.state_dict(), "quant_backend": args.quant_backend}, path
+    )
+    logging.info(f"Saved int8 checkpoint {path}")
+
+    indices = range(num_calibration, len(dataset)) or range(len(dataset))
+    x_hr = dataset[indices[0]][0][None]
+
+    rows = []
+    for name, model in [("fp32", G), ("int8 LRNet", G_int8)]:
+        psnr, ssim_ = evaluate_psnr_ssim(model, dataset, indices)
+        with torch.no_grad():
+            latency = time_fn(model, x_hr, repeats=args.quant_repeats)
+        rows.append([name, psnr, ssim_, latency])
+
+    logging.info(
+        f"Post training quantization ({len(indices)} val images, "
+        f"{num_calibration} calibration)\n"
+        + format_table(["Model", "PSNR", "SSIM", "Latency (ms)"], rows)
+    )
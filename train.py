@@ -20,12 +20,13 @@ import torch.distributed as dist
 import warnings
 
 # Modules
-from dataloader import get_dataloaders
+from dataloader import get_dataloaders, to_device
 from utils.dir_helper import dir_init
 from models import get_model
-from loss import GLoss, DLoss
+from loss import GLoss, DLoss, DistillationLoss
 from config import initialise
 from metrics import PSNR
+from utils.curriculum import TimeToPSNR, curriculum_stages, stage_at
 
 # Typing
 from typing import TYPE_CHECKING
@@ -84,7 +85,12 @@ def main(_run):
         world_size = 1
 
     # Get data
-    data = get_dataloaders(args, is_local_rank_0=is_local_rank_0)
+    data = get_dataloaders(args, is_local_rank_0=is_local_rank_0, device=rank)
+
+    # Progressive resolution curriculum, see utils/curriculum.py
+    stages = curriculum_stages(args)
+    stage = None
+    time_to_psnr = TimeToPSNR(args.curriculum_target_psnr)
 
     # Model
     G = get_model.model(args).to(rank)
@@ -131,6 +137,13 @@ def main(_run):
     # Initialise losses
     g_loss = GLoss(args).to(rank)
 
+    # Distillation from a frozen teacher, hooks go on the unwrapped student
+    distill_loss = None
+    if args.distill_teacher_ckpt:
+        teacher = get_model.teacher(args).to(rank)
+        student = G.module if args.distdataparallel else G
+        distill_loss = DistillationLoss(student, teacher, args)
+
     # Compatibility with checkpoints without global_step
     if not global_step:
         global_step = start_epoch * len(data.train_loader) * args.batch_size
@@ -144,6 +157,8 @@ def main(_run):
         "cobi_rgb_loss": 0.0,
         "train_PSNR": 0.0,
     }
+    if distill_loss is not None:
+        loss_dict.update({"distill_output_loss": 0.0, "distill_feature_loss": 0.0})
 
     metric_dict = {"PSNR": 0.0, "total_loss": 0.0}
     avg_metrics = AvgLoss_with_dict(loss_dict=metric_dict, args=args)
@@ -154,6 +169,27 @@ def main(_run):
             # Train mode
             G.train()
 
+            # New curriculum stage: train loader with its crops
+            if stage is not stage_at(stages, epoch):
+                stage = stage_at(stages, epoch)
+                if len(stages) > 1:
+                    data = get_dataloaders(
+                        args._replace(
+                            crop_size=stage.crop_size,
+                            crops_per_image=stage.crops_per_image,
+                        ),
+                        is_local_rank_0=is_local_rank_0,
+                        device=rank,
+                    )
+
+                if is_local_rank_0:
+                    time_to_psnr.begin_stage(stage, epoch)
+                    if time_to_psnr.rows:
+                        logging.info(time_to_psnr.summary())
+                    logging.info(
+                        f"Curriculum stage {stage.index} ({stage}) "
+                        f"from epoch {epoch + 1}"
+                    )
 
             if is_local_rank_0:
                 train_pbar.reset()
@@ -171,7 +207,7 @@ def main(_run):
                 loss_dict = defaultdict(float)
 
                 source, target, filename = batch
-                source, target = (source.to(rank), target.to(rank))
+                source, target = (to_device(source, rank), to_device(target, rank))
 
                 # ------------------------------- #
                 # Update Gen
@@ -180,8 +216,12 @@ def main(_run):
                 output = G(source)
 
                 g_loss(output=output, target=target)
+                total_loss = g_loss.total_loss
+
+                if distill_loss is not None:
+                    total_loss = total_loss + distill_loss(source=source, output=output)
 
-                g_loss.total_loss.backward()
+                total_loss.backward()
                 g_optimizer.step()
 
                 # Update lr schedulers
@@ -192,9 +232,12 @@ def main(_run):
                 loss_dict["train_PSNR"] += PSNR(output, target)
 
                 # Accumulate all losses
-                loss_dict["total_loss"] += g_loss.total_loss
+                loss_dict["total_loss"] += total_loss.detach()
                 loss_dict["image_loss"] += g_loss.image_loss
                 loss_dict["cobi_rgb_loss"] += g_loss.cobi_rgb_loss
+                if distill_loss is not None:
+                    loss_dict["distill_output_loss"] += distill_loss.output_loss
+                    loss_dict["distill_feature_loss"] += distill_loss.feature_loss
 
                 exp_loss += reduce_loss_dict(loss_dict, world_size=world_size)
 
@@ -285,7 +328,8 @@ def main(_run):
                         metrics_dict = defaultdict(float)
 
                         source, target, filename = batch
-                        source, target = (source.to(rank), target.to(rank))
+                        source = to_device(source, rank)
+                        target = to_device(target, rank)
 
                         output = G(source)
                         g_loss(output=output, target=target)
@@ -319,6 +363,18 @@ def main(_run):
                                 global_step,
                             )
 
+                        reached = time_to_psnr.update(
+                            avg_metrics.loss_dict["PSNR"], epoch + 1
+                        )
+                        for target_psnr, seconds in reached:
+                            logging.info(
+                                f"Val PSNR {target_psnr} dB reached after "
+                                f"{seconds:.0f} s (stage {stage.index})"
+                            )
+                            writer.add_scalar(
+                                f"Time_to_PSNR/{target_psnr}", seconds, global_step
+                            )
+
                         n = np.min([3, args.batch_size])
                         for e in range(n):
                             source_vis = source[e].mul(0.5).add(0.5)
@@ -409,7 +465,7 @@ def main(_run):
 
                     for i, batch in enumerate(data.test_loader):
                         source, filename = batch
-                        source = source.to(rank)
+                        source = to_device(source, rank)
 
                         output = G(source)
 
@@ -492,3 +548,7 @@ def main(_run):
                 is_min=True,
                 args=args,
             )
+
+    if is_local_rank_0 and stage is not None:
+        time_to_psnr.end_stage(epoch + 1)
+        logging.info(time_to_psnr.summary())
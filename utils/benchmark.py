@@ -0,0 +1,144 @@
+"""
+Helpers shared by the scripts under benchmarks/
+"""
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import resource
+import statistics
+import time
+
+import torch
+
+from metrics import PSNR_numpy
+from utils.myssim import compare_ssim as ssim
+
+# Typing
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.typing_alias import *
+
+
+def _synchronize():
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+
+def time_fn(fn, *args, warmup: int = 2, repeats: int = 10, **kwargs) -> float:
+    """
+    Median wall clock of fn(*args, **kwargs), in milliseconds.
+    """
+    for _ in range(warmup):
+        fn(*args, **kwargs)
+
+    timings = []
+    for _ in range(repeats):
+        _synchronize()
+        start = time.perf_counter()
+        fn(*args, **kwargs)
+        _synchronize()
+        timings.append((time.perf_counter() - start) * 1e3)
+
+    return statistics.median(timings)
+
+
+def conv_macs(model: "nn.Module", *inputs) -> int:
+    """
+    Multiply-accumulates of every conv run by model(*inputs): modules with a 4D
+    weight (nn.Conv2d, ShareSepConv as a depthwise conv, folded convs), from
+    their output shapes.
+    """
+    macs = []
+
+    def _hook(module, args, output):
+        macs.append(output.numel() * module.weight[0].numel())
+
+    handles = [
+        module.register_forward_hook(_hook)
+        for module in model.modules()
+        if torch.is_tensor(getattr(module, "weight", None))
+        and module.weight.dim() == 4
+    ]
+    try:
+        with torch.no_grad():
+            model(*inputs)
+    finally:
+        for handle in handles:
+            handle.remove()
+
+    return sum(macs)
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident set size of this process so far, in MB (Linux: ru_maxrss in KB).
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_in_subprocess(fn, *args, **kwargs):
+    """
+    fn(*args, **kwargs) in a fresh (spawned) process, so that its peak memory
+    is not masked by earlier measurements. fn must be importable (top level).
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(fn, *args, **kwargs).result()
+
+
+def evaluate_psnr_ssim(
+    restore: "Callable", dataset: "Dataset", indices: "Iterable[int]", device="cpu"
+) -> "Tuple[float,float]":
+    """
+    Mean PSNR and SSIM of restore over dataset[indices] (OLEDDataset, mode val),
+    on float outputs in [0, 1], without 8-bit quantization. Use these to
+    compare variants with each other. val.py's own numbers remain the
+    reference for reporting.
+    """
+    psnr, ssim_, count = 0.0, 0.0, 0
+    with torch.no_grad():
+        for i in indices:
+            source, target, _ = dataset[i]
+            output = restore(source[None].to(device))[0].float().cpu()
+
+            target_numpy = target.mul(0.5).add(0.5).permute(1, 2, 0).numpy()
+            output_numpy = output.mul(0.5).add(0.5).permute(1, 2, 0).numpy()
+
+            psnr += PSNR_numpy(target_numpy, output_numpy)
+            ssim_ += ssim(
+                target_numpy,
+                output_numpy,
+                gaussian_weights=True,
+                use_sample_covariance=False,
+                multichannel=True,
+            )
+            count += 1
+
+    return psnr / count, ssim_ / count
+
+
+def format_table(headers: "List[str]", rows: "List[List]") -> str:
+    """
+    Markdown table, floats rounded to 3 decimals (small ones in scientific notation).
+    """
+
+    def _fmt(value) -> str:
+        if not isinstance(value, float):
+            return str(value)
+        return f"{value:.3f}" if value == 0 or abs(value) >= 1e-2 else f"{value:.2e}"
+
+    rows = [[_fmt(value) for value in row] for row in rows]
+    widths = [
+        max([len(header)] + [len(row[i]) for row in rows])
+        for i, header in enumerate(headers)
+    ]
+
+    lines = [
+        "| " + " | ".join(h.ljust(w) for h, w in zip(headers, widths)) + " |",
+        "|" + "|".join("-" * (w + 2) for w in widths) + "|",
+    ]
+    lines += [
+        "| " + " | ".join(v.ljust(w) for v, w in zip(row, widths)) + " |"
+        for row in rows
+    ]
+    return "\n".join(lines)
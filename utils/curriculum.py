@@ -0,0 +1,153 @@
+"""
+Progressive resolution curriculum, aligned with CosineAnnealingWarmRestarts.
+
+Stage k spans restart cycle k (epochs [start_k, start_k + T_0 * T_mult ** k))
+and trains on crops of curriculum_crop_sizes[k]. After the listed sizes,
+training continues at crop_size (None: whole frames) until num_epochs.
+
+Every stage keeps the pixels per step of the final one: batches hold
+batch_size decoded pairs, each yielding crops_per_image crops, so smaller
+crops get proportionally more crops per image (and per decode).
+"""
+from dataclasses import dataclass
+import logging
+import time
+
+from utils.benchmark import format_table
+
+# Typing
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.typing_alias import *
+
+
+@dataclass
+class Stage:
+    index: int
+    start_epoch: int
+    end_epoch: int
+    crop_size: "Optional[Tuple[int, int]]"
+    crops_per_image: int
+
+    def __str__(self):
+        size = "x".join(map(str, self.crop_size)) if self.crop_size else "full"
+        return f"{size} x {self.crops_per_image}"
+
+
+def cycle_starts(T_0: int, T_mult: int, num_epochs: int) -> "List[int]":
+    """
+    First epoch of every warm restart cycle before num_epochs.
+    """
+    starts = [0]
+    length = T_0
+    while starts[-1] + length < num_epochs:
+        starts.append(starts[-1] + length)
+        length *= T_mult
+    return starts
+
+
+def _pixels(crop_size: "Optional[Tuple[int, int]]", args: "tupperware") -> int:
+    if crop_size:
+        return crop_size[0] * crop_size[1]
+    return args.image_height * args.image_width
+
+
+def curriculum_stages(args: "tupperware") -> "List[Stage]":
+    """
+    Stages of args.curriculum_crop_sizes (one per restart cycle), followed by
+    args.crop_size up to args.num_epochs.
+    """
+    final_crops = args.crops_per_image if args.crop_size else 1
+    budget = _pixels(args.crop_size, args) * final_crops
+
+    starts = cycle_starts(args.T_0, args.T_mult, args.num_epochs)
+    sizes = list(args.curriculum_crop_sizes)[: len(starts) - 1]
+    if len(sizes) < len(args.curriculum_crop_sizes):
+        logging.warning(
+            f"Only {len(starts)} restart cycles in {args.num_epochs} epochs, "
+            f"dropping curriculum_crop_sizes after {sizes}"
+        )
+
+    stages = []
+    for index, crop_size in enumerate(sizes + [args.crop_size]):
+        crops_per_image = final_crops
+        if index < len(sizes):
+            crop_size = tuple(crop_size)
+            crops_per_image = max(1, budget // _pixels(crop_size, args))
+
+        end = starts[index + 1] if index < len(sizes) else args.num_epochs
+        stages.append(Stage(index, starts[index], end, crop_size, crops_per_image))
+    return stages
+
+
+def stage_at(stages: "List[Stage]", epoch: int) -> "Stage":
+    for stage in stages:
+        if epoch < stage.end_epoch:
+            return stage
+    return stages[-1]
+
+
+class TimeToPSNR:
+    """
+    Wall-clock per curriculum stage, and to the first val PSNR at or above
+    each of targets (dB).
+    """
+
+    def __init__(self, targets: "List[float]"):
+        self.targets = sorted(targets)
+        self.start = time.perf_counter()
+        self.reached = {}
+        self.stage = None
+        self.stage_start = self.start
+        self.best_psnr = 0.0
+        self.rows = []
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def begin_stage(self, stage: "Stage", epoch: int):
+        if self.stage is not None:
+            self.end_stage(epoch)
+        self.stage = stage
+        self.stage_start = time.perf_counter()
+        self.best_psnr = 0.0
+
+    def end_stage(self, epoch: int):
+        """
+        :param epoch: first epoch after the stage
+        """
+        self.rows.append(
+            [
+                self.stage.index,
+                str(self.stage),
+                f"{self.stage.start_epoch + 1}-{epoch}",
+                time.perf_counter() - self.stage_start,
+                self.best_psnr,
+            ]
+        )
+
+    def update(self, psnr: float, epoch: int) -> "List[Tuple[float, float]]":
+        """
+        Record a val PSNR.
+
+        :return: (target, seconds) of targets first reached now
+        """
+        self.best_psnr = max(self.best_psnr, psnr)
+        reached = []
+        for target in self.targets:
+            if target not in self.reached and psnr >= target:
+                self.reached[target] = (self.elapsed(), epoch, self.stage.index)
+                reached.append((target, self.reached[target][0]))
+        return reached
+
+    def summary(self) -> str:
+        headers = ["Stage", "Crops", "Epochs", "Wall-clock (s)", "Best PSNR"]
+        text = "Curriculum stages\n" + format_table(headers, self.rows)
+
+        rows = [
+            [target, *self.reached.get(target, ("-", "-", "-"))]
+            for target in self.targets
+        ]
+        headers = ["Target PSNR", "Time to PSNR (s)", "Epoch", "Stage"]
+        return text + "\n" + format_table(headers, rows)
@@ -3,17 +3,60 @@ from torch.nn import functional as F
 
 
 def unpixel_shuffle(feature, r: int = 1):
-    b, c, h, w = feature.shape
-    out_channel = c * (r ** 2)
-    out_h = h // r
-    out_w = w // r
-    feature_view = feature.contiguous().view(b, c, out_h, r, out_w, r)
-    feature_prime = (
-        feature_view.permute(0, 1, 3, 5, 2, 4)
-        .contiguous()
-        .view(b, out_channel, out_h, out_w)
-    )
-    return feature_prime
+    """
+    Inverse of F.pixel_shuffle, (b, c, h, w) -> (b, c * r * r, h / r, w / r).
+
+    Same channel order as view(b, c, h / r, r, w / r, r).permute(0, 1, 3, 5, 2, 4),
+    as F.pixel_unshuffle (scriptable, exports to ONNX with dynamic h, w).
+    """
+    return F.pixel_unshuffle(feature, r)
+
+
+def space_to_batch(x: torch.Tensor, d: int) -> torch.Tensor:
+    """
+    Dilation phases of x stacked along the batch, (n, c, h, w) ->
+    (d * d * n, c, h / d, w / d): phase (i, j) (rows i::d, cols j::d) of sample
+    b at index (i * d + j) * n + b. A conv of dilation d on x is a dense conv
+    on every phase. h and w must be multiples of d.
+
+    The reshapes of unpixel_shuffle, with the phases moved to the batch.
+    """
+    n, c, h, w = x.shape
+    y = unpixel_shuffle(x, d).view(n, c, d * d, h // d, w // d)
+    return y.permute(2, 0, 1, 3, 4).reshape(d * d * n, c, h // d, w // d)
+
+
+def batch_to_space(x: torch.Tensor, d: int) -> torch.Tensor:
+    """
+    Inverse of space_to_batch, (d * d * n, c, h, w) -> (n, c, h * d, w * d).
+    """
+    b, c, h, w = x.shape
+    n = b // (d * d)
+    y = x.view(d * d, n, c, h, w).permute(1, 2, 0, 3, 4).reshape(n, c * d * d, h, w)
+    return F.pixel_shuffle(y, d)
+
+
+def box_sum(x: torch.Tensor, r: int = 1) -> torch.Tensor:
+    """
+    Sum over (2r + 1) x (2r + 1) windows (zero padded), in O(1) per pixel for
+    any radius: separable running sums (summed-area table) differenced at
+    distance 2r + 1.
+
+    Running sums grow with the frame, so they are accumulated in float64.
+
+    :param x: shape: (n, c, h, w)
+    :return: shape: (n, c, h, w), dtype of x
+    """
+    d = 2 * r + 1
+    y = F.pad(x.double(), (r + 1, r, r + 1, r))
+
+    y = y.cumsum(dim=2)
+    y = y[:, :, d:] - y[:, :, :-d]
+
+    y = y.cumsum(dim=3)
+    y = y[:, :, :, d:] - y[:, :, :, :-d]
+
+    return y.to(x.dtype)
 
 
 def sample_patches(
@@ -53,37 +96,33 @@ def sample_patches(
 
 
 def chop_patches(
-    img: torch.Tensor, patch_size_h: int = 256, patch_size_w: int = 512
+    img: torch.Tensor,
+    patch_size_h: int = 256,
+    patch_size_w: int = 512,
+    stride_h: int = None,
+    stride_w: int = None,
 ) -> torch.Tensor:
     """
+    Chop an image into (possibly overlapping) patches.
 
-    :param inputs: the input feature maps, shape: (n, c, h, w).
-    :param patch_size: the spatial size of sampled patches
-    :param stride: the stride of sampling.
-    :return: extracted patches, shape: (n, c, patch_size, patch_size, n_patches).
-    """
-    """
-    Patch sampler for feature maps.
-    Parameters
-    ---
-    inputs : torch.Tensor
-
-    patch_size : int, optional
-
-    stride : int, optional
-
-    Returns
-    ---
-    patches : torch.Tensor
+    :param img: the input image, shape: (n, c, h, w).
+    :param patch_size_h: patch height
+    :param patch_size_w: patch width
+    :param stride_h: vertical stride, defaults to patch_size_h (no overlap).
+    :param stride_w: horizontal stride, defaults to patch_size_w (no overlap).
+    :return: patches, shape: (num_h * num_w * n, c, patch_size_h, patch_size_w).
+        Patches are ordered row major over the grid, batch minor.
 
+    (h - patch_size_h) and (w - patch_size_w) must be divisible by the strides.
     """
+    stride_h = stride_h or patch_size_h
+    stride_w = stride_w or patch_size_w
+
     patches = (
-        img.unfold(2, patch_size_h, patch_size_h)
-        .unfold(3, patch_size_w, patch_size_w)
-        .contiguous()
+        img.unfold(2, patch_size_h, stride_h)
+        .unfold(3, patch_size_w, stride_w)
         .permute(2, 3, 0, 1, 4, 5)
         .flatten(start_dim=0, end_dim=2)
-        # .reshape(-1, c, patch_size_h, patch_size_w)
     )
     return patches
 
@@ -92,7 +131,7 @@ def unchop_patches(
     patches: torch.Tensor, img_h: int = 1024, img_w: int = 2048, n: int = 1
 ) -> torch.Tensor:
     """
-    Assumes non-overlapping patches
+    Inverse of chop_patches, assumes non-overlapping patches
 
     See: https://discuss.pytorch.org/t/reshaping-windows-into-image/19805
     """
@@ -100,9 +139,10 @@ def unchop_patches(
     num_h = img_h // patch_size_h
     num_w = img_w // patch_size_w
 
-    img = patches.reshape(n, num_h * num_w, patch_size_h * patch_size_w * c).permute(
-        0, 2, 1
-    )
+    # Row major over the grid, batch minor (see chop_patches)
+    img = patches.reshape(
+        num_h * num_w, n, c * patch_size_h * patch_size_w
+    ).permute(1, 2, 0)
     img = F.fold(
         img,
         (img_h, img_w),
@@ -113,6 +153,37 @@ def unchop_patches(
     )
     return img.reshape(n, c, img_h, img_w)
 
+
+def feather_window(
+    patch_size_h: int,
+    patch_size_w: int,
+    overlap_h: int = 0,
+    overlap_w: int = 0,
+    device: "torch.device" = None,
+) -> torch.Tensor:
+    """
+    Separable blending window for overlapping patches (models/tiling.py).
+
+    Linear ramp over `overlap` pixels at every edge, ones in the interior.
+    Strictly positive, so image borders (covered by a single patch) stay intact.
+
+    :return: window, shape: (patch_size_h, patch_size_w).
+    """
+
+    def _ramp(size: int, overlap: int) -> torch.Tensor:
+        ramp = torch.ones(size, device=device)
+        if overlap > 0:
+            edge = torch.arange(1, overlap + 1, device=device).float()
+            edge = edge / (overlap + 1)
+            ramp[:overlap] = edge
+            ramp[-overlap:] = edge.flip(0)
+        return ramp
+
+    window_h = _ramp(patch_size_h, overlap_h)
+    window_w = _ramp(patch_size_w, overlap_w)
+    return window_h[:, None] * window_w[None, :]
+
+
 def roll_n(X, axis, n):
     f_idx = tuple(
         slice(None, None, None) if i != axis else slice(0, n, None)
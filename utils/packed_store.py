@@ -0,0 +1,185 @@
+"""
+Pre-decoded image store: uint8 RGB images packed into memory mapped shards.
+
+Layout of a store directory (one per source dir, see store_dir):
+    shard_000.bin, shard_001.bin, ...: raw HWC uint8 RGB images, back to back
+    index.json: per sample, its name and the shard / offset / shape of its
+        source and target (None for the test set). Removed first when
+        re-packing and written last, atomically: a store with an index is
+        complete
+
+Images are read as numpy views of the memory mapped shards, no decode and no
+copy. Every process (dataloader worker) maps the shards itself, so they share
+the OS page cache: the dataset is read from disk once, not decoded per worker
+per epoch.
+"""
+import json
+import logging
+import os
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+# Typing
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from utils.typing_alias import *
+
+index_name = "index.json"
+
+
+def store_dir(source_dir: "Path") -> "Path":
+    """
+    Store of the pairs of source_dir: sibling directory {name}_packed.
+    """
+    source_dir = Path(source_dir)
+    return source_dir.with_name(f"{source_dir.name}_packed")
+
+
+def imread_rgb(path: "Path") -> "np.ndarray":
+    image = cv2.imread(str(path))
+    assert image is not None, f"Could not read {path}"
+    return np.ascontiguousarray(image[:, :, ::-1])
+
+
+class _ShardWriter:
+    def __init__(self, directory: "Path", shard_bytes: int):
+        self.directory = directory
+        self.shard_bytes = shard_bytes
+        self.shard = -1
+        self.offset = shard_bytes
+        self.file = None
+
+    def write(self, image: "np.ndarray") -> "Dict":
+        if self.offset and self.offset + image.nbytes > self.shard_bytes:
+            self.close()
+            self.shard += 1
+            self.offset = 0
+            self.file = open(self.directory / f"shard_{self.shard:03d}.bin", "wb")
+
+        self.file.write(image.tobytes())
+        entry = {"shard": self.shard, "offset": self.offset, "shape": image.shape}
+        self.offset += image.nbytes
+        return entry
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+
+def pack(
+    source_paths: "List[Path]",
+    target_paths: "List[Path]",
+    directory: "Path",
+    shard_bytes: int = 4 * 2 ** 30,
+) -> int:
+    """
+    Decode pairs (target_paths empty for the test set) into a store.
+
+    :param shard_bytes: maximum shard size (a larger image gets its own shard)
+    :return: bytes written
+    """
+    directory = Path(directory)
+    directory.mkdir(exist_ok=True, parents=True)
+
+    # No index while shards are rewritten: an interrupted re-pack leaves no
+    # store rather than a stale index over new shards
+    index_path = directory / index_name
+    if index_path.exists():
+        index_path.unlink()
+    for shard in directory.glob("shard_*.bin"):
+        shard.unlink()
+
+    writer = _ShardWriter(directory, shard_bytes)
+    samples = []
+    total = 0
+    for i, source_path in enumerate(source_paths):
+        source = imread_rgb(source_path)
+        sample = {"name": source_path.name, "source": writer.write(source)}
+        total += source.nbytes
+
+        sample["target"] = None
+        if target_paths:
+            target = imread_rgb(target_paths[i])
+            sample["target"] = writer.write(target)
+            total += target.nbytes
+
+        samples.append(sample)
+    writer.close()
+
+    # Index last, atomically
+    partial_path = directory / f"{index_name}.partial"
+    with open(partial_path, "w") as f:
+        json.dump({"shards": writer.shard + 1, "samples": samples}, f)
+    os.replace(partial_path, index_path)
+
+    logging.info(
+        f"Packed {len(samples)} samples ({total / 2 ** 30:.2f} GB) into {directory}"
+    )
+    return total
+
+
+class PackedStore:
+    """
+    Read only view of a store. Shards are mapped lazily, per process: the
+    store pickles without them, so every dataloader worker maps its own.
+    """
+
+    def __init__(self, directory: "Path"):
+        self.directory = Path(directory)
+        assert (
+            self.directory / index_name
+        ).exists(), f"No {index_name} in {self.directory}, re-run pack_dataset.py"
+        with open(self.directory / index_name) as f:
+            index = json.load(f)
+
+        self.samples = index["samples"]
+        self.num_shards = index["shards"]
+        self._shards = None
+
+        # Every shard the index points into, large enough
+        sizes = {}
+        for sample in self.samples:
+            for entry in [sample["source"], sample["target"]]:
+                if entry:
+                    h, w, c = entry["shape"]
+                    end = entry["offset"] + h * w * c
+                    sizes[entry["shard"]] = max(sizes.get(entry["shard"], 0), end)
+        for shard, size in sizes.items():
+            path = self.directory / f"shard_{shard:03d}.bin"
+            assert (
+                path.exists() and path.stat().st_size >= size
+            ), f"{path} is missing or truncated, re-run pack_dataset.py"
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_shards"] = None
+        return state
+
+    @property
+    def names(self) -> "List[str]":
+        return [sample["name"] for sample in self.samples]
+
+    def _shard(self, shard: int) -> "np.memmap":
+        if self._shards is None:
+            self._shards = [
+                np.memmap(self.directory / f"shard_{i:03d}.bin", np.uint8, mode="r")
+                for i in range(self.num_shards)
+            ]
+        return self._shards[shard]
+
+    def read(self, index: int, key: str = "source") -> "np.ndarray":
+        """
+        HWC uint8 RGB image, a (read only) view of its shard.
+
+        :param key: source or target
+        """
+        entry = self.samples[index][key]
+        h, w, c = entry["shape"]
+        start = entry["offset"]
+        return self._shard(entry["shard"])[start : start + h * w * c].reshape(h, w, c)
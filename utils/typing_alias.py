@@ -9,12 +9,17 @@ __all__ = [
     "TYPE_CHECKING",
     "Any",
     "Array",
+    "Callable",
     "Dict",
     "DataLoader",
+    "Dataset",
+    "Iterable",
     "List",
     "lr_scheduler",
     "nn.Module",
     "optim",
+    "Optional",
+    "Path",
     "SummaryWriter",
     "tupperware",
     "Tensor",
@@ -23,8 +28,9 @@ __all__ = [
 ]
 
 
-from typing import Dict, List, Any, Tuple, Union
-from torch.utils.data import DataLoader
+from typing import Callable, Dict, Iterable, List, Any, Optional, Tuple, Union
+from pathlib import Path
+from torch.utils.data import DataLoader, Dataset
 from utils.tupperware import tupperware
 from torch.utils.tensorboard import SummaryWriter
 from torch import Tensor, nn, optim
@@ -11,13 +11,15 @@ import cv2
 
 # Torch Libs
 import torch
+from torch.nn import functional as F
 from torch.utils.tensorboard import SummaryWriter
 from PerceptualSimilarity.models import PerceptualLoss
 
 # Modules
-from dataloader import get_dataloaders
+from dataloader import get_dataloaders, to_device
 from utils.tupperware import tupperware
 from models import get_model
+from models.quantization import load_quantized
 from metrics import PSNR_numpy
 from config import initialise
 
@@ -53,7 +55,7 @@ def main(_run):
     device = args.device
 
     # Get data
-    data = get_dataloaders(args)
+    data = get_dataloaders(args, device=device)
 
     # Model
     G = get_model.model(args).to(device)
@@ -74,6 +76,21 @@ def main(_run):
 
     logging.info(f"Loaded experiment {args.exp_name} trained for {start_epoch} epochs.")
 
+    if args.int8_inference:
+        assert device == "cpu", "Quantized kernels are CPU only"
+        G = load_quantized(
+            G, args.ckpt_dir / args.save_filename_int8_G, backend=args.quant_backend
+        )
+
+    if args.fuse_for_inference:
+        G.fuse_for_inference(
+            max_kernel_size=args.fuse_max_kernel_size,
+            latency_tradeoff=args.fuse_latency_tradeoff,
+        )
+
+    # Whole frame or tiled inference
+    restore = get_model.inference_fn(G, args)
+
     # Train, val and test paths
     val_path = args.output_dir / f"val_{args.inference_mode}_epoch_{start_epoch}"
     test_path = args.output_dir / f"test_{args.inference_mode}_epoch_{start_epoch}"
@@ -96,9 +113,9 @@ def main(_run):
             metrics_dict = defaultdict(float)
 
             source, target, filename = batch
-            source, target = (source.to(device), target.to(device))
+            source, target = (to_device(source, device), to_device(target, device))
 
-            output = G(source)
+            output = restore(source)
 
             if args.self_ensemble:
                 output_ensembled = [output]
@@ -106,7 +123,7 @@ def main(_run):
                 for k in ensemble_ops.keys():
                     # Forward transform
                     source_t = ensemble_ops[k][0](source)
-                    output_t = G(source_t)
+                    output_t = restore(source_t)
                     # Inverse transform
                     output_t = ensemble_ops[k][1](output_t)
 
@@ -116,6 +133,10 @@ def main(_run):
 
                 output = torch.mean(output_ensembled, dim=0, keepdim=True)
 
+            # Preview outputs are compared to the target downscaled alike
+            if output.shape[-2:] != target.shape[-2:]:
+                target = F.interpolate(target, size=output.shape[-2:], mode="area")
+
             # PSNR
             output_255 = (output.mul(0.5).add(0.5) * 255.0).int()
             output_quant = (output_255.float() / 255.0).sub(0.5).mul(2)
@@ -184,9 +205,9 @@ def main(_run):
             for i, batch in enumerate(data.test_loader):
 
                 source, filename = batch
-                source = source.to(device)
+                source = to_device(source, device)
 
-                output = G(source)
+                output = restore(source)
 
                 if args.self_ensemble:
                     output_ensembled = [output]
@@ -194,7 +215,7 @@ def main(_run):
                     for k in ensemble_ops.keys():
                         # Forward transform
                         source_t = ensemble_ops[k][0](source)
-                        output_t = G(source_t)
+                        output_t = restore(source_t)
                         # Inverse transform
                         output_t = ensemble_ops[k][1](output_t)
 